@@ -0,0 +1,53 @@
+#!/usr/bin/env python2.7
+# atomicFile.py module replaces files whole, so that readers see the old file or the new but
+#               never part of one, and stamps the version of a file so that caches and indexes
+#               kept beside it can tell when it has changed.  Shared by the ra package and src.
+
+import os, tempfile
+from contextlib import contextmanager
+
+def fileStamp(path):
+    '''
+    Identifies the version of a file: (size, mtime, inode).  Raises OSError if there is no
+    such file.
+    '''
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+@contextmanager
+def replacing(path, mode=0664):
+    '''
+    Yields the name of a temporary file beside path, to be written by name, which is renamed
+    over path when the with block ends.  The new file keeps the permissions of the one it
+    replaces, or else gets mode.  If the block raises, path is left as it was and the
+    temporary file is removed.
+    '''
+    dirName = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=dirName, prefix='.' + os.path.basename(path))
+    os.close(fd)
+    try:
+        yield tmpPath
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 07777
+        os.chmod(tmpPath, mode)
+        os.rename(tmpPath, path)
+    except:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+@contextmanager
+def atomicWrite(path, binary=False, mode=0664, buffering=-1):
+    '''
+    Yields an open file whose content replaces path when the with block ends (see
+    replacing).
+    '''
+    with replacing(path, mode) as tmpPath:
+        fileMode = 'w'
+        if binary:
+            fileMode = 'wb'
+        fileH = open(tmpPath, fileMode, buffering)
+        try:
+            yield fileH
+        finally:
+            fileH.close()
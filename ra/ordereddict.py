@@ -1,67 +1,156 @@
+
+_GONE = object()  # Holds the place of a deleted entry until the ordering is compacted
+
+
+def _new(cls):
+    '''Unpickling: makes an empty instance, to be filled by __setstate__.'''
+    return dict.__new__(cls)
+
+
 class OrderedDict(dict):
     """
     A Dictionary ADT that preserves ordering of its keys through a parallel
     list.
 
-    Inherits from the dict built-in python class, extending functionality 
+    Inherits from the dict built-in python class, extending functionality
     relevant to ordering.
+
+    Items appended to the ordering that are not keys (comments) are kept only
+    in the ordering. Deleted entries leave a placeholder that is compacted
+    away once they are half the list, so deletes need no list search. Where
+    there are many entries, their places are indexed on the first delete.
     """
 
+    __slots__ = ('_order', '_pos', '_gone')
+
     def __init__(self):
-        self.__ordering = list()
+        self._order = list()
+        self._pos = None   # key: place in _order, built when first needed
+        self._gone = 0
         dict.__init__(self)
 
 
     def __setitem__(self, key, value):
         if key not in self:
-            self.__ordering.append(key)
+            if type(key) is str:
+                key = intern(key)
+            if self._pos != None:
+                self._pos[key] = len(self._order)
+            self._order.append(key)
         dict.__setitem__(self, key, value)
-        
+
 
     def __delitem__(self, key):
+        if not dict.__contains__(self, key):
+            raise KeyError(key)
+        self._unlink(self._place(key))
         dict.__delitem__(self, key)
-        self.__ordering.remove(key)
+
+
+    def _positions(self):
+        if self._pos == None:
+            self._pos = dict()
+            for ix, item in enumerate(self._order):
+                if item is not _GONE and dict.__contains__(self, item):
+                    self._pos.setdefault(item, ix)
+        return self._pos
+
+
+    def _place(self, item):
+        '''Returns where an item is in the ordering, or raises ValueError.'''
+        if dict.__contains__(self, item) and (self._pos != None or len(self._order) > 32):
+            ix = self._positions().get(item)
+            if ix != None:
+                return ix
+        return self._order.index(item) # Short lists and comments are just searched
+
+
+    def _unlink(self, ix):
+        item = self._order[ix]
+        self._order[ix] = _GONE
+        self._gone += 1
+        if self._pos != None and self._pos.get(item) == ix:
+            del self._pos[item]
+        if self._gone > 16 and self._gone * 2 > len(self._order):
+            self._compact()
+
+
+    def _compact(self):
+        self._order = [ item for item in self._order if item is not _GONE ]
+        self._gone = 0
+        if self._pos != None:
+            self._pos = None
+            self._positions()
 
 
     def append(self, item):
-        self.__ordering.append(item)
+        if self._pos != None and dict.__contains__(self, item):
+            self._pos.setdefault(item, len(self._order))
+        self._order.append(item)
 
 
     def remove(self, item):
-        self.__ordering.remove(item)
+        self._unlink(self._place(item))
 
     def sort(self):
-        self.__ordering.sort()
+        self._compact()
+        self._order.sort()
+        self._pos = None
 
     def reorder(self, position, key):
-        if key in self.__ordering:
-            self.__ordering.remove(key)
-            self.__ordering.insert(position, key)
-        
+        try:
+            self._unlink(self._place(key))
+        except ValueError:
+            return
+        if self._gone > 0:
+            self._compact()
+        self._order.insert(position, key)
+        self._pos = None
+
     def __iter__(self):
-        for item in self.__ordering:
-            yield item
+        for item in self._order:
+            if item is not _GONE:
+                yield item
 
     def values(self):
-        return self.__ordering
-            
+        return list(self)
+
     def iterkeys(self):
         self.__iter__()
 
 
     def itervalues(self):
-        for item in self.__ordering:
+        for item in self:
             yield self[item]
 
 
     def iteritems(self):
-        for item in self.__ordering:
+        for item in self:
             yield item, self[item]
 
 
+    def __reduce__(self):
+        attrs = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            if cls is OrderedDict:
+                break
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, name):
+                    attrs[name] = getattr(self, name)
+        return (_new, (self.__class__,), (dict(self), list(self), attrs))
+
+
+    def __setstate__(self, state):
+        items, order, attrs = state
+        OrderedDict.__init__(self)
+        dict.update(self, items)
+        self._order = order
+        for name in attrs:
+            setattr(self, name, attrs[name])
+
+
     def __str__(self):
         str = ''
         for item in self.iteritems():
             str += item.__str__() + '\n'
         return str
-
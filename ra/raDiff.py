@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+# raDiff.py module compares two versions of an ra file stanza by stanza.  Each stanza's settings
+#           are hashed, so only stanzas whose hashes differ are compared setting by setting.
+#           Files are streamed: what is kept of the old file is each stanza's name, hash and
+#           place in the file, and changed stanzas are read back from it by seeking.
+#     Usage: raDiff.py [-k {key}] [-q] {old.ra} {new.ra}
+#            Exits 1 if the files differ.
+
+import sys, hashlib, argparse
+from raFile import RaFile, readBlocks
+from raIndex import RaIndex
+
+def stanzaDigest(stanza):
+    '''
+    Returns a hash of a stanza's settings, ignoring their order and any comments.
+    '''
+    return hashlib.md5('\n'.join([ key + '\t' + value \
+                                   for key, value in sorted(dict.items(stanza)) ])).digest()
+
+def fieldChanges(old, new):
+    '''
+    Returns (setting, old value, new value) for each setting that differs between two
+    stanzas, the value being None where a stanza lacks the setting.
+    '''
+    changes = [ (key, old[key], value) for key, value in new.difference(old).iteritems() ]
+    changes.extend([ (key, None, new[key]) for key in new.iterkeys() if key not in old ])
+    changes.extend([ (key, old[key], None) for key in old.iterkeys() if key not in new ])
+    return changes
+
+def diff(old, new):
+    '''
+    Yields the differences between two RaFiles, as (kind, name, detail) where kind is
+    'added' or 'removed' (detail being the stanza) or 'changed' (detail being a list of
+    fieldChanges).  Added and changed stanzas come in the new file's order.
+    '''
+    for name in new.iterkeys():
+        if name not in old:
+            yield ('added', name, new[name])
+        elif stanzaDigest(old[name]) != stanzaDigest(new[name]):
+            yield ('changed', name, fieldChanges(old[name], new[name]))
+    for name in old.iterkeys():
+        if name not in new:
+            yield ('removed', name, old[name])
+
+
+def _placedStanzas(raFile, fileH, filePath, key=None):
+    '''Yields (name, stanza, offset, length) of each stanza in an ra file, in order.'''
+    for blockName, offset, length in RaIndex(filePath).scan():
+        for stanzaName, stanza in _readBlock(raFile, fileH, offset, length, key):
+            yield stanzaName, stanza, offset, length
+
+def _readBlock(raFile, fileH, offset, length, key=None):
+    fileH.seek(offset)
+    for block in readBlocks(fileH.read(length).splitlines(True)):
+        if isinstance(block, str):
+            continue
+        testKey, name, stanza = raFile.readStanza(block, key)
+        if stanza != None and name != None:
+            yield name, stanza
+
+def _readStanza(raFile, fileH, place, name, key=None):
+    for stanzaName, stanza in _readBlock(raFile, fileH, place[0], place[1], key):
+        if stanzaName == name:
+            return stanza
+    return None
+
+def diffFiles(oldPath, newPath, key=None, raFile=None):
+    '''
+    Yields the differences between two ra files, as diff() does, without reading either
+    into memory.  Stanzas are named by key, if given, as for RaFile.  raFile is an instance
+    of the RaFile type whose readStanza should parse them.
+    '''
+    if raFile == None:
+        raFile = RaFile()
+    oldH = open(oldPath, 'rb')
+    newH = open(newPath, 'rb')
+    try:
+        olds = dict()  # name: (digest, offset, length) of the last stanza of that name
+        for name, stanza, offset, length in _placedStanzas(raFile, oldH, oldPath, key):
+            olds[name] = (stanzaDigest(stanza), offset, length)
+
+        for name, stanza, offset, length in _placedStanzas(raFile, newH, newPath, key):
+            found = olds.pop(name, None)
+            if found == None:
+                yield ('added', name, stanza)
+            elif found[0] != stanzaDigest(stanza):
+                old = _readStanza(raFile, oldH, found[1:], name, key)
+                yield ('changed', name, fieldChanges(old, stanza))
+
+        removed = sorted([ (found[1], name) for name, found in olds.iteritems() ])
+        for offset, name in removed:
+            yield ('removed', name, _readStanza(raFile, oldH, olds[name][1:], name, key))
+    finally:
+        oldH.close()
+        newH.close()
+
+
+############ command line ############
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares two versions of an ra file.')
+    parser.add_argument('-k', '--key', default=None,
+                        help='Name stanzas by this setting instead of their first line')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Only list the names of stanzas that differ')
+    parser.add_argument('old', help='Old ra file')
+    parser.add_argument('new', help='New ra file')
+    args = parser.parse_args(sys.argv[1:])
+
+    counts = { 'added': 0, 'removed': 0, 'changed': 0 }
+    marks = { 'added': '+', 'removed': '-', 'changed': '~' }
+    for kind, name, detail in diffFiles(args.old, args.new, args.key):
+        counts[kind] += 1
+        print marks[kind], name
+        if args.quiet:
+            continue
+        if kind == 'changed':
+            for setting, oldValue, newValue in detail:
+                print '    %s: %r -> %r' % (setting, oldValue, newValue)
+        else:
+            for setting, value in detail.iteritems():
+                print '    %s %s' % (setting, value)
+    print "%d added, %d removed, %d changed" % (counts['added'], counts['removed'],
+                                                counts['changed'])
+    sys.exit(1 if sum(counts.values()) > 0 else 0)
@@ -1,8 +1,54 @@
-import sys, string, os, re
+import sys, string, os, re, tempfile, bisect, multiprocessing
 from ordereddict import OrderedDict
 from raStanza import RaStanza
+from raIndex import RaIndex, parallelRanges
+from atomicFile import atomicWrite
 import collections
 
+def readBlocks(file):
+    '''
+    Yields the blocks of an open ra file in order: each stanza as a list of
+    its lines, and each comment or blank line between stanzas as a string.
+    '''
+    stanza = list()
+    for line in file:
+        stripped = line.strip()
+        if len(stanza) == 0 and (stripped.startswith('#') or stripped == ''):
+            yield line
+        elif stripped != '':
+            stanza.append(line)
+        else:
+            yield stanza
+            stanza = list()
+    if len(stanza) > 0:
+        yield stanza
+
+def _readRange(piece):
+    '''
+    Pool worker for RaFile.read: parses a byte range of an ra file as
+    _readParsed does the whole of it. Stanzas go back as plain tuples (see
+    RaStanza.toPlain), as the parent must unpickle every one of them; those
+    of a derived type go back as they are.
+    '''
+    cls, filePath, start, end, key = piece
+    file = open(filePath, 'r')
+    try:
+        file.seek(start)
+        lines = file.read(end - start).splitlines(True)
+    finally:
+        file.close()
+    raFile = cls()
+    parsed = list()
+    for block in readBlocks(lines):
+        if isinstance(block, str):
+            parsed.append(block)
+        else:
+            testKey, name, entry = raFile.readStanza(block, key)
+            if type(entry) is RaStanza:
+                entry = entry.toPlain()
+            parsed.append((testKey, name, entry))
+    return parsed
+
 class RaFile(OrderedDict):
     '''
     Stores a Ra file in a set of entries, one for each stanza in the file.
@@ -71,65 +117,202 @@ class RaFile(OrderedDict):
     possible before operating over them.
 
     Filtering allows you to eliminate a lot of code.
+
+    Ra files too large to read in can still be worked through one stanza at
+    a time, with the same where predicate applied as each stanza is read:
+        for stanza in RaFile().iterStanzas(path, where=lambda s: s['expId'] == '123'):
+            print stanza.name
+
+    Writing streams the file out stanza by stanza, to a temporary file that
+    then replaces the original, so readers never see a partial file:
+        rafile.write()
+
+    Stanzas added since the file was read or last written can be appended to
+    it without rewriting what is already there. Changes to stanzas already
+    in the file still need a full write:
+        rafile.createStanza('metaObject', 'wgEncodeNewStanza')
+        rafile.write(append=True)
+
+    Lookups on a field can be made without scanning every stanza. The first
+    query on a field builds a hash index of it, which is then kept up to date
+    as stanzas are added, replaced or deleted. To get every stanza of one
+    experiment, of some replicates, or of a family of files:
+        stanzas = rafile.query('expId', '123')
+        stanzas = rafile.query('replicate', values=['1', '2'],
+                               where=lambda s: s['fileName'].endswith('.fastq'))
+        stanzas = rafile.query('fileName', prefix='wgEncodeSydhTfbs')
+
+    Stanzas come back in the order they were added, grouped by value. A
+    stanza changed in place is not seen by the indexes until it is set again
+    (rafile[stanza.name] = stanza) or reindex() is called.
+
+    To get one stanza out of a large file without reading the file in, fetch
+    it by name. A sidecar index of where each stanza lies in the file is kept
+    beside it (see RaIndex), and rebuilt whenever the file has changed:
+        somestanza = RaFile().fetch('wgEncodeSomeStanzaName', path)
+
+    Very large files can be read by a pool of processes, each parsing a piece
+    of the file between stanzas, with the results put together in order:
+        rafile = RaFile(path, processes=8)
+    This does not scale with cores: the parent still unpickles and files
+    every stanza, about half the work of a serial read, so a pooled read is
+    at best about twice as fast.
+
+    Two versions of a file are compared with raDiff, which reports the
+    stanzas added, removed and changed (with the settings that changed):
+        for kind, name, detail in raDiff.diffFiles(oldPath, newPath):
+            print kind, name
     '''
 
     @property
     def filename(self):
         return self._filename
     
-    def __init__(self, filePath=None, key=None):
+    def __init__(self, filePath=None, key=None, processes=1):
         OrderedDict.__init__(self)
+        self._pending = None  # names added since read or written; None: never read or written
+        self._fieldIndexes = dict()  # field: (value: [names], name: value), built on first query
+        self._sortedValues = dict()  # field: sorted values, for prefix queries
         if filePath != None and os.path.isfile(filePath):
-            self.read(filePath, key)
+            self.read(filePath, key, processes)
         else:
             self._filename = filePath
         self.curStanza = None
 
-    def read(self, filePath, key=None):
+    def read(self, filePath, key=None, processes=1):
         '''
         Reads an rafile stanza by stanza, and internalizes it. Don't override
-        this for derived types, instead override readStanza.
+        this for derived types, instead override readStanza. With processes,
+        a large file is parsed in pieces by a pool of that many processes.
         '''
         self._filename = filePath
-        file = open(filePath, 'r')
-        scopes = list()
+        self._pending = None
 
-        #entry = None
-        stanza = list()
         keyValue = ''
 
-        reading = 1
-        
-        while reading:
-            line = file.readline() # get the line
-            if line == '':
-                reading = 0
-        
+        for block in self._readParsed(filePath, key, processes):
             # if its a comment or whitespace we append it to the list representation and ignore in dict
-            #line = line.strip()
-            if len(stanza) == 0 and (line.strip().startswith('#') or (line.strip() == '' and reading)):
-                OrderedDict.append(self, line)
+            if isinstance(block, str):
+                OrderedDict.append(self, block)
                 continue
 
-            if line.strip() != '':
-                stanza.append(line)
-            elif len(stanza) > 0:
-                if keyValue == '':
-                    keyValue, name, entry = self.readStanza(stanza, key)
-                else:
-                    testKey, name, entry = self.readStanza(stanza, key)
-                    if entry != None and keyValue != testKey:
-                        raise KeyError('Inconsistent Key ' + testKey)
+            testKey, name, entry = block
+            if keyValue == '':
+                keyValue = testKey
+            elif entry != None and keyValue != testKey:
+                raise KeyError('Inconsistent Key ' + testKey)
 
-                if entry != None:
-                    if name != None or key == None:
-                        if name in self:
-                            print KeyError('Duplicate Key ' + name)
-                        self[name] = entry
+            if entry != None:
+                if name != None or key == None:
+                    if name in self:
+                        print KeyError('Duplicate Key ' + name)
+                    self[name] = entry
 
-                stanza = list()
+        self._pending = list()
 
-        file.close()
+    def _readParsed(self, filePath, key=None, processes=1):
+        '''
+        Yields the comments and blank lines between stanzas, and readStanza's
+        result for each stanza, in file order.
+        '''
+        ranges = parallelRanges(filePath, processes)
+        if ranges == None:
+            file = open(filePath, 'r')
+            try:
+                for block in readBlocks(file):
+                    if isinstance(block, str):
+                        yield block
+                    else:
+                        yield self.readStanza(block, key)
+            finally:
+                file.close()
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            pieces = [ (self.__class__, filePath, start, end, key) for start, end in ranges ]
+            for parsed in pool.imap(_readRange, pieces):
+                for block in parsed:
+                    if isinstance(block, tuple) and isinstance(block[2], tuple):
+                        block = (block[0], block[1], RaStanza.fromPlain(block[2]))
+                    yield block
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def iterStanzas(self, file, key=None, where=None, scoped=False):
+        '''
+        Yields the stanzas of an ra file one at a time, without keeping them,
+        so that files too large to hold in memory can be worked through.
+
+        file: a path or an open file handle (which is left open)
+        key: as for read(), only stanzas having this key are taken, and are
+        named by it
+        where: if given, only stanzas for which where(stanza) holds are
+        yielded. As with filter, key errors are silently taken as false.
+        scoped: indented stanzas inherit the settings of the stanza above
+        them, as readStanza does when given scopes
+
+        Stanzas are parsed by readStanza, so derived types get their own. The
+        inconsistent key check of read() is made; duplicate keys are not
+        checked, as that would mean remembering every name.
+        '''
+        if isinstance(file, basestring):
+            fileH = open(file, 'r')
+        else:
+            fileH = file
+        scopes = None
+        if scoped:
+            scopes = list()
+        keyValue = ''
+        try:
+            for block in readBlocks(fileH):
+                if isinstance(block, str):
+                    continue
+                testKey, name, entry = self.readStanza(block, key, scopes)
+                if entry == None or (name == None and key != None):
+                    continue
+                if keyValue == '':
+                    keyValue = testKey
+                elif keyValue != testKey:
+                    raise KeyError('Inconsistent Key ' + testKey)
+                if where != None:
+                    try:
+                        if not where(entry):
+                            continue
+                    except KeyError:
+                        continue
+                yield entry
+        finally:
+            if fileH is not file:
+                fileH.close()
+
+    def fetch(self, name, filePath=None):
+        '''
+        Returns the named stanza, read on its own from the file (by default
+        the file this was read from) through its sidecar index, or None if
+        there is no such stanza. Indented stanzas do not inherit from their
+        parents. The stanza is not added to this RaFile.
+        '''
+        if filePath == None:
+            filePath = self.filename
+        try:
+            text = RaIndex(filePath).read(name)
+        except (IOError, OSError):
+            # No index can be kept beside the file: look through the whole of it
+            found = None
+            for stanza in self.iterStanzas(filePath, where=lambda s: s.name == name):
+                found = stanza  # The last of any duplicates, as read() keeps
+            return found
+        if text == None:
+            return None
+        for block in readBlocks(text.splitlines(True)):
+            if not isinstance(block, str):
+                testKey, stanzaName, entry = self.readStanza(block)
+                if stanzaName == name:
+                    return entry
+        return None
 
     def createStanza(self, key, value):
         self[value] = RaStanza(key, value)
@@ -137,6 +320,8 @@ class RaFile(OrderedDict):
    
     def add(self, key, value):
         self.curStanza[key] = value
+        if key in self._fieldIndexes:
+            self.reindex(self.curStanza.name)
  
     def readStanza(self, stanza, key=None, scopes=None):
         '''
@@ -152,38 +337,170 @@ class RaFile(OrderedDict):
         entry: the stanza itself
         '''
         entry = RaStanza()
-        if entry.readStanza(stanza, key, scopes) == None:
+        names = entry.readStanza(stanza, key, scopes)
+        if names == None:
             return None, None, None
-        entry = RaStanza()
-        val1, val2 = entry.readStanza(stanza, key, scopes)
-        return val1, val2, entry
+        return names[0], names[1], entry
+
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self._unindex(key)
+        elif self._pending != None:
+            self._pending.append(key)
+        OrderedDict.__setitem__(self, key, value)
+        self._index(key, value)
 
+    def __delitem__(self, key):
+        OrderedDict.__delitem__(self, key)
+        self._unindex(key)
 
-    def write(self, filename=None):
+    def _index(self, name, stanza):
+        for field in self._fieldIndexes:
+            value = stanza.get(field)
+            if value == None:
+                continue
+            byValue, byName = self._fieldIndexes[field]
+            if value in byValue:
+                byValue[value].append(name)
+            else:
+                byValue[value] = [ name ]
+                self._sortedValues.pop(field, None)
+            byName[name] = value
+
+    def _unindex(self, name):
+        for field in self._fieldIndexes:
+            byValue, byName = self._fieldIndexes[field]
+            value = byName.pop(name, None)
+            if value == None:
+                continue
+            names = byValue[value]
+            names.remove(name)
+            if len(names) == 0:
+                del byValue[value]
+                self._sortedValues.pop(field, None)
+
+    def _fieldIndex(self, field):
+        if field not in self._fieldIndexes:
+            byValue = dict()
+            byName = dict()
+            for name in self.iterkeys():
+                value = self[name].get(field)
+                if value != None:
+                    byValue.setdefault(value, []).append(name)
+                    byName[name] = value
+            self._fieldIndexes[field] = (byValue, byName)
+            self._sortedValues.pop(field, None)
+        return self._fieldIndexes[field][0]
+
+    def reindex(self, name=None):
+        '''
+        Brings the field indexes up to date after a stanza (or, by default,
+        any number of stanzas) has been changed in place.
+        '''
+        if name == None:
+            self._fieldIndexes = dict()
+            self._sortedValues = dict()
+        else:
+            self._unindex(name)
+            self._index(name, self[name])
+
+    def query(self, field, value=None, values=None, prefix=None, where=None):
+        '''
+        Returns the stanzas whose field equals value, is one of values, or
+        starts with prefix, looked up through an index of the field. If where
+        is given, only stanzas for which where(stanza) holds are returned, key
+        errors counting as false as in filter.
+        '''
+        byValue = self._fieldIndex(field)
+        if value != None:
+            found = [ value ]
+        elif values != None:
+            found = list()
+            for item in values:
+                if item not in found:
+                    found.append(item)
+        elif prefix != None:
+            if field not in self._sortedValues:
+                self._sortedValues[field] = sorted(byValue)
+            sortedValues = self._sortedValues[field]
+            found = list()
+            ix = bisect.bisect_left(sortedValues, prefix)
+            while ix < len(sortedValues) and sortedValues[ix].startswith(prefix):
+                found.append(sortedValues[ix])
+                ix += 1
+        else:
+            raise ValueError('query needs a value, values or prefix')
+
+        ret = list()
+        for item in found:
+            for name in byValue.get(item, ()):
+                stanza = self[name]
+                if where != None:
+                    try:
+                        if not where(stanza):
+                            continue
+                    except KeyError:
+                        continue
+                ret.append(stanza)
+        return ret
+
+    def write(self, filename=None, append=False):
+        '''
+        Writes the ra file out, by default to the file it was read from. The
+        whole file is written to a temporary file which is then renamed over
+        the target. With append, only the stanzas added since the file was
+        read or last written are added to the end of the target.
+        '''
         if filename == None:
             filename = self.filename
-        file = open(filename, 'w')
-        file.write(str(self))
-        
+        if append and os.path.isfile(filename):
+            self._append(filename)
+        else:
+            with atomicWrite(filename, buffering=65536) as file:
+                file.writelines(self.iterLines())
+        self._pending = list()
+
+    def _append(self, filename):
+        if self._pending == None:
+            names = list(self.iterkeys())  # Never read or written: all of it is new to the file
+        else:
+            names = [ name for name in self._pending if name in self ]
+        file = open(filename, 'r+b', 65536)
+        try:
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:  # Stanzas must be separated by a blank line
+                file.seek(max(file.tell() - 2, 0))
+                tail = file.read()
+                file.seek(0, os.SEEK_END)
+                if not tail.endswith('\n'):
+                    file.write('\n\n')
+                elif tail != '\n\n' and tail != '\n':
+                    file.write('\n')
+            for name in names:
+                file.write(self[name].__str__() + '\n')
+        finally:
+            file.close()
+
     def iter(self):
         pass
 
 
     def iterkeys(self):
-        for item in self._OrderedDict__ordering:
-            if not(item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield item
 
 
     def itervalues(self):
-        for item in self._OrderedDict__ordering:
-            if not (item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield self[item]
 
 
     def iteritems(self):
-        for item in self._OrderedDict__ordering:
-            if not (item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield item, self[item]
             else:
                 yield [item]
@@ -239,14 +556,54 @@ class RaFile(OrderedDict):
                 continue
         return ret
 
-    def __str__(self):
-        str = ''
+    def iterLines(self):
+        '''
+        Yields the lines of the ra file as they are written out.
+        '''
         for item in self.iteritems():
-            if len(item) == 1:
-                str += item[0].__str__() + '\n'
+            if len(item) == 1:  # Comments and blank lines between stanzas, as they were read
+                if item[0].endswith('\n'):
+                    yield item[0]
+                else:
+                    yield item[0] + '\n'
             else:
-                str += item[1].__str__() + '\n'
-        return str #.rsplit('\n', 1)[0]
+                yield item[1].__str__() + '\n'
 
+    def __str__(self):
+        return ''.join(self.iterLines()) #.rsplit('\n', 1)[0]
 
 
+############ command line testing ############
+if __name__ == '__main__':
+    '''
+    Command-line testing: reads an ra file, writes it out and reads it back,
+    checking that no stanza or setting is lost or changed, and that writing
+    it again gives the same text.
+        Usage: raFile.py {file.ra} [{key}]
+    '''
+    key = None
+    if len(sys.argv) > 2:
+        key = sys.argv[2]
+    original = RaFile(sys.argv[1], key)
+    fd, copyPath = tempfile.mkstemp(suffix='.ra')
+    os.close(fd)
+    try:
+        original.write(copyPath)
+        copy = RaFile(copyPath, key)
+    finally:
+        os.remove(copyPath)
+    problems = list()
+    if list(copy.iterkeys()) != list(original.iterkeys()):
+        problems.append('stanza names or their order differ')
+    for name in original.iterkeys():
+        if name in copy and list(copy[name]) != list(original[name]):
+            problems.append("stanza '" + name + "' lines differ")
+        elif name in copy and dict(copy[name]) != dict(original[name]):
+            problems.append("stanza '" + name + "' settings differ")
+    if str(copy) != str(original):
+        problems.append('writing again gives different text')
+    for problem in problems:
+        print problem
+    print "%d stanzas: round trip %s" % (len(list(original.iterkeys())),
+                                         'failed' if len(problems) > 0 else 'ok')
+    sys.exit(1 if len(problems) > 0 else 0)
@@ -0,0 +1,205 @@
+import os
+from atomicFile import atomicWrite, fileStamp
+
+INDEX_VERSION = '2'
+SEARCH_BYTES = 8192  # Narrow the binary search to this much, then read through it
+PARALLEL_MIN_BYTES = 8 * 1048576  # Smaller files are not worth parsing in pieces
+CHUNKS_PER_PROCESS = 4
+
+def splitRanges(raFile, count):
+    '''
+    Returns (start, end) byte ranges that divide an ra file into about count
+    pieces, each ending at a blank line between stanzas (not one following a
+    '\\' continuation), so that every piece can be parsed on its own.
+    '''
+    size = os.path.getsize(raFile)
+    ranges = list()
+    start = 0
+    file = open(raFile, 'rb')
+    try:
+        for ix in range(1, count):
+            file.seek(max(size * ix // count, start))
+            file.readline()
+            continued = True  # Only part of that line may have been read: don't trust its end
+            end = None
+            for line in iter(file.readline, ''):
+                stripped = line.strip()
+                if stripped == '' and not continued:
+                    end = file.tell()
+                    break
+                continued = stripped.endswith('\\')
+            if end == None or end >= size:
+                break
+            ranges.append((start, end))
+            start = end
+    finally:
+        file.close()
+    ranges.append((start, size))
+    return ranges
+
+def parallelRanges(raFile, processes):
+    '''
+    Returns the byte ranges to parse an ra file in with a pool of processes,
+    or None if it should just be read through.
+    '''
+    if processes == None or processes <= 1 or os.path.getsize(raFile) < PARALLEL_MIN_BYTES:
+        return None
+    return splitRanges(raFile, processes * CHUNKS_PER_PROCESS)
+
+def firstLineName(lines):
+    '''
+    Names a stanza as RaFile does: by the value on its first line, as it
+    stands. Returns None for a first line with no value.
+    '''
+    parts = lines[0].strip().split(None, 1)
+    if len(parts) == 2:
+        return parts[1].strip()
+    return None
+
+class RaIndex(object):
+    '''
+    A sidecar index of an ra file, kept beside it as '<file>.idx', giving the
+    byte offset and length of each stanza by the value of its first line. A
+    single stanza can then be read by seeking to it, without parsing the file:
+        text = RaIndex('wgEncodeSomeRaFile.ra').read('wgEncodeSomeStanzaName')
+
+    The index records the size, mtime and inode of the ra file it was built
+    from, and is rebuilt whenever they no longer match. Its entries are kept
+    sorted by name, so a lookup is a binary search of the index file rather
+    than a read of all of it.
+
+    Stanzas are separated by blank lines (not counting a line after a '\\'
+    continuation) and comment lines before a stanza are not part of it. Where
+    names are duplicated, the last stanza is the one found, as when the file
+    is read in full. Lookups raise IOError or OSError if the index is stale
+    and cannot be written.
+
+    A reader that names its stanzas differently (by comment-stripped logical
+    lines, say) passes its own nameOf, which is given the raw lines of a
+    stanza and returns its name, or None to leave it out. Such an index is
+    kept apart, as '<file>.<nameOf>.idx', so readers do not rebuild each
+    other's.
+    '''
+
+    def __init__(self, raFile, nameOf=None):
+        self._raFile = raFile
+        if nameOf == None:
+            self._nameOf = firstLineName
+            self._indexFile = raFile + '.idx'
+        else:
+            self._nameOf = nameOf
+            self._indexFile = raFile + '.' + nameOf.__name__ + '.idx'
+
+    @property
+    def filename(self):
+        return self._indexFile
+
+    def _stamp(self):
+        return '#raIdx %s %s %d %.6f %d\n' % ((INDEX_VERSION, self._nameOf.__name__) + \
+                                              fileStamp(self._raFile))
+
+    def isCurrent(self):
+        try:
+            file = open(self._indexFile, 'r')
+        except IOError:
+            return False
+        try:
+            return file.readline() == self._stamp()
+        finally:
+            file.close()
+
+    def scan(self):
+        '''
+        Yields (name, offset, length) of each stanza of the ra file, in order.
+        '''
+        file = open(self._raFile, 'rb')
+        try:
+            offset = 0
+            start = None
+            lines = None
+            continued = False
+            for line in file:
+                stripped = line.strip()
+                if start == None:
+                    if stripped != '' and not stripped.startswith('#'):
+                        start = offset
+                        lines = [ line ]
+                elif stripped == '' and not continued:
+                    name = self._nameOf(lines)
+                    if name != None:
+                        yield name, start, offset - start
+                    start = None
+                    lines = None
+                else:
+                    lines.append(line)
+                continued = stripped.endswith('\\')
+                offset += len(line)
+            if start != None:
+                name = self._nameOf(lines)
+                if name != None:
+                    yield name, start, offset - start
+        finally:
+            file.close()
+
+    def build(self):
+        '''
+        Writes the index, through a temporary file renamed into place. Returns
+        the number of stanzas indexed.
+        '''
+        stamp = self._stamp()
+        entries = [ (name, ix, offset, length) \
+                    for ix, (name, offset, length) in enumerate(self.scan()) ]
+        entries.sort()
+        with atomicWrite(self._indexFile, buffering=65536) as file:
+            file.write(stamp)
+            for name, ix, offset, length in entries:
+                file.write('%s\t%d\t%d\n' % (name, offset, length))
+        return len(entries)
+
+    def lookup(self, name):
+        '''
+        Returns (offset, length) of the named stanza, or None if there is none.
+        The index is built or rebuilt first if needed.
+        '''
+        if not self.isCurrent():
+            self.build()
+        file = open(self._indexFile, 'r')
+        try:
+            lo = len(file.readline())
+            file.seek(0, os.SEEK_END)
+            hi = file.tell()
+            while hi - lo > SEARCH_BYTES:
+                mid = (lo + hi) // 2
+                file.seek(mid)
+                file.readline()  # Skip to the start of the next entry
+                pos = file.tell()
+                line = file.readline()
+                if line == '' or line.rsplit('\t', 2)[0] >= name:
+                    hi = mid
+                else:
+                    lo = pos
+            file.seek(lo)
+            found = None
+            for line in file:
+                entryName, offset, length = line.rsplit('\t', 2)
+                if entryName > name:
+                    break
+                if entryName == name:
+                    found = (int(offset), int(length))
+            return found
+        finally:
+            file.close()
+
+    def read(self, name):
+        '''
+        Returns the text of the named stanza, or None if there is none.
+        '''
+        place = self.lookup(name)
+        if place == None:
+            return None
+        file = open(self._raFile, 'rb')
+        try:
+            file.seek(place[0])
+            return file.read(place[1])
+        finally:
+            file.close()
@@ -1,6 +1,6 @@
 import sys, string
 import re
-from ordereddict import OrderedDict
+from ordereddict import OrderedDict, _GONE, _new
 import collections
 
 class RaStanza(OrderedDict):
@@ -8,6 +8,8 @@ class RaStanza(OrderedDict):
     Holds an individual entry in the RaFile.
     '''
 
+    __slots__ = ('_name', '_nametype', 'parent') # Files may hold a great many stanzas
+
     @property
     def name(self):
         return self._name
@@ -23,6 +25,32 @@ class RaStanza(OrderedDict):
             self._nametype = ''
         
 
+    def toPlain(self):
+        '''
+        Returns this stanza as plain tuples, (settings, order, name, nametype),
+        which pickle and unpickle far faster than the stanza itself: pool
+        workers hand stanzas back this way. order is None unless comments
+        make it differ from the order of the settings.
+        '''
+        order = [ item for item in self._order if item is not _GONE ]
+        items = tuple([ (item, dict.__getitem__(self, item)) for item in order \
+                        if dict.__contains__(self, item) ])
+        if len(items) == len(order):
+            order = None
+        return (items, order, self._name, self._nametype)
+
+    @classmethod
+    def fromPlain(cls, plain):
+        '''
+        Makes a stanza from toPlain's tuples.
+        '''
+        items, order, name, nametype = plain
+        if order == None:
+            order = [ item[0] for item in items ]
+        entry = _new(cls)
+        entry.__setstate__((items, order, { '_name': name, '_nametype': nametype }))
+        return entry
+
     def checkIndent(self, stanza):
         indent = -1
         #print stanza
@@ -102,10 +130,11 @@ class RaStanza(OrderedDict):
         if line.startswith('#') or line == '':
             OrderedDict.append(self, line)
         else:
-            raKey = line.split(' ', 1)[0].strip()
+            parts = line.split(' ', 1)
+            raKey = parts[0].strip()
             raVal = ''
-            if (len(line.split(' ', 1)) == 2):
-                raVal = line.split(' ', 1)[1].strip()
+            if len(parts) == 2:
+                raVal = parts[1].strip()
             #if raKey in self:
                 #raise KeyError(raKey + ' already exists')
             self[raKey] = raVal
@@ -130,20 +159,20 @@ class RaStanza(OrderedDict):
         return retRa
 
     def iterkeys(self):
-        for item in self._OrderedDict__ordering:
-            if not (item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield item
 
 
     def itervalues(self):
-        for item in self._OrderedDict__ordering:
-            if not (item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield self[item]
 
 
     def iteritems(self):
-        for item in self._OrderedDict__ordering:
-            if not (item.startswith('#') or item == ''):
+        for item in self:
+            if item in self:
                 yield item, self[item]
 
 
@@ -151,13 +180,20 @@ class RaStanza(OrderedDict):
         iterkeys(self)
 
         
-    def __str__(self):
-        str = ''
+    def iterLines(self):
+        '''
+        Yields the stanza's lines as they are written out. Comments are kept
+        as they were read, newline and all.
+        '''
         for key in self:
             if key.startswith('#'):
-                str += key + '\n'
+                if key.endswith('\n'):
+                    yield key
+                else:
+                    yield key + '\n'
             else:
-                str += key + ' ' + self[key] + '\n'
+                yield key + ' ' + self[key] + '\n'
 
-        return str
 
+    def __str__(self):
+        return ''.join(self.iterLines())
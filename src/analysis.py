@@ -1,10 +1,20 @@
-import sys, os.path
-import commands
+import sys, os.path, threading
 from settings import Settings
 from stanzas import Stanzas
+import toolsDb
 from log import Log
+from process import ProcessResult, commandString, execute
+from toolCache import ToolCache
+from resultCache import ResultCache
+from resourceHistory import ResourceHistory
+from events import EventLog, EVENTS_EXT
 #from ra.raFile import RaFile
 
+# Tools DBs are read once per process, however many analyses are run (e.g. in a batch).  Load
+# them with loadToolsDb() before forking, or each child reads its own.
+_toolsDbs = {}
+_toolsDbLock = threading.Lock() # Versions may be probed concurrently
+
 class Analysis(object):
     '''
     This is the interface for an instantiation of the Encode Analysis 
@@ -24,13 +34,14 @@ class Analysis(object):
     def version(self):
         return str(self._pipelineVersion)
         
-    def __init__(self, settingsFile, analysisId=None, genome='hg19'):
+    def __init__(self, settingsFile, analysisId=None, genome='hg19', settings=None):
         '''
         Takes in a settings file which contains various paths to tools, a temp
         directory and other configuration setting for all analyses.  Optionally
         a manifest file for analysis specific details (relevant input files and 
         analysis ID) may be provided.  If no manifest file is provided, those
         details will have to be "registered" to the analysis, one by one.
+        Already read settings may be passed in to share them between analyses.
         '''
         self._pipelineVersion = 1
         self._variables       = {}
@@ -46,11 +57,17 @@ class Analysis(object):
         self.strict           = False
         self._deliveryKeys    = None
         self._toolsDb         = None
+        self._toolCache       = None
+        self._resultCache     = None
+        self._resourceHistory = None
+        self._events          = None
         self._toolsDir        = None
         self._refDir          = None
 
         self._settingsFile = os.path.abspath( settingsFile )
-        self._settings = Settings(self._settingsFile)
+        self._settings = settings
+        if self._settings == None:
+            self._settings = Settings(self._settingsFile)
         self.setupEnv()
 
         self._dryRun          = self._settings.getBoolean('dryRun',default=False)
@@ -177,6 +194,90 @@ class Analysis(object):
             self._refDir = self._refDir + '/' # normalize dirs to always end in /
         return self._refDir
     
+    @property
+    def toolCache(self):
+        '''
+        Persistent cache of tool md5sums and versions, shared by all analyses using the same
+        'toolCacheDir' setting (defaults to 'toolCache/' under the tmpDir).
+        '''
+        if self._toolCache == None:
+            cacheDir = self.getSetting('toolCacheDir','')
+            if cacheDir == '':
+                cacheDir = self.getDir('tmpDir') + 'toolCache/'
+            else:
+                cacheDir = self.getDir('toolCacheDir')
+            self._toolCache = ToolCache(cacheDir)
+        return self._toolCache
+
+    @property
+    def resultCache(self):
+        '''
+        Cache of step results shared by all analyses using the same 'resultCacheDir' setting
+        (defaults to 'resultCache/' under the tmpDir).  None when 'resultCache' is False.
+        '''
+        if self._resultCache == None:
+            if not self._settings.getBoolean('resultCache', 'True'):
+                return None
+            cacheDir = self.getSetting('resultCacheDir','')
+            if cacheDir == '':
+                cacheDir = self.getDir('tmpDir') + 'resultCache/'
+            else:
+                cacheDir = self.getDir('resultCacheDir')
+            maxGb = float(self.getSetting('resultCacheMaxGb','500'))
+            self._resultCache = ResultCache(cacheDir, int(maxGb * 1073741824),
+                                            self.toolCache.md5sum)
+        return self._resultCache
+
+    @property
+    def resourceHistory(self):
+        '''
+        Measured step usage shared by all analyses using the same 'resourceHistoryDir' setting
+        (defaults to 'resourceHistory/' under the tmpDir).  'resourceHeadroom' is the fraction
+        added to the 95th percentile of past usage when estimating what a step needs.
+        '''
+        if self._resourceHistory == None:
+            historyDir = self.getSetting('resourceHistoryDir','')
+            if historyDir == '':
+                historyDir = self.getDir('tmpDir') + 'resourceHistory/'
+            else:
+                historyDir = self.getDir('resourceHistoryDir')
+            headroom = float(self.getSetting('resourceHeadroom','0.2'))
+            self._resourceHistory = ResourceHistory(historyDir, headroom)
+        return self._resourceHistory
+
+    @property
+    def logMaxBytes(self):
+        '''
+        Step logs larger than setting 'logMaxMb' are merged into the analysis log as just their
+        head and tail, with the whole log gzipped beside it.  Default 0: merge all of it.
+        '''
+        return int(float(self.getSetting('logMaxMb','0')) * 1048576)
+
+    @property
+    def events(self):
+        '''
+        Machine readable record of step and tool runs, written next to the analysis log as
+        '{id}.events.jsonl'.  None before the analysis dir exists or if setting 'events' is False.
+        '''
+        if self._events == None and self._analysisDir != None and self.id != None:
+            if self._settings.getBoolean('events','True'):
+                self._events = EventLog(self.dir + self.id.replace(' ','') + EVENTS_EXT,
+                                        self.id)
+        return self._events
+
+    def resultKeyParts(self):
+        '''
+        Returns the (name, value) pairs of analysis settings that may change step results.
+        '''
+        parts = []
+        for name in [ 'genome', 'gender', 'readType', 'type' ]:
+            parts.append(('analysis.' + name, self.getVar(name, '')))
+        refDir = os.environ.get('EAP_REF_DIR')
+        if refDir == None or refDir == "":
+            refDir = self.getSetting('refDir','')
+        parts.append(('analysis.refDir', refDir))
+        return parts
+
     def setupEnv(self):
         '''
         Ensures the toolsDir is in the path.
@@ -244,26 +345,51 @@ class Analysis(object):
         '''
         Retrieves tool data as a dictionary from the toolDb.
         '''
+        with _toolsDbLock:
+            return self._getToolData(toolId, name)
+
+    def loadToolsDb(self):
+        '''
+        Reads the tools DB now (compiling it, or indexing it by name and version), so that
+        processes forked afterwards share it instead of each reading it again.  Returns it.
+        '''
+        with _toolsDbLock:
+            return self._loadToolsDb()
+
+    def _loadToolsDb(self):
         if self._toolsDb == None:
             toolDbFile = self.getSetting('toolDbFile','')
             if toolDbFile == '':
                 toolDbFile = self.toolsDir + 'tools.ra'
-            self._toolsDb = Stanzas(toolDbFile)
-            if self._toolsDb == None:
-                return None
+            if toolDbFile not in _toolsDbs:
+                # Compiled (beside tools.ra or else in the toolCacheDir) unless python can't
+                if toolsDb.sqlite3 != None and self._settings.getBoolean('toolDbCompiled','True'):
+                    tools = toolsDb.ToolsDb(toolDbFile, fallbackDir=self.toolCache.dir)
+                    tools.connect()  # Compiles if stale. Children reconnect, cheaply
+                else:
+                    tools = Stanzas(toolDbFile)
+                    tools.altIndex('name',unique=False)
+                    tools.setSortOrder(['name','version','toolId'])
+                _toolsDbs[toolDbFile] = tools
+            self._toolsDb = _toolsDbs[toolDbFile]
+        return self._toolsDb
+
+    def _getToolData(self, toolId, name=None):
+        if self._loadToolsDb() == None:
+            return None
+
+        if isinstance(self._toolsDb, toolsDb.ToolsDb):
+            toolData = self._toolsDb.byId(toolId)
+            if toolData == None and name != None:
+                toolData = self._toolsDb.latestByName(name)
+            return toolData
        
         toolData = self._toolsDb.getStanza(toolId)
 
         # If tool not found by id, see if it can be found by name
         if toolData == None and name != None:
-            self._toolsDb.altIndex('name',unique=False)
-            self._toolsDb.setSortOrder(['name','version','toolId'])
-            stanza = None
-            while True: # With sort order, the last shall have the latest version
-                stanza = self._toolsDb.getStanzaFromAlt(name,stanza)
-                if stanza == None:
-                    break
-                toolData = stanza
+            # With sort order, the last shall have the latest version
+            toolData = self._toolsDb.latestFromAlt(name)
         return toolData
 
     def createAnalysisDir(self):
@@ -288,7 +414,7 @@ class Analysis(object):
             
         tmpdir = self.dir + name.replace(' ','_') + '/'
         if clean and os.path.isdir(tmpdir):
-            err = os.system("rm -rf "+tmpdir)
+            err = self.runCmd(['rm','-rf',tmpdir],logOut=False,logErr=False,dryRun=False)
             os.mkdir(tmpdir)
         elif not os.path.isdir(tmpdir):
             os.mkdir(tmpdir)
@@ -306,6 +432,10 @@ class Analysis(object):
     
     def inputFile(self, name):
         return self._inputFiles[name]
+
+    def inputKeys(self):
+        '''Keys of the registered input files.'''
+        return self._inputFiles.keys()
         
     def registerInterimOutput(self, name, fileNoPath=None):
         '''
@@ -347,16 +477,16 @@ class Analysis(object):
         if dryRun == None:
             dryRun = self._dryRun
         if soft:
-            err = self.runCmd('ln -sf '+fromLoc+' '+toLoc,logOut=logOut,dryRun=dryRun,log=log)
+            err = self.runCmd(['ln','-sf',fromLoc,toLoc],logOut=logOut,dryRun=dryRun,log=log)
         else:
-            err = self.runCmd('ln -f ' +fromLoc+' '+toLoc,logOut=logOut,dryRun=dryRun,log=log)
+            err = self.runCmd(['ln','-f', fromLoc,toLoc],logOut=logOut,dryRun=dryRun,log=log)
             
         if err != 0:  
             if os.path.isdir(fromLoc): # If dir then remove old and then copy contents recursively
-                self.runCmd('rm -rf '+toLoc,logOut=logOut,dryRun=dryRun,log=log)
-                err = self.runCmd('cp -rf '+fromLoc+' '+toLoc,logOut=logOut,dryRun=dryRun,log=log)
+                self.runCmd(['rm','-rf',toLoc],logOut=logOut,dryRun=dryRun,log=log)
+                err = self.runCmd(['cp','-rf',fromLoc,toLoc],logOut=logOut,dryRun=dryRun,log=log)
             else:
-                err = self.runCmd('cp -f '+fromLoc+' '+toLoc,logOut=logOut,dryRun=dryRun,log=log)
+                err = self.runCmd(['cp','-f',fromLoc,toLoc],logOut=logOut,dryRun=dryRun,log=log)
                 
         if err != 0:
             raise Exception("Unable to ln or cp '" + fromLoc + "' to '" + toLoc + "'")
@@ -462,7 +592,7 @@ class Analysis(object):
             pass # descendent classes should consider this an exception
             
         step.log.out("'\n--- End of step ---")
-        step.log.dump( self.log.file() ) # to stdout if no runningLog
+        step.log.dump( self.log.file(), self.logMaxBytes ) # to stdout if no runningLog
         # Morgan, do you want the step log going to stdout even if there is an analysis log?
         #if self.log.file() != None:  # If analysis log, be sure to just print step log to stdout
         #    step.log.dump()
@@ -470,22 +600,36 @@ class Analysis(object):
             step.cleanup()               # Removes step.stepDir()
         else:
             self.log.out('') # skip a lineline
-            self.runCmd('ls -l ' + step.dir, dryRun=False)
+            self.runCmd(['ls','-l',step.dir], dryRun=False)
             self.log.out('')
         self.removeStep(step)  # Do we want to do this?   
         return 0
         
+    def stepCompleted(self, step):
+        '''
+        Returns True if the step completed in an earlier run and need not be run again.
+        Analyses that can resume override this.
+        '''
+        return False
+
+    def recordsSteps(self):
+        '''
+        Returns True if completed steps are recorded under their result keys, for a later run
+        to resume from.  Analyses that can resume override this.
+        '''
+        return False
+
     def onFail(self, step):
         '''
         pipeline will handle failure of logical steps like sweeping the log to the running log
         '''
         step.log.out("\n--- End of step ---")
-        step.log.dump(self.log.file()) # to stdout if no runningLog  
+        step.log.dump(self.log.file(), self.logMaxBytes) # to stdout if no runningLog  
         if self.log.file() != None:  # If analysis log, be sure to just print step log to stdout
-            step.log.dump()
+            step.log.dump(maxBytes=self.logMaxBytes)
         if self._dryRun:
             self.log.out('') # skip a lineline
-            self.runCmd('ls -l ' + step.dir, dryRun=False)
+            self.runCmd(['ls','-l',step.dir], dryRun=False)
             self.log.out('')
         retVal = step.err
         self.removeStep(step)  # Do we want to do this?   
@@ -493,31 +637,37 @@ class Analysis(object):
             retVal = 1    # Must fail!
         return retVal
         
-    def runCmd(self, cmd, logOut=True, logErr=True, dryRun=None, log=None):
+    def runProcess(self, cmd, logOut=True, logErr=True, dryRun=None, log=None, stdout=None,
+                   started=None):
         '''
-        Runs the provided command and returns error code.  Does NOT trigger onFail.
+        Runs the provided command (argument list or string) and returns a ProcessResult holding
+        the exit status, wall time, cpu and peak memory.  Does NOT trigger onFail.
         Note that you can pass in a log object if you don't want to use the analysis log.
+        Pass stdout=fileName rather than using a shell '>' redirect.
+        Pass started=callback(proc) to be able to kill the command (see ToolFuture).
         '''
         if dryRun == None:
             dryRun=self._dryRun
         if log == None:
             log = self.log
         if logOut or logErr:
+            cmdLine = commandString(cmd)
+            if stdout != None:
+                cmdLine += ' > ' + stdout
             if dryRun:
-                log.out('*> ' + cmd)
+                log.out('*> ' + cmdLine)
             else:
-                log.out('> ' + cmd)  # Always log command itself
+                log.out('> ' + cmdLine)  # Always log command itself
         if dryRun:
-            return 0
-        log.close()  # Ensure log is closed so that command redirect can be tacked on
-        logFile = log.file()
-        if logFile != None and logOut and logErr:
-            err = os.system(cmd + ' >> ' + logFile + ' 2>&1')
-        elif logFile != None and logErr:
-            err = os.system(cmd + ' 2>>' + logFile)
-        else:
-            err = os.system(cmd)
-        return err
+            return ProcessResult(cmd)
+        return execute(cmd, log=log, logOut=logOut, logErr=logErr, stdout=stdout, started=started)
+
+    def runCmd(self, cmd, logOut=True, logErr=True, dryRun=None, log=None, stdout=None):
+        '''
+        Runs the provided command and returns error code.  Does NOT trigger onFail.
+        Note that you can pass in a log object if you don't want to use the analysis log.
+        '''
+        return self.runProcess(cmd, logOut, logErr, dryRun, log, stdout).status
         
     def getCmdOut(self, cmd, dryRun=None, logCmd=True, logResult=False, default='', log=None, errOk=False):
         '''
@@ -529,14 +679,15 @@ class Analysis(object):
         if log == None:
             log = self.log
         if logCmd:
-            log.out('> ' + cmd)
+            log.out('> ' + commandString(cmd))
         if dryRun:
             return default
-        err, out = commands.getstatusoutput(cmd)
+        result = execute(cmd, capture=True)
+        out = result.output
         if logResult:
             log.out(out)
-        if err != 0 and not errOk:
-            raise Exception("Running [" + cmd + "] returned '" + str(err))
+        if result.status != 0 and not errOk:
+            raise Exception("Running [" + commandString(cmd) + "] returned '" + str(result.status))
         if len(out) == 0:
             out = default
         return out
@@ -588,10 +739,10 @@ if __name__ == '__main__':
 
     # show that both logs are working but have yet to be combined
     print '\n..... Current contents of running log (no step log!):'
-    os.system('cat ' + e3.log.file())
+    e3.log.dump()
     print '...................................................'
     print '\n..... Current contents of step log:'
-    os.system('cat ' + stepLog.file())
+    stepLog.dump()
     print '...................................................'
     
     # end the stepLog as a logical step might
@@ -600,7 +751,7 @@ if __name__ == '__main__':
     os.system('rm -rf ' + stepDir) # This will be done in logicalStep.cleanup()
     e3.log.out('--- End running log ---')
     print '\n..... Current contents of running log (includes step log):'
-    os.system('cat ' + e3.log.file())
+    e3.log.dump()
     print '...................................................'
 
     # Restart the running log.  Really this is expected to be called at the start, not the end.
@@ -615,7 +766,7 @@ if __name__ == '__main__':
         pass
     e3.getCmdOut('ls -l '+ analysisDir,logResult=True)
     print '\n..... Contents of new running log:'
-    os.system('cat ' + e3.log.file())
+    e3.log.dump()
     print '...................................................'
     
     # Not testing:
@@ -0,0 +1,108 @@
+#!/usr/bin/env python2.7
+# batchAnalysis.py module holds BatchAnalysis class which runs many EncodeAnalyses in one process.
+#                  The settings and tools DB are read once, before any step is forked, and the
+#                  step graphs of every analysis are run by a single LocalExecutor that shares
+#                  the node fairly between them.
+#                  Manifests are given as a directory of manifest files, or as a tab separated
+#                  table: either one manifest file path per line, or a header line of manifest
+#                  keys followed by one line of values per analysis.
+
+import os, time
+from src.settings import Settings
+from src.encodeAnalysis import EncodeAnalysis
+from src.localExecutor import LocalExecutor
+from src.log import Log
+
+def readManifests(manifestsPath):
+    '''
+    Returns a list of (label, manifest) pairs, where a manifest is either a file path or a dict.
+    '''
+    if os.path.isdir(manifestsPath):
+        names = sorted([ name for name in os.listdir(manifestsPath) if not name.startswith('.') ])
+        return [ (name, os.path.join(manifestsPath, name)) for name in names \
+                 if os.path.isfile(os.path.join(manifestsPath, name)) ]
+
+    manifests = []
+    header = None
+    tableFile = open(manifestsPath, 'r')
+    for line in tableFile:
+        line = line.rstrip('\n')
+        if line.strip() == '' or line.startswith('#'):
+            continue
+        columns = line.split('\t')
+        if header == None and len(columns) == 1:   # Just a list of manifest files
+            path = columns[0].strip()
+            if not os.path.isabs(path):
+                path = os.path.join(os.path.dirname(os.path.abspath(manifestsPath)), path)
+            manifests.append((os.path.basename(path), path))
+        elif header == None:
+            header = [ column.strip() for column in columns ]
+        else:
+            manifest = Settings()
+            for ix in range(min(len(header), len(columns))):
+                if columns[ix].strip() != '':
+                    manifest[header[ix]] = columns[ix].strip()
+            manifests.append((manifest.get('expName', str(len(manifests) + 1)), manifest))
+    tableFile.close()
+    return manifests
+
+
+class BatchAnalysis(object):
+    '''
+    Runs the pipelines of many manifests through one scheduler.
+    Settings 'localCpus' and 'localRamGb' limit what the whole batch may use on this node
+    (default: all of it) and 'batchMaxSteps' limits how many steps run at once (default: no
+    limit beyond cpus and ram).
+    '''
+
+    def __init__(self, settingsFile, manifestsPath, resume=0):
+        self._settingsFile = os.path.abspath(settingsFile)
+        self.settings = Settings(self._settingsFile) # Read once, shared by all analyses
+        self.log = Log()
+        self.analyses = []
+        self.problems = []   # (label, message) of manifests that could not be set up
+        self.graphRuns = []
+        for label, manifest in readManifests(manifestsPath):
+            try:
+                analysis = EncodeAnalysis(self._settingsFile, manifest, resume,
+                                          settings=self.settings)
+                if analysis.pipeline == None:
+                    raise Exception("No pipeline for dataType '" + analysis.dataType + "'")
+                analysis.loadToolsDb()  # Shared with the steps forked from here
+                self.analyses.append(analysis)
+            except Exception as e:
+                self.problems.append((label, str(e)))
+
+    def start(self):
+        '''Runs every analysis.  Returns the number that did not succeed.'''
+        cpus = int(self.settings.get('localCpus', '0'))
+        ram = long(float(self.settings.get('localRamGb', '0')) * 1073741824)
+        maxRunning = int(self.settings.get('batchMaxSteps', '0'))
+        executor = LocalExecutor(cpus, ram, self.log)
+
+        graphs = []
+        names = []
+        for analysis in self.analyses:
+            analysis.createAnalysisDir()
+            analysis.pipeline.running = True
+            graphs.append(analysis.pipeline.getStepGraph())
+            names.append(analysis.id)
+        self.log.out("# Batch of " + str(len(graphs)) + " analyses on [cpus:%d ram:%.1fGB]" % \
+                     (executor.cpus, executor.ram / 1073741824.0))
+        self.graphRuns = executor.runBatch(graphs, names, maxRunning)
+        self.log.out(self.summary())
+        return len(self.problems) + \
+               len([ graphRun for graphRun in self.graphRuns if graphRun.status != 'Succeeded' ])
+
+    def summary(self):
+        '''Returns a table of each analysis' status, steps completed and duration.'''
+        lines = [ "%-32s %-10s %9s  %-10s %s" % ('analysis', 'status', 'steps', 'duration',
+                                                 'failed steps') ]
+        for graphRun in self.graphRuns:
+            duration = time.strftime("%H:%M:%S", time.gmtime(graphRun.duration))
+            lines.append("%-32s %-10s %4d/%-4d  %-10s %s" % (graphRun.name, graphRun.status,
+                         len(graphRun.done), len(graphRun.graph.steps), duration,
+                         ','.join([ step.name for step in graphRun.failed ])))
+        for label, message in self.problems:
+            lines.append("%-32s %-10s %9s  %-10s %s" % (label, 'Invalid', '-', '-', message))
+        return '\n'.join(lines)
@@ -1,18 +1,28 @@
-import os, subprocess, shutil
-from jobTree.scriptTree.target import Target
-from jobTree.scriptTree.stack import Stack
+import os, shutil, json
+from datetime import datetime
+try:
+    from jobTree.scriptTree.stack import Stack
+except ImportError:
+    Stack = None # Without jobTree, only the local executor can be used
 #from ra.raFile import RaFile
 from src.analysis import Analysis
 from src.settings import Settings
+from src.resultCache import treeSize
+from ra.atomicFile import atomicWrite
+from src.localExecutor import LocalExecutor
 from src.pipelines.dnasePipeline import DnasePipeline
 
 class EncodeAnalysis(Analysis):
     
-    def __init__(self, settingsFile, manifestFile, resume=0):
+    def __init__(self, settingsFile, manifestFile, resume=0, settings=None):
 
-        manifest = Settings(manifestFile)
+        # The manifest may already be read (e.g. a row of a batch table)
+        if isinstance(manifestFile, dict):
+            manifest = manifestFile
+        else:
+            manifest = Settings(manifestFile)
     
-        Analysis.__init__(self, settingsFile, manifest['expName'])
+        Analysis.__init__(self, settingsFile, manifest['expName'], settings=settings)
 
         self.resume = resume
         
@@ -54,8 +64,11 @@ class EncodeAnalysis(Analysis):
         """
         probably need one of these in experiment
         """
-        if self.resume == 0:
-            self.createAnalysisDir()
+        self.createAnalysisDir() # On resume, completed steps found there are skipped
+        if self.getSetting('executor', 'jobTree').lower() == 'local':
+            return self.startLocal()
+        if Stack == None:
+            raise Exception("jobTree is not installed.  Set 'executor local' in the settings.")
         stack = Stack(self.pipeline)
         options = stack.getDefaultOptions()
         options.jobTree = self.dir + 'jobTreeRun'
@@ -68,6 +81,22 @@ class EncodeAnalysis(Analysis):
         print 'starting jobTree'
         i = stack.startJobTree(options)
         print "success!!!"
+
+    def startLocal(self):
+        '''
+        Runs the pipeline on this node with the LocalExecutor, rather than with jobTree.
+        Settings 'localCpus' and 'localRamGb' limit what it may use (default: the whole node).
+        '''
+        cpus = int(self.getSetting('localCpus', '0'))
+        ram = long(float(self.getSetting('localRamGb', '0')) * 1073741824)
+        executor = LocalExecutor(cpus, ram, self.log)
+        self.loadToolsDb()  # Shared with the steps forked from here
+        self.pipeline.running = True
+        failed = executor.run(self.pipeline.getStepGraph())
+        if len(failed) > 0:
+            raise Exception("Failed steps: " + ', '.join([ step.name for step in failed ]) + \
+                            ".  Not run: " + ', '.join([ step.name for step in executor.notRun ]))
+        print "success!!!"
     
     def onFail(self, step):
         self.pipeline.stop()
@@ -86,13 +115,18 @@ class EncodeAnalysis(Analysis):
     def createAnalysisDir(self):
         Analysis.createAnalysisDir(self)
         self.interimDir = self.dir + 'interim/'
-        os.mkdir(self.interimDir)
+        if not os.path.isdir(self.interimDir):
+            os.mkdir(self.interimDir)
         self.targetDir = self.dir + 'target/'
-        os.mkdir(self.targetDir)
+        if not os.path.isdir(self.targetDir):
+            os.mkdir(self.targetDir)
         
     def deliverFiles(self, step):
+        '''Delivers a step's files.  Returns a dict of delivered paths keyed by file key.'''
         subDir = self.dir + step.name + '_submit/'
-        os.mkdir(subDir)
+        if not os.path.isdir(subDir): # May be rerunning a step
+            os.mkdir(subDir)
+        delivered = {}
     
         for k in step.interimFiles:
             if not os.path.exists(step.interimFiles[k]):
@@ -100,7 +134,8 @@ class EncodeAnalysis(Analysis):
             splits = k.split('/')
             localName = splits[len(splits) - 1]
             #os.rename(step.interimFiles[k], self.interimDir + localName)
-            err = self.runCmd('mv {old} {to}'.format(old=step.interimFiles[k], to=self.interimDir + localName), dryRun=False, log=step.log)
+            err = self.runCmd(['mv', step.interimFiles[k], self.interimDir + localName], dryRun=False, log=step.log)
+            delivered[k] = self.interimDir + localName
         if len(step.targetFiles) > 0:
             #md = step.createMetadataFile('files')
             for k in step.targetFiles:
@@ -109,8 +144,9 @@ class EncodeAnalysis(Analysis):
                 splits = k.split('/')
                 localName = splits[len(splits) - 1]
                 #os.rename(step.targetFiles[k], self.targetDir + localName)
-                err = self.runCmd('mv {old} {to}'.format(old=step.targetFiles[k], to=self.targetDir + localName), dryRun=False, log=step.log)
-                err = self.runCmd('cp {old} {to}'.format(old=self.targetDir + localName, to=subDir + localName), dryRun=False, log=step.log)
+                err = self.runCmd(['mv', step.targetFiles[k], self.targetDir + localName], dryRun=False, log=step.log)
+                err = self.runCmd(['cp', self.targetDir + localName, subDir + localName], dryRun=False, log=step.log)
+                delivered[k] = self.targetDir + localName
                 #shutil.copy(self.targetDir + localName, subDir + localName)
                 
                 # TODO: relevant metadata needs to be put into the steps
@@ -129,11 +165,101 @@ class EncodeAnalysis(Analysis):
         #    fp = open(subDir + step.name + '.json', 'w')
         #    json.dump(step.json, fp, sort_keys=True, indent=4, separators=(',', ': '))
         #    fp.close()
+        return delivered
+
+    def recordsSteps(self):
+        '''Completed steps are recorded, so that a resumed run can skip them.'''
+        return True
+
+    def stepRecordFile(self, step):
+        '''Completion record of a step, written when its files are delivered.'''
+        return self.dir + 'completed/' + step.name.replace(' ','_') + '.json'
+
+    def writeStepRecord(self, step, delivered):
+        '''
+        Records that a step completed: its result key, the md5sums of its inputs and the size
+        and md5sum of each file it delivered.  Written atomically, so a record is either whole
+        or absent.  Steps without a result key can't be validated later, so get no record:
+        they are always rerun on resume (see stepCompleted).
+        '''
+        if self.dryRun or step.resultKeyUsed == None:
+            return
+        record = { 'step': step.name, 'class': step.__class__.__name__,
+                   'version': step.version, 'resultKey': step.resultKeyUsed,
+                   'completed': datetime.now().strftime("%Y-%m-%d %X"),
+                   'inputs': {}, 'outputs': {} }
+        for key in step.inputKeys():
+            path = self.getFile(key)
+            record['inputs'][key] = { 'path': path, 'md5sum': self.toolCache.md5sum(path) }
+        for key in delivered.keys():
+            if not step.isOwnResult(key):
+                continue # e.g. versions.ra, which every step delivers
+            path = delivered[key]
+            if os.path.isdir(path):
+                record['outputs'][key] = { 'path': path, 'size': treeSize(path), 'md5sum': '' }
+            else:
+                record['outputs'][key] = { 'path': path, 'size': os.path.getsize(path),
+                                           'md5sum': self.toolCache.md5sum(path) }
+        recordFile = self.stepRecordFile(step)
+        recordDir = os.path.dirname(recordFile)
+        if not os.path.isdir(recordDir):
+            try:
+                os.makedirs(recordDir)
+            except OSError:
+                pass # Another step just made it
+        with atomicWrite(recordFile) as fp:
+            json.dump(record, fp, sort_keys=True, indent=4, separators=(',', ': '))
+
+    def stepCompleted(self, step):
+        '''
+        When resuming, returns True if the step's completion record is still valid: the step,
+        its tools and inputs are unchanged (same result key) and every delivered file is still
+        there with the same size and md5sum.  Because this is checked as each step is about to
+        run, steps downstream of a rerun step are rerun whenever their inputs actually changed.
+        '''
+        if self.resume == 0 or self.dryRun:
+            return False
+        try:
+            resultKey = step.resultKey()
+        except Exception:
+            resultKey = None
+        if resultKey == None:  # Not cacheable, or an input is missing
+            self.log.out("# Step '" + step.name + "' must be rerun: without a result key " + \
+                         "its earlier results cannot be validated")
+            return False
+        recordFile = self.stepRecordFile(step)
+        try:
+            fp = open(recordFile, 'r')
+            record = json.load(fp)
+            fp.close()
+        except (IOError, ValueError):
+            return False
+        valid = (resultKey == record.get('resultKey'))
+        for output in record.get('outputs', {}).values():
+            if not valid:
+                break
+            path = output['path']
+            if not os.path.exists(path):
+                valid = False
+            elif os.path.isdir(path):
+                valid = (treeSize(path) == output['size'])
+            else:
+                valid = (os.path.getsize(path) == output['size'] and \
+                         self.toolCache.md5sum(path) == output['md5sum'])
+        if not valid:
+            os.remove(recordFile) # Stale: the step will run again
+            self.log.out("# Step '" + step.name + "' must be rerun: its completion record " + \
+                         "is no longer valid")
+            return False
+        self.log.out("# Step '" + step.name + "' completed " + record['completed'] + \
+                     ": skipped on resume")
+        return True
     
     def onSucceed(self, step):
-        self.deliverFiles(step)
+        delivered = self.deliverFiles(step)
+        self.writeStepRecord(step, delivered)
         step.log.out("'\n--- End of step ---")
-        step.log.dump( self.log.file() )
+        step.log.dump( self.log.file(), self.logMaxBytes )
         #step.cleanup()
     
     def onRun(self, step):
@@ -141,28 +267,4 @@ class EncodeAnalysis(Analysis):
         versions.createStanza('pipeline', self.pipeline.version)
         versions.add(step.name, step.version)
         step.writeVersions(versions)
-        
-    
-    def runCmd2(self, cmd, logOut=True, logErr=True, dryRun=None, log=None):
-        if log == None:
-            log = self.log
-        
-        log.out('> ' + cmd)
-        #log.close()
-        
-        if dryRun:
-            return
-        
-        stdout = None
-        outfile = None
-        if '>' in cmd:
-            splits = cmd.split('>')
-            cmd = splits[0].strip()
-            stdout = splits[1].strip()
-            outfile = open(stdout, 'w')
-        
-            
-        result = subprocess.call(cmd, stdout=outfile, stderr=log._log)
-        #self.log('process completes with exit code ' + str(result))
 
-        return result
@@ -0,0 +1,157 @@
+#!/usr/bin/env python2.7
+# events.py module holds EventLog class which writes a machine readable record of an analysis
+#           alongside its log: one json object per line for each step start and end and each
+#           granular tool start and end, with times, exit codes, cpu, memory, block i/o and
+#           file sizes.  Also summarizes the events of many analyses, so that it can be seen
+#           which tool in which step is getting slower.
+#     Usage: events.py [--by tool|step] [--match {name}] {eventsFile or dir}...
+#            Directories are searched for '*.events.jsonl' files.
+
+import os, sys, json, time, socket, argparse
+from resourceHistory import percentile
+
+EVENTS_EXT = '.events.jsonl'
+
+class EventLog(object):
+    '''
+    Appends events to a json lines file.  Each event is a single O_APPEND write, so steps
+    running in other processes may share the file.  Failure to write is not an error.
+    '''
+
+    def __init__(self, eventsFile, analysisId=None):
+        self._eventsFile = eventsFile
+        self._analysisId = analysisId
+        self._host = socket.gethostname()
+
+    def file(self):
+        return self._eventsFile
+
+    def emit(self, event, at=None, **fields):
+        '''Writes one event.  'at' is when it happened (epoch seconds), default now.'''
+        if at == None:
+            at = time.time()
+        fields['event'] = event
+        fields['time'] = round(at, 3)
+        fields['analysis'] = self._analysisId
+        fields['host'] = self._host
+        fields['pid'] = os.getpid()
+        line = json.dumps(fields, sort_keys=True) + '\n'
+        try:
+            fd = os.open(self._eventsFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0664)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except (IOError, OSError):
+            pass
+
+
+def fileSizes(files):
+    '''Returns a dict of the sizes of files (given as a dict of key: path) that exist.'''
+    sizes = {}
+    for key in files.keys():
+        path = files[key].rstrip('/')
+        try:
+            if os.path.isdir(path):
+                sizes[key] = sum([ os.path.getsize(os.path.join(root, name)) \
+                                   for root, dirs, names in os.walk(path) for name in names ])
+            else:
+                sizes[key] = os.path.getsize(path)
+        except OSError:
+            continue
+    return sizes
+
+def eventFiles(paths):
+    '''Returns the events files named, or found under the directories named.'''
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            found.extend([ os.path.join(root, name) for name in sorted(names) \
+                           if name.endswith(EVENTS_EXT) ])
+    return found
+
+def readEvents(paths):
+    '''Yields the events in files or directories, skipping partial lines.'''
+    for path in eventFiles(paths):
+        try:
+            fileH = open(path, 'r')
+        except IOError:
+            continue
+        try:
+            for line in fileH:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        finally:
+            fileH.close()
+
+def summarize(events, by='tool', match=None):
+    '''
+    Returns a dict, keyed by tool (as 'step/tool') or step class, of lists of ended runs:
+    (wall seconds, cpu seconds, maxRss bytes, bytes read, bytes written, failed).  For steps
+    the bytes are the sizes of the files declared as inputs and outputs.  Tools declare no
+    files, so for them the bytes are block i/o, which leaves out reads served from the page
+    cache and counts writes only when they reach the disk.
+    '''
+    runs = {}
+    for event in events:
+        if by == 'tool' and event.get('event') == 'toolEnd':
+            name = str(event.get('stepClass', '')) + '/' + str(event.get('tool', ''))
+            bytesIn = event.get('blockBytesRead', event.get('bytesRead', 0))
+            bytesOut = event.get('blockBytesWritten', event.get('bytesWritten', 0))
+        elif by == 'step' and event.get('event') == 'stepEnd' and not event.get('restored'):
+            name = str(event.get('stepClass', ''))
+            bytesIn = sum(event.get('inputSizes', {}).values())
+            bytesOut = sum(event.get('outputSizes', {}).values())
+        else:
+            continue
+        if match != None and name.find(match) == -1:
+            continue
+        runs.setdefault(name, []).append((event.get('wall', 0.0), event.get('cpuTime', 0.0),
+                                          event.get('maxRss', 0), bytesIn, bytesOut,
+                                          event.get('exitCode', 0) != 0))
+    return runs
+
+def report(runs, by='tool'):
+    '''
+    Returns lines of per name run counts, wall time percentiles and throughput: of the files
+    read and written by steps, but only of block i/o by tools (see summarize).
+    '''
+    rate = 'MB/s'
+    if by == 'tool':
+        rate = 'blkMB/s'
+    lines = [ "%-40s %5s %5s %9s %9s %11s %11s %9s" % ('name', 'runs', 'fail', 'p50 wall',
+              'p95 wall', 'p50 ' + rate, 'p5 ' + rate, 'p95 rssMB') ]
+    for name in sorted(runs.keys()):
+        ended = [ run for run in runs[name] if not run[5] ]
+        failed = len(runs[name]) - len(ended)
+        if len(ended) == 0:
+            lines.append("%-40s %5d %5d" % (name, len(runs[name]), failed))
+            continue
+        walls = [ run[0] for run in ended ]
+        # Throughput of everything read and written, per second of wall time
+        rates = [ (run[3] + run[4]) / 1048576.0 / run[0] for run in ended if run[0] > 0 ]
+        if len(rates) == 0:
+            rates = [ 0.0 ]
+        lines.append("%-40s %5d %5d %8.1fs %8.1fs %11.1f %11.1f %9.0f" % (name, len(runs[name]),
+                     failed, percentile(walls, 50), percentile(walls, 95),
+                     percentile(rates, 50), percentile(rates, 5),
+                     percentile([ run[2] for run in ended ], 95) / 1048576.0))
+    return lines
+
+
+############ command line ############
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarizes the events of many analyses.')
+    parser.add_argument('--by', choices=['tool', 'step'], default='tool',
+                        help='Summarize granular tools (default) or whole steps')
+    parser.add_argument('--match', default=None, help='Only names containing this')
+    parser.add_argument('paths', nargs='+', help='Events files, or directories holding them')
+    args = parser.parse_args(sys.argv[1:])
+
+    for line in report(summarize(readEvents(args.paths), args.by, args.match), args.by):
+        print line
@@ -0,0 +1,38 @@
+#!/usr/bin/env python2.7
+# fileLock.py module holds FileLock class: an exclusive lock on a lock file, held for the
+#             length of a 'with' block, so that separate processes (e.g. concurrent galaxy jobs
+#             of one analysis) take turns.  POSIX locks are used as they work over NFS.  They are
+#             released if the process dies, so a stale lock file never blocks anyone.
+
+import os, errno, fcntl
+
+class FileLock(object):
+    '''
+    with FileLock(path): ...  Only one process at a time is within the block.
+    '''
+
+    def __init__(self, lockFile):
+        self._lockFile = lockFile
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self._lockFile, os.O_RDWR | os.O_CREAT, 0664)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        except IOError as e:
+            if e.errno not in [ errno.ENOLCK, errno.EOPNOTSUPP, errno.EINVAL ]:
+                os.close(self._fd)
+                self._fd = None
+                raise
+            # No locks on this file system: go ahead unguarded, as was always done
+        return self
+
+    def __exit__(self, excType, excValue, trace):
+        if self._fd != None:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            except IOError:
+                pass
+            os.close(self._fd)
+            self._fd = None
+        return False
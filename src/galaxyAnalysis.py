@@ -16,9 +16,15 @@
 #               in a series of workFlow steps.  This may be necessary as data becomes 
 #               available at different times or replicates fail and need to be replaced.
 #               In galaxy the processing is kicked off manually, not simply when data arrives.
+#               Jobs of one analysis may be run at the same time (e.g. replicate workflows), so
+#               each job writes its own segment of the analysis log, and the whole log is merged
+#               from the segments when wanted.
 
-import os,sys
+import os,sys,time,errno,socket,glob
 from src.analysis import Analysis
+from src.log import Log, mergeLogs
+from src.fileLock import FileLock
+from src.process import execute
 
 class GalaxyAnalysis(Analysis):
     '''
@@ -58,18 +64,53 @@ class GalaxyAnalysis(Analysis):
             return self._analysisDir
             
         if self._stayWithinGalaxy:
-            self._analysisDir = os.getcwd() # Override the Analysis class version for this
-            if not self._analysisDir.endswith('/'):
-                self._analysisDir = self._analysisDir + '/'
+            parentDir = os.getcwd() # Override the Analysis class version for this
+            if not parentDir.endswith('/'):
+                parentDir = parentDir + '/'
         else:
-            self._analysisDir = self.getDir('tmpDir')
-        self._analysisDir = self._analysisDir + self.id.replace(' ','_') + '/'
-        if not os.path.isdir(self._analysisDir):
-            try:
-                os.makedirs(self._analysisDir)
-            except:
-                pass       # Race condition!
+            parentDir = self.getDir('tmpDir')
+        analysisDir = parentDir + self.id.replace(' ','_') + '/'
+        if not os.path.isdir(analysisDir + 'logs/'):
+            if not os.path.isdir(parentDir):
+                try:
+                    os.makedirs(parentDir)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            # Other jobs of this analysis may be starting too
+            with FileLock(parentDir + '.' + self.id.replace(' ','_') + '.lock'):
+                if not os.path.isdir(analysisDir + 'logs/'):
+                    os.makedirs(analysisDir + 'logs/')
+        self._analysisDir = analysisDir
         return self._analysisDir
+
+    def declareLogFile(self, name=None):
+        '''
+        Declares this job's segment of the analysis log: 'logs/{name}.{time}.{host}.{pid}.log'
+        in the analysis dir.  Concurrent jobs never append to the same file.  See mergeLogs().
+        '''
+        if self.log != None and self.log.file() != None:
+            return self.log.file()
+        if name == None:
+            if self.id == None:
+                raise Exception("This 'analysis' has not been registered or defined in manifest.")
+            name = self.id
+        self.log.declareFile(self.dir + 'logs/' + name.replace(' ','') + '.' + \
+                             time.strftime("%Y%m%d-%H%M%S") + '.' + socket.gethostname() + \
+                             '.' + str(os.getpid()) + '.log')
+        self.log.keepIndex()
+        return self.log.file()
+
+    def mergeLogs(self):
+        '''
+        Builds the analysis log '{id}.log' from the log segments of every job of the analysis,
+        with entries in the order they were written.  Returns the path of the merged log.
+        '''
+        merged = self.dir + self.id.replace(' ','') + '.log'
+        self.log.flush()
+        with FileLock(self.dir + 'logs/.merge.lock'):
+            mergeLogs(sorted(glob.glob(self.dir + 'logs/*.log')), merged)
+        return merged
         
     def fileParse(self, someFile):
         '''
@@ -219,7 +260,7 @@ class GalaxyAnalysis(Analysis):
         '''Returns true if file is gziped'''
         if filePath.endswith('.gz') or filePath.endswith('.gzip'):
             return True
-        err = os.system("gzip -lq " + filePath + ' > /dev/null 2>&1')
+        err = execute(['gzip','-lq',filePath], capture=True).status
         if err == 0:
             return True
         return False
@@ -413,14 +454,17 @@ class GalaxyAnalysis(Analysis):
         
     def logToResultDir(self):
         '''
-        Copies the analysis log to the results dir, if it is outside galaxy
+        Rebuilds the analysis log in the analysis dir at the end of each job, so that it covers
+        every job so far, and copies it to the results dir, if it is outside galaxy
         '''
+        if self.log.file() == None:
+            return
+        mergedLog = self.mergeLogs()
         # TODO: figure out what to do inside galaxy.  Replace stepLog with analysis log?
         if not self._stayWithinGalaxy:
-            if self.log.file() != None:
-                nonGalaxyLog = self.resultsDir() + self.fileGetPart( self.log.file(), 'fileName' )
-                os.system('rm -f ' + nonGalaxyLog)
-                self.log.dump(nonGalaxyLog)
+            nonGalaxyLog = self.resultsDir() + self.fileGetPart( mergedLog, 'fileName' )
+            Log(nonGalaxyLog).remove()
+            Log(mergedLog).dump(nonGalaxyLog)
         
     def onSucceed(self, step):
         """
@@ -438,10 +482,10 @@ class GalaxyAnalysis(Analysis):
         
         step.log.out("\n--- End of step ---\n")
         
-        step.log.dump( self.log.file() ) # to stdout if no runningLog
+        step.log.dump( self.log.file(), self.logMaxBytes ) # to stdout if no runningLog
         self.logToResultDir()
         if self.log.file() != None:  # If analysisLog, then be sure to just print step log to stdout
-            step.log.dump()
+            step.log.dump(maxBytes=self.logMaxBytes)
         ### TODO: cleanup step dir AFTER debugging phase.
         ###if not self.dryRun:
         ###    step.cleanup()               # Removes logicalStep.stepDir()
@@ -458,10 +502,12 @@ class GalaxyAnalysis(Analysis):
         #if self.dryRun:
         self.printPaths(log=step.log)   # For posterity
         step.log.out('') # skip a lineline
-        self.runCmd('ls -l ' + step.dir, dryRun=False, log=step.log)
+        self.runCmd(['ls','-l',step.dir], dryRun=False, log=step.log)
         step.log.out('')
 
         retVal = Analysis.onFail(self,step)
+        if self.log.file() != None:
+            self.mergeLogs()  # The failure belongs in the analysis log too
         if retVal > 255:  # This case has been returning 0 !!!
             retVal = 55
         if retVal == 0:
@@ -0,0 +1,279 @@
+#!/usr/bin/env python2.7
+# localExecutor.py module holds LocalExecutor class which runs the steps of a StepGraph on this
+#                  node, without jobTree.  Each step is run in its own forked process (steps
+#                  change directory, so they cannot share one).  Steps are admitted first-fit
+#                  against the node's cores and memory using each step's declared cpus and ram.
+#                  After a failure no more steps are started, and those running are allowed to
+#                  finish.  Several graphs (e.g. a batch of analyses) may share one executor.
+#                  If the executor itself is interrupted, running steps are terminated.
+#                  Also holds a stand-in Target class for when jobTree is not installed.
+
+import os, sys, time, errno, signal, traceback, multiprocessing
+from log import Log, flushAll, afterFork
+from process import ProcessResult
+
+class Target(object):
+    '''
+    Stands in for jobTree's Target when jobTree is not installed, so that steps can still be
+    run directly or by the LocalExecutor.
+    '''
+
+    def __init__(self, time=None, memory=None, cpu=None):
+        self._targetTime   = time
+        self._targetMemory = memory
+        self._targetCpu    = cpu
+
+    def addChildTarget(self, childTarget):
+        raise Exception("jobTree is not installed.  Use the local executor.")
+
+    def setFollowOnTarget(self, followOnTarget):
+        raise Exception("jobTree is not installed.  Use the local executor.")
+
+    def logToMaster(self, string):
+        sys.stderr.write(string + '\n')
+
+
+class ExecutorStopped(Exception):
+    pass
+
+
+class GraphRun(object):
+    '''
+    Progress of one StepGraph run by the LocalExecutor.
+    '''
+
+    def __init__(self, graph, name=''):
+        self.graph     = graph
+        self.name      = name
+        self.done      = []
+        self.started   = []
+        self.failed    = []
+        self.notRun    = []
+        self.results   = {}  # ProcessResult of each step run, keyed by step name
+        self.cpusInUse = 0
+        self.began     = None
+        self.ended     = None
+
+    def label(self, step=None):
+        '''Names a step (or the graph) in messages.'''
+        if step == None:
+            return "'" + self.name + "'"
+        if self.name == '':
+            return "'" + step.name + "'"
+        return "'" + self.name + ':' + step.name + "'"
+
+    def start(self, step, cpus):
+        if self.began == None:
+            self.began = time.time()
+        self.started.append(step)
+        self.cpusInUse += cpus
+
+    def end(self, step, cpus, result):
+        self.ended = time.time()
+        self.cpusInUse -= cpus
+        self.results[step.name] = result
+        if result.status == 0:
+            self.done.append(step)
+        else:
+            self.failed.append(step)
+
+    def finish(self):
+        self.notRun = [ step for step in self.graph.steps if step not in self.started ]
+
+    @property
+    def status(self):
+        if len(self.failed) > 0:
+            return 'Failed'
+        if len(self.notRun) > 0:
+            return 'Incomplete'
+        return 'Succeeded'
+
+    @property
+    def duration(self):
+        if self.began == None or self.ended == None:
+            return 0.0
+        return self.ended - self.began
+
+
+def nodeCpus():
+    '''Returns the number of cores on this node.'''
+    return multiprocessing.cpu_count()
+
+def nodeRam():
+    '''Returns bytes of physical memory on this node.'''
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+class LocalExecutor(object):
+    '''
+    Runs every step of a StepGraph as soon as its dependencies are done and there are enough
+    free cpus and ram for it, as requested by step.requestResources().  A step asking for more
+    than the node has is run when the node is otherwise idle.
+    '''
+
+    def __init__(self, cpus=None, ram=None, log=None):
+        self.cpus = cpus
+        if self.cpus == None or self.cpus <= 0:
+            self.cpus = nodeCpus()
+        self.ram = ram
+        if self.ram == None or self.ram <= 0:
+            self.ram = nodeRam()
+        self.log = log
+        if self.log == None:
+            self.log = Log()
+        self.results = {}   # ProcessResult of each step run, keyed by step name
+        self.notRun = []
+        self._running = {}  # step keyed by pid
+
+    def demand(self, step):
+        '''Returns the (cpus, ram) a step will be charged, capped at what the node has.'''
+        cpus = min(max(1, int(step.cpus)), self.cpus)
+        ram = min(max(0, long(step.ram)), self.ram)
+        return (cpus, ram)
+
+    def run(self, graph):
+        '''
+        Runs the steps of the graph.  Returns the list of steps that failed (empty on success).
+        Steps that were never started because of a failure are listed in self.notRun.
+        '''
+        graphRun = self.runBatch([ graph ])[0]
+        self.results = graphRun.results
+        self.notRun = graphRun.notRun
+        return graphRun.failed
+
+    def runBatch(self, graphs, names=None, maxRunning=0):
+        '''
+        Runs the steps of several graphs (e.g. one per analysis) sharing this node.  Returns a
+        GraphRun for each graph.  Free resources go first to the graph with the fewest cpus in
+        use, so no analysis is starved.  A failure stops only the graph it happened in.  With
+        maxRunning, no more than that many steps run at once.
+        '''
+        graphRuns = []
+        for ix in range(len(graphs)):
+            name = ''
+            if names != None:
+                name = names[ix]
+            graphRuns.append(GraphRun(graphs[ix], name))
+        freeCpus = self.cpus
+        freeRam = self.ram
+        running = {}  # GraphRun, began and (cpus, ram) charged, keyed by pid
+        demands = {}  # Inputs exist once a step is ready, so its request is sized then
+        previousHandler = signal.signal(signal.SIGTERM, self._onSignal)
+        try:
+            while True:
+                # Launch one step at a time, to the neediest graph with a step that fits
+                while maxRunning <= 0 or len(self._running) < maxRunning:
+                    launch = None
+                    for graphRun in sorted(graphRuns, key=lambda run: run.cpusInUse):
+                        if len(graphRun.failed) > 0:
+                            continue
+                        for step in graphRun.graph.ready(graphRun.done, graphRun.started):
+                            if id(step) not in demands:
+                                step.requestResources()
+                                demands[id(step)] = self.demand(step)
+                            cpus, ram = demands[id(step)]
+                            if cpus <= freeCpus and ram <= freeRam: # First-fit
+                                launch = (graphRun, step, cpus, ram)
+                                break
+                        if launch != None:
+                            break
+                    if launch == None:
+                        break
+                    graphRun, step, cpus, ram = launch
+                    pid = self._launch(step)
+                    self._running[pid] = step
+                    running[pid] = (graphRun, time.time(), cpus, ram)
+                    graphRun.start(step, cpus)
+                    freeCpus -= cpus
+                    freeRam -= ram
+                    self.log.out("# Started " + graphRun.label(step) + " [cpus:%d ram:%.1fGB]" % \
+                                 (cpus, ram / 1073741824.0) + \
+                                 " free [cpus:%d ram:%.1fGB]" % \
+                                 (freeCpus, freeRam / 1073741824.0))
+                if len(self._running) == 0:
+                    break
+                flushAll() # So what was logged here precedes what the steps log meanwhile
+                pid, status, usage = self._waitAny()
+                step = self._running.pop(pid, None)
+                if step == None:
+                    continue # Not a step
+                graphRun, began, cpus, ram = running.pop(pid)
+                freeCpus += cpus
+                freeRam += ram
+                result = ProcessResult([ step.name ], status, time.time() - began, usage)
+                graphRun.end(step, cpus, result)
+                if status == 0:
+                    self.log.out("# Finished " + graphRun.label(step) + \
+                                 " [" + result.usageString() + "]")
+                else:
+                    self.log.out("# Failed " + graphRun.label(step) + \
+                                 " [" + result.usageString() + "]")
+                    stillRunning = len([ run for run in running.values() if run[0] == graphRun ])
+                    if stillRunning > 0:
+                        steps = "steps"
+                        if graphRun.name != '':
+                            steps = "steps of " + graphRun.label()
+                        self.log.out("# No more " + steps + " will be started.  Waiting for " + \
+                                     str(stillRunning) + " running step(s) to finish.")
+        except (KeyboardInterrupt, ExecutorStopped):
+            self.shutdown()
+            raise
+        finally:
+            signal.signal(signal.SIGTERM, previousHandler)
+        for graphRun in graphRuns:
+            graphRun.finish()
+        return graphRuns
+
+    def _launch(self, step):
+        '''Forks a process to run the step in its own process group.  Returns the pid.'''
+        flushAll() # Else the child would inherit, and write again, whatever is buffered
+        pid = os.fork()
+        if pid != 0:
+            try:
+                os.setpgid(pid, pid) # As the child does, so it can be killed from the start
+            except OSError:
+                pass
+            return pid
+        # Child:
+        afterFork()
+        exitCode = 1
+        try:
+            os.setpgrp()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if step.run() == 0:
+                exitCode = 0
+        except:
+            traceback.print_exc()
+        finally:
+            flushAll()  # _exit() skips atexit
+            os._exit(exitCode)
+
+    def _waitAny(self):
+        '''Waits for any step to end.  Returns (pid, exit status, rusage).'''
+        while True:
+            try:
+                return os.wait4(-1, 0)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    def _onSignal(self, signum, frame):
+        raise ExecutorStopped("Local executor received signal " + str(signum))
+
+    def shutdown(self):
+        '''Terminates every running step (and all that it started) and waits for them.'''
+        for pid in self._running.keys():
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        while len(self._running) > 0:
+            try:
+                pid, status, usage = self._waitAny()
+            except OSError:
+                break
+            step = self._running.pop(pid, None)
+            if step != None:
+                self.log.out("# Terminated '" + step.name + "'")
+        self._running = {}
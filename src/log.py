@@ -1,5 +1,341 @@
+#!/usr/bin/env python2.7
+# log.py module holds Log class for logging to a file or stdout.  Each log file has a single
+#        append-mode descriptor per process, shared by every Log of that file, with a small
+#        write buffer.  Buffers are flushed when full, when a second has passed (by a daemon
+#        thread, should nothing more be logged), when the log is closed, and (by flushAll())
+#        before any process is started, so that nothing is written twice by a forked child and
+#        nothing appears out of order.  Step logs are merged into
+#        the analysis log by the kernel (copy_file_range or sendfile) rather than by 'cat', and
+#        may be capped to their head and tail, with the whole log kept gzipped beside it.
+#        A log may keep an index of when each block of it was written, so that the logs of
+#        concurrent jobs can be merged in time order (mergeLogs()).
+
+import os, sys, time, errno, fcntl, gzip, shutil, atexit, threading
+from ra.atomicFile import replacing
+
+BUFFER_BYTES  = 65536  # Flushed when this much is waiting
+FLUSH_SECONDS = 1.0    # or when the oldest waiting text is this old
+COPY_BYTES    = 1048576
+
+# Kernel copies, found through ctypes since python2.7's os module has neither.
+try:
+    import ctypes, ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _copyFileRange = getattr(_libc, 'copy_file_range', None) # glibc 2.27 and up
+    if _copyFileRange != None:
+        _copyFileRange.argtypes = [ ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+                                    ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t,
+                                    ctypes.c_uint ]
+        _copyFileRange.restype = ctypes.c_ssize_t
+    _sendfile = getattr(_libc, 'sendfile', None)
+    if _sendfile != None:
+        _sendfile.argtypes = [ ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+                               ctypes.c_size_t ]
+        _sendfile.restype = ctypes.c_ssize_t
+except (ImportError, OSError):
+    _copyFileRange = None
+    _sendfile = None
+
+def _kernelCopy(copier, inFd, outFd, offset, count):
+    '''
+    Copies up to count bytes from offset with a libc copier.  Returns bytes copied, which is
+    short if the file is, or None if this copier cannot copy between these descriptors.
+    '''
+    copied = 0
+    while count > 0:
+        inOffset = ctypes.c_int64(offset + copied)
+        if copier == _copyFileRange:
+            done = copier(inFd, ctypes.byref(inOffset), outFd, None, min(count, 1 << 30), 0)
+        else:
+            done = copier(outFd, inFd, ctypes.byref(inOffset), min(count, 1 << 30))
+        if done < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if copied == 0 and err in [ errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EBADF,
+                                        errno.EOPNOTSUPP, errno.ESPIPE ]:
+                return None
+            raise OSError(err, os.strerror(err))
+        if done == 0:
+            break
+        copied += done
+        count -= done
+    return copied
+
+def copyRange(inFd, outFd, offset, count):
+    '''
+    Copies count bytes of inFd, starting at offset, to outFd at its current position.  The
+    kernel copies without passing the data through python: copy_file_range between files,
+    sendfile to pipes and sockets.  Otherwise the data is read and written in chunks.
+    '''
+    for copier in [ _copyFileRange, _sendfile ]:
+        if copier == None or count <= 0:
+            continue
+        copied = _kernelCopy(copier, inFd, outFd, offset, count)
+        if copied != None:
+            return
+    os.lseek(inFd, offset, os.SEEK_SET)
+    while count > 0:
+        chunk = os.read(inFd, min(count, COPY_BYTES))
+        if chunk == '':
+            break
+        _writeAll(outFd, chunk)
+        count -= len(chunk)
+
+def copyCapped(inFd, outFd, maxBytes=0, note=''):
+    '''
+    Copies all of inFd to outFd or, if it is larger than maxBytes, just its head and tail with
+    a line in between saying how much was left out.  Returns True if capped.
+    '''
+    size = os.fstat(inFd).st_size
+    if maxBytes <= 0 or size <= maxBytes:
+        copyRange(inFd, outFd, 0, size)
+        return False
+    head = maxBytes / 2
+    tail = maxBytes - head
+    copyRange(inFd, outFd, 0, head)
+    _writeAll(outFd, "\n... [" + str(size - head - tail) + " bytes left out" + note + "] ...\n")
+    copyRange(inFd, outFd, size - tail, tail)
+    return True
+
+def _lockf(fd, operation):
+    '''File locks are a courtesy: a file system without them just goes without.'''
+    try:
+        fcntl.lockf(fd, operation)
+    except IOError as e:
+        if e.errno not in [ errno.ENOLCK, errno.EOPNOTSUPP, errno.EINVAL ]:
+            raise
+
+def _writeAll(fd, data):
+    while len(data) > 0:
+        try:
+            written = os.write(fd, data)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        data = data[written:]
+
+class _LogHandle(object):
+    '''
+    The open descriptor and write buffer of one log file.  O_APPEND means each flush lands at
+    the current end of file, whichever process or descriptor wrote last.
+    '''
+
+    def __init__(self, path):
+        self.path    = path
+        self.lock    = threading.RLock()  # Steps may log from several tool threads
+        self._fd     = None
+        self._buffer = []
+        self._size   = 0
+        self._oldest = None
+        self.indexFile = None  # When set, the time and offset of each block written go here
+
+    def _open(self):
+        if self._fd != None and os.fstat(self._fd).st_nlink == 0:
+            os.close(self._fd)  # Removed behind our back (e.g. 'rm -f'): start a new file
+            self._fd = None
+        if self._fd == None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0664)
+
+    def append(self, text):
+        with self.lock:
+            if len(self._buffer) == 0:
+                self._oldest = time.time()
+                _startFlusher()
+            self._buffer.append(text)
+            self._size += len(text)
+            if self._size >= BUFFER_BYTES or time.time() - self._oldest >= FLUSH_SECONDS:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if len(self._buffer) == 0:
+                return
+            data = ''.join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self._open()
+            _lockf(self._fd, fcntl.LOCK_EX) # Waits while another process appends a file to it
+            try:
+                if self.indexFile != None:
+                    self._noteBlock(self._oldest, os.fstat(self._fd).st_size)
+                _writeAll(self._fd, data)
+            finally:
+                _lockf(self._fd, fcntl.LOCK_UN)
+
+    def truncate(self):
+        '''Starts the file over, discarding anything not yet written.'''
+        with self.lock:
+            self._buffer = []
+            self._size = 0
+            self._open()
+            os.ftruncate(self._fd, 0)
+
+    def appendFrom(self, path, maxBytes=0, note=''):
+        '''
+        Appends the contents of another file, after anything already logged, capped to maxBytes.
+        Returns True if capped.
+        '''
+        with self.lock:
+            self.flush()
+            self._open()
+            inFd = os.open(path, os.O_RDONLY)
+            try:
+                # Kernel copies refuse O_APPEND descriptors, so the end of file is locked while
+                # the copy is written through a descriptor of its own.
+                _lockf(self._fd, fcntl.LOCK_EX)
+                try:
+                    outFd = os.open(self.path, os.O_WRONLY)
+                    try:
+                        offset = os.lseek(outFd, 0, os.SEEK_END)
+                        if self.indexFile != None:
+                            self._noteBlock(time.time(), offset)
+                        return copyCapped(inFd, outFd, maxBytes, note)
+                    finally:
+                        os.close(outFd)
+                finally:
+                    _lockf(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(inFd)
+
+    def _noteBlock(self, when, offset):
+        fd = os.open(self.indexFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0664)
+        try:
+            _writeAll(fd, "%.6f\t%d\n" % (when, offset))
+        finally:
+            os.close(fd)
+
+    def close(self, discard=False):
+        with self.lock:
+            if discard:
+                self._buffer = []
+                self._size = 0
+            self.flush()
+            if self._fd != None:
+                os.close(self._fd)
+                self._fd = None
+
+
+_handles = {}   # _LogHandle keyed by absolute path
+_handlesLock = threading.Lock()
+
+def _handle(path):
+    path = os.path.abspath(path)
+    with _handlesLock:
+        if path not in _handles:
+            _handles[path] = _LogHandle(path)
+        return _handles[path]
+
+_flusherPid = None  # Process whose flusher thread is running
+
+def _flushHandles():
+    with _handlesLock:
+        handles = _handles.values()
+    for handle in handles:
+        try:
+            handle.flush()
+        except OSError:
+            pass
+
+def _flushEvery():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        _flushHandles()
+
+def _startFlusher():
+    '''
+    Starts a daemon thread flushing every log each FLUSH_SECONDS, so that text logged just
+    before a quiet spell (a tool working silently, say) does not wait for more to follow.
+    Once per process: threads do not survive a fork.
+    '''
+    global _flusherPid
+    pid = os.getpid()
+    if _flusherPid == pid:
+        return
+    with _handlesLock:
+        if _flusherPid == pid:
+            return
+        _flusherPid = pid
+    flusher = threading.Thread(target=_flushEvery, name='logFlusher')
+    flusher.daemon = True
+    flusher.start()
+
+def afterFork():
+    '''
+    To be called in a forked child that goes on logging.  Locks the parent's threads held at
+    the fork would never be released in the child, so every lock is made anew.
+    '''
+    global _handlesLock
+    _handlesLock = threading.Lock()
+    for handle in _handles.values():
+        handle.lock = threading.RLock()
+
+def flushAll():
+    '''
+    Writes out every buffered log.  Called before starting a process (which could otherwise
+    write its own copy of the buffers, or write ahead of them) and at exit.
+    '''
+    _flushHandles()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+atexit.register(flushAll)
+
+def readIndex(logFile):
+    '''Returns the (time, offset) of each block of an indexed log, in order written.'''
+    blocks = []
+    try:
+        fileH = open(logFile + '.idx', 'r')
+    except IOError:
+        return blocks
+    try:
+        for line in fileH:
+            columns = line.split()
+            if len(columns) == 2:   # Else a partial line from a job that died
+                blocks.append((float(columns[0]), int(columns[1])))
+    finally:
+        fileH.close()
+    return blocks
+
+def mergeLogs(logFiles, toFile):
+    '''
+    Writes the blocks of several logs to one file, in the order they were written.  A log
+    without an index is taken as a single block, written when it was last modified.
+    '''
+    blocks = []   # (time, log number, start, end)
+    for logNo in range(len(logFiles)):
+        logFile = logFiles[logNo]
+        try:
+            size = os.path.getsize(logFile)
+        except OSError:
+            continue
+        starts = readIndex(logFile)
+        if len(starts) == 0:
+            starts = [ (os.path.getmtime(logFile), 0) ]
+        elif starts[0][1] > 0:
+            starts.insert(0, (starts[0][0], 0))  # Written before the index was kept
+        for ix in range(len(starts)):
+            end = size
+            if ix + 1 < len(starts):
+                end = min(starts[ix + 1][1], size)
+            if end > starts[ix][1]:
+                blocks.append((starts[ix][0], logNo, starts[ix][1], end))
+    blocks.sort()
+
+    with replacing(toFile) as tmpFile:  # Readers see the old view or the new, never part of one
+        outFd = os.open(tmpFile, os.O_WRONLY | os.O_TRUNC)
+        inFds = {}
+        try:
+            for when, logNo, start, end in blocks:
+                if logNo not in inFds:
+                    inFds[logNo] = os.open(logFiles[logNo], os.O_RDONLY)
+                copyRange(inFds[logNo], outFd, start, end - start)
+        finally:
+            for inFd in inFds.values():
+                os.close(inFd)
+            os.close(outFd)
 
-import os, sys
 
 class Log(object):
     """
@@ -8,7 +344,6 @@ class Log(object):
     
     def __init__(self, logFile=None):
         self._logFile = logFile
-        self._log = None
         
     def declareFile(self, logFile):
         """
@@ -29,20 +364,37 @@ class Log(object):
         
     def open(self, mode='a'):
         '''
-        Opens log file.  If no file was declared out will go to stdout.
+        Opens log file ('w' empties it).  If no file was declared out will go to stdout.
+        '''
+        if self._logFile == None:
+            return None
+        handle = _handle(self._logFile)
+        if mode.startswith('w'):
+            handle.truncate()
+        return handle
+
+    def keepIndex(self):
+        '''
+        Keeps '{logFile}.idx' of when each block of the log was written, for mergeLogs().
+        '''
+        if self._logFile != None:
+            _handle(self._logFile).indexFile = self._logFile + '.idx'
+
+    def flush(self):
+        '''
+        Writes out anything buffered, so the file may be read by others.
         '''
-        if self._log != None and self._log.closed == False:
-            return self._log
         if self._logFile != None:
-            self._log = open( self._logFile, mode)
-        return self._log
+            _handle(self._logFile).flush()
+        else:
+            sys.stdout.flush()
 
     def close(self):
         '''
-        closes the log file
+        Flushes and closes the log file.  It will be reopened by the next write.
         '''
-        if self._log != None and self._log.closed == False:
-            self._log.close()
+        if self._logFile != None:
+            _handle(self._logFile).close()
 
     def out(self, text, mode='a'):
         '''
@@ -51,40 +403,101 @@ class Log(object):
         if self._logFile == None:
             print text
             return
-        self.open(mode)
-        self._log.write(text + '\n')
-        self.close()  # always close again, so that others might append in turn
+        self.open(mode).append(text + '\n')
+
+    def write(self, text):
+        '''
+        Writes raw text (e.g. streamed tool output) to the log.  Goes to stdout if no file was
+        declared.
+        '''
+        if self._logFile == None:
+            sys.stdout.write(text)
+            return
+        self.open().append(text)
 
     def appendFile(self, fileToAppend):
         """
         Dumps the contents of a file into the log
         """
-        self.close()
         if self._logFile != None:
-            return os.system('cat ' + fileToAppend + ' >> ' + self._logFile)
-        else:
-            return os.system('cat ' + fileToAppend)
+            return self._copy(fileToAppend, _handle(self._logFile))
+        return self._copy(fileToAppend, None)
 
-    def dump(self, appendToLog=None):
+    def dump(self, appendToLog=None, maxBytes=0):
         """
-        Dumps the log to stdout or a provided appendToLog
+        Dumps the log to stdout or a provided appendToLog.  A log larger than maxBytes (if given)
+        is cut down to its head and tail; when appending to a log, the whole of it is kept
+        gzipped in the same directory.
         """
-        self.close()
         if self._logFile == None:
             return 0
+        self.flush()
         if appendToLog != None:
-            return os.system('cat ' + self._logFile + ' >> ' + appendToLog)
+            fullLog = None
+            if maxBytes > 0 and os.path.getsize(self._logFile) > maxBytes:
+                fullLog = os.path.join(os.path.dirname(os.path.abspath(appendToLog)),
+                                       os.path.basename(self._logFile) + '.gz')
+                try:
+                    self._gzip(fullLog)
+                except (IOError, OSError):
+                    fullLog = None
+            return self._copy(self._logFile, _handle(appendToLog), maxBytes, fullLog)
         else: 
-            return os.system('cat ' + self._logFile)
+            return self._copy(self._logFile, None, maxBytes)
+
+    def _gzip(self, toFile):
+        '''Writes a gzipped copy of the log.'''
+        fromH = open(self._logFile, 'rb')
+        try:
+            with replacing(toFile) as tmpFile:
+                toH = gzip.open(tmpFile, 'wb')
+                try:
+                    shutil.copyfileobj(fromH, toH, COPY_BYTES)
+                finally:
+                    toH.close()
+        finally:
+            fromH.close()
+
+    def _copy(self, fromFile, toHandle, maxBytes=0, fullLog=None):
+        '''Appends a file to a log handle, or stdout if None.  Returns 0 or 1 as cat would.'''
+        if os.path.abspath(fromFile) in _handles:
+            _handle(fromFile).flush()
+        note = ''
+        if fullLog != None:
+            note = "; whole log in " + fullLog
+        try:
+            if toHandle != None:
+                toHandle.appendFrom(fromFile, maxBytes, note)
+                return 0
+            sys.stdout.flush()
+            inFd = os.open(fromFile, os.O_RDONLY)
+            try:
+                copyCapped(inFd, sys.stdout.fileno(), maxBytes)
+            finally:
+                os.close(inFd)
+        except (IOError, OSError) as e:
+            sys.stderr.write("cat: " + fromFile + ": " + str(e.strerror) + "\n")
+            return 1
+        return 0
 
     def remove(self):
         '''
         Removes the log file. Useful to ensure log starts empty.
         '''
-        self.close()
         if self._logFile == None:
             return 0
-        return os.system('rm -f ' + self._logFile)
+        handle = _handle(self._logFile)
+        with handle.lock:
+            handle.close(discard=True)
+            for path in [ self._logFile, handle.indexFile ]:
+                if path == None:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        return 1
+        return 0
 
     def empty(self):
         '''
@@ -1,15 +1,59 @@
-import os, sys, pprint, traceback, json
+import os, sys, time, pprint, traceback, json
 from datetime import datetime, timedelta
-from jobTree.scriptTree.target import Target
+try:
+    from jobTree.scriptTree.target import Target
+except ImportError:
+    from localExecutor import Target # Without jobTree, steps can only be run locally
 from ra.raFile import RaFile
 from analysis import Analysis
 from log import Log
+from toolPool import ToolPool, ToolFuture, parallelMap
+from toolCache import findExecutable
+from staging import stageFile
+from resultCache import resultDigest
+from events import fileSizes
+
+GB = 1073741824 # For declaring the ram of steps
+
+def epoch(when):
+    '''Returns a datetime as seconds since the epoch.'''
+    return time.mktime(when.timetuple()) + when.microsecond / 1000000.0
+
+def overlappingPeak(runs):
+    '''
+    Returns the most memory tools could have held at once: the largest sum of the peak rss
+    of tools whose (began, ended, maxRss) runs overlapped.  Tools run one after another
+    count on their own.
+    '''
+    changes = []
+    for began, ended, maxRss in runs:
+        changes.append((began, 1, maxRss))
+        changes.append((ended, 0, -maxRss))  # At the same moment, ends come before begins
+    changes.sort()
+    held = 0
+    peak = 0
+    for when, begins, rss in changes:
+        held += rss
+        peak = max(peak, held)
+    return peak
 
 class StepError(Exception):
     
     def __init__(self, step=None, message=None):
+        Exception.__init__(self, message)
         self.message = message
-        pass
+
+
+class VersionCollector(object):
+    '''
+    Stands in for a versions RaFile in writeVersions() to collect (tool, version) pairs.
+    '''
+
+    def __init__(self):
+        self.pairs = []
+
+    def add(self, key, value):
+        self.pairs.append((key, value))
 
 
 class LogicalStep(Target):
@@ -55,7 +99,10 @@ class LogicalStep(Target):
         return self._status
         
     def __init__(self, analysis, stepName, ram=1000000000, cpus=1):
-        Target.__init__(self, time=0.00025, memory=ram, cpu=cpus)
+        self._declaredRam = ram   # Used by the default resourceProfile()
+        self._declaredCpus = cpus
+        self.ram = ram
+        self.cpus = cpus
         self._stepVersion = 1
         self._analysis = analysis
         self.interimFiles = {}
@@ -69,17 +116,33 @@ class LogicalStep(Target):
         self._status = 'Init' # Init/Running/Success/Fail
         self._dir = None # needs to make temp directory for itself
         self._toolBegan = None
+        self._toolResult = None
+        self._toolPool = None
         self._stepBegan = None
+        self._resultKey = None  # Digest identifying results in the result cache
+        self._preDeclared = set() # Files declared by the analysis, not the step
+        self._restored = False    # Results came from the result cache
+        self._quietVersions = False
+        self._peakRss = 0         # Measured usage of granular tools, recorded on success
+        self._cpuTime = 0.0
+        cpus, ram = self.requestResources()  # Inputs may not exist yet: see resizeTarget()
+        Target.__init__(self, time=0.00025, memory=ram, cpu=cpus)
         self.ana.registerStep(self)  # Analysis may manage multiple steps simultaneously
 
     def __str__(self):
         return pprint.pformat(self)
         
     def run(self):
+        if self.ana.stepCompleted(self): # Resuming, and this step's results are still good
+            self._status = 'Success'
+            self._err = 0
+            self.emitEvent('stepSkipped')
+            return 0
         self._status = 'Running'
         self.createDir()
         self.declareLogFile() # Ensures that the logical step dir and log exist
         self._stepBegan = datetime.now()
+        self.emitEvent('stepStart', at=epoch(self._stepBegan), cpus=self.cpus, ram=self.ram)
         self.log.out("--- Beginning '" + self._stepName + "' [version: "+self.version+"] [" + 
                      self._stepBegan.strftime("%Y-%m-%d %X (%A)")+ '] ---')
         self._prevDir = os.getcwd()
@@ -87,7 +150,8 @@ class LogicalStep(Target):
         self.log.out("> cd "+self.dir)
         try:
             self.ana.onRun(self)
-            self.onRun() #now this calls child onRun directly
+            if not self.restoreResults():
+                self.onRun() #now this calls child onRun directly
         except StepError as e:
             return self.onFail(e)
         except Exception as e:
@@ -108,6 +172,8 @@ class LogicalStep(Target):
             self.mockUpResults()
         for fileName in self.metaFiles:
             self.metaFiles[fileName].write()
+        self.storeResults()
+        self.recordUsage()
         self._err = 0 # by definition
         os.chdir(self._prevDir)
         #self.log.out("> cd "+self._prevDir)
@@ -115,10 +181,11 @@ class LogicalStep(Target):
         stepTook = str(stepEnded - self._stepBegan + timedelta(seconds=0.5)).split('.')[0]
         self.log.out("\n>> Successfully completed '" + self._stepName + "' [" + \
                      stepEnded.strftime("%Y-%m-%d %X (%A)") + ' duration:' + stepTook + "]\n")
+        self.emitStepEnd(stepEnded)
         self.ana.onSucceed(self)
         
     def fail(self, message):
-        raise StepError(message)
+        raise StepError(self, message)
     
     def onFail(self, e, logTrace=False):
         self._status = 'Fail'
@@ -132,8 +199,228 @@ class LogicalStep(Target):
             self.log.out(traceback.format_exc())
         if self._err == 0:
             self._err = 1  # Make sure this error is noticed!
+        self.emitStepEnd(stepEnded, error=str(e))
         return self.ana.onFail(self)
 
+    def resourceProfile(self, inputBytes):
+        '''
+        Returns the (cpus, ram) this step's tools need, given the total size of its inputs
+        (0 when not yet known).  Steps override this with what their tools really use.
+        '''
+        return (self._declaredCpus, self._declaredRam)
+
+    def inputBytes(self):
+        '''Returns the total size of the step's inputs, or 0 if they are not known yet.'''
+        total = 0
+        try:
+            for key in self.inputKeys() or []:
+                total += os.path.getsize(self.ana.getFile(key))
+        except Exception:
+            return 0
+        return total
+
+    def requestResources(self):
+        '''
+        Sets and returns the (cpus, ram) to request for this step: its resourceProfile() for
+        the current inputs, replaced by measured usage once enough runs on inputs of similar size
+        have been recorded.
+        Measured cpus never exceed the profile, as that is how many threads the tools use.
+        '''
+        inputBytes = self.inputBytes()
+        cpus, ram = self.resourceProfile(inputBytes)
+        history = self.ana.resourceHistory
+        if history != None:
+            measured = history.estimate(self.__class__.__name__, inputBytes)
+            if measured != None:
+                cpus = min(cpus, measured[0])
+                ram = measured[1]
+        self.cpus = cpus
+        self.ram = ram
+        return (cpus, ram)
+
+    def resizeTarget(self):
+        '''
+        Requests resources again once the step's inputs exist, and re-initializes the jobTree
+        Target with them.  Called just before the step is added as a child target, as until
+        then jobTree has read nothing from it.  (The LocalExecutor re-requests by itself.)
+        '''
+        cpus, ram = self.requestResources()
+        Target.__init__(self, time=0.00025, memory=ram, cpu=cpus)
+
+    def noteUsage(self, result, concurrentRss=0):
+        '''
+        Accumulates the usage of a granular tool for recordUsage().  concurrentRss is the peak
+        of tools run alongside one another, if more than the tool's own.
+        '''
+        if result != None:
+            self._cpuTime += result.cpuTime
+            self._peakRss = max(self._peakRss, result.maxRss)
+        self._peakRss = max(self._peakRss, concurrentRss)
+
+    def recordUsage(self):
+        '''Records what this run used, so that later runs can request accurately.'''
+        history = self.ana.resourceHistory
+        if history == None or self.ana.dryRun or self._restored or self._stepBegan == None:
+            return
+        wall = (datetime.now() - self._stepBegan).total_seconds()
+        history.record(self.__class__.__name__, { 'step': self.name, 'wall': wall,
+                       'cpuTime': self._cpuTime, 'maxRss': self._peakRss,
+                       'inputBytes': self.inputBytes(), 'cpus': self.cpus, 'ram': self.ram })
+
+    def emitEvent(self, event, at=None, **fields):
+        '''Writes an event about this step to the analysis events, if there are any.'''
+        events = self.ana.events
+        if events == None or self.ana.dryRun:
+            return
+        events.emit(event, at, step=self.name, stepClass=self.__class__.__name__, **fields)
+
+    def emitStepEnd(self, stepEnded, error=None):
+        '''Writes the 'stepEnd' event: status, usage and the sizes of input and output files.'''
+        if self._stepBegan == None:
+            return
+        inputFiles = {}
+        for key in self.inputKeys() or []:
+            try:
+                inputFiles[key] = self.ana.getFile(key)
+            except Exception:
+                continue
+        outputFiles = dict(self.interimFiles)
+        outputFiles.update(self.targetFiles)
+        exitCode = 0
+        if self._status != 'Success':
+            exitCode = self._err
+        self.emitEvent('stepEnd', at=epoch(stepEnded), status=self._status, exitCode=exitCode,
+                       error=error, wall=(stepEnded - self._stepBegan).total_seconds(),
+                       cpuTime=self._cpuTime, maxRss=self._peakRss, restored=self._restored,
+                       resultKey=self._resultKey, inputSizes=fileSizes(inputFiles),
+                       outputSizes=fileSizes(outputFiles))
+
+    def inputKeys(self):
+        '''
+        Returns the keys of the analysis files this step reads.  Steps that override this
+        have their results cached, and are not rerun when nothing they depend upon changed.
+        '''
+        return None
+
+    def outputKeys(self):
+        '''
+        Returns the keys of the analysis files this step produces, so that a StepGraph knows
+        which steps must wait for it.
+        '''
+        return None
+
+    def resultParams(self):
+        '''
+        Returns the (name, value) pairs of the step parameters its results depend upon.  A step
+        that overrides inputKeys() must override this too, naming every constructor argument
+        that can change its results; until it does, its results are not cached.
+        '''
+        return None
+
+    def scriptNames(self):
+        '''
+        Returns the glue scripts onRun() will run.  writeVersions() only records a script once
+        it runs, so steps that run glue scripts override this to have them in the result key.
+        '''
+        return []
+
+    def resultKey(self):
+        '''
+        Returns the digest identifying this step's results: input file md5sums, step class and
+        version, declared step parameters, tool and glue script versions and relevant analysis
+        settings.  Returns None if the step is not cacheable.
+        '''
+        inputKeys = self.inputKeys()
+        params = self.resultParams()
+        if inputKeys == None or params == None:
+            return None
+        parts = [ ('step.class', self.__class__.__name__), ('step.version', self.version) ]
+        for name, value in params:
+            parts.append(('step.' + name, value))
+        parts.extend(self.ana.resultKeyParts())
+        for key in inputKeys:
+            md5sum = self.ana.toolCache.md5sum(self.ana.getFile(key))
+            if md5sum == '':
+                return None  # Let onRun() report the missing input
+            parts.append(('input.' + key, md5sum))
+        versions = VersionCollector()
+        self._quietVersions = True
+        try:
+            self.writeVersions(versions)
+            self.getToolVersions(self.scriptNames(), versions)
+        finally:
+            self._quietVersions = False
+        for tool, version in versions.pairs:
+            parts.append(('tool.' + tool, version))
+        return resultDigest(parts)
+
+    def restoreResults(self):
+        '''
+        Looks for this step's results in the result cache.  On a hit they are staged (read
+        only) into the step dir and declared, so onRun() need not be called.  Returns True on
+        a hit.
+        '''
+        self._resultKey = None
+        self._restored = False
+        self._preDeclared = set(self.targetFiles.keys()) | set(self.interimFiles.keys())
+        cache = self.ana.resultCache
+        if self.ana.dryRun or (cache == None and not self.ana.recordsSteps()):
+            return False  # Nothing would use the key: don't md5sum the inputs for it
+        try:
+            self._resultKey = self.resultKey()
+        except Exception as e:
+            self.log.out("# Result key unknown: " + str(e))
+            return False
+        if self._resultKey == None or cache == None:
+            return False
+        entry = cache.restore(self._resultKey, self.dir)
+        if entry == None:
+            self.log.out("# Result cache miss [" + self._resultKey + "]")
+            return False
+        for kind, files in [ ('target', self.targetFiles), ('interim', self.interimFiles) ]:
+            for key, relPath in entry['files'][kind].items():
+                path = self.dir + str(relPath)
+                if os.path.isdir(path):
+                    path = path + '/'
+                files[str(key)] = path
+        self.log.out("# Results restored from cache [" + self._resultKey + "]")
+        self._restored = True
+        self._err = 0
+        return True
+
+    @property
+    def resultKeyUsed(self):
+        '''The result key this run was made under, or None if the step is not cacheable.'''
+        return self._resultKey
+
+    def isOwnResult(self, key):
+        '''True if the target/interim file key was declared by the step, not its analysis.'''
+        return key not in self._preDeclared
+
+    def storeResults(self):
+        '''
+        Adds this step's target and interim files to the result cache.  Failure to cache does
+        not fail the step.
+        '''
+        cache = self.ana.resultCache
+        if self._resultKey == None or self._restored or cache == None or self.ana.dryRun:
+            return
+        targets = {}
+        for key in self.targetFiles.keys():
+            if self.isOwnResult(key):
+                targets[key] = self.targetFiles[key]
+        interims = {}
+        for key in self.interimFiles.keys():
+            if self.isOwnResult(key):
+                interims[key] = self.interimFiles[key]
+        description = { 'step': self.name, 'class': self.__class__.__name__,
+                        'version': self.version, 'analysis': self.ana.id }
+        try:
+            if cache.store(self._resultKey, self.dir, targets, interims, description):
+                self.log.out("# Results cached [" + self._resultKey + "]")
+        except Exception as e:
+            self.log.out("# Results not cached: " + str(e))
+
     def createDir(self):
         '''Creates logical step directory'''
         self._dir = self.ana.createTempDir(self.name, clean=True)
@@ -170,6 +457,38 @@ class LogicalStep(Target):
         self._garbageFiles[key] = self.makeFilePath(key, name, ext)
         return self.fileNameOrFullPath(self._garbageFiles[key])
         
+    def stageInput(self, key, name=None):
+        '''
+        Materializes the analysis input file 'key' in the step dir, so that tools may be
+        given a local name for it, and returns that name.  The file is reflinked where possible
+        (hard linked or symlinked if the input is already read only) and only copied as a last
+        resort, and is read only.  The input itself is left as it is.  It is named for the key
+        (unless named), keeping the input's extension.  A bam's '.bai' index, if any, is
+        staged beside it.  The staged file is garbage: it goes with the step dir.
+        '''
+        fromLoc = self.ana.getFile(key)
+        if name == None:
+            baseName = os.path.basename(fromLoc)
+            name = key.split('.')[0]
+            if '.' in baseName:
+                name += baseName[baseName.index('.'):]
+        toLoc = self.makeFilePath(key, name)
+        if self.ana.dryRun:
+            return fromLoc
+        for files in (self.targetFiles, self.interimFiles, self._garbageFiles):
+            for declaredKey in files.keys():
+                if declaredKey != key and files[declaredKey] == toLoc:
+                    raise Exception("Unable to stage '" + key + "' as '" + toLoc + \
+                                    "': already declared for '" + declaredKey + "'.")
+        self._garbageFiles[key] = toLoc
+        method = stageFile(fromLoc, toLoc)
+        self.log.out("> stage " + method + " '" + fromLoc + "' '" + toLoc + "'")
+        if toLoc.endswith('.bam') and os.path.exists(fromLoc + '.bai'):
+            self._garbageFiles[key + '.bai'] = toLoc + '.bai'
+            method = stageFile(fromLoc + '.bai', toLoc + '.bai')
+            self.log.out("> stage " + method + " '" + fromLoc + ".bai' '" + toLoc + ".bai'")
+        return self.fileNameOrFullPath(toLoc)
+
     def declareLogFile(self, name=None):
         '''
         Gets or sets the filename for the log that will be created by this logical step.
@@ -189,11 +508,11 @@ class LogicalStep(Target):
     def mockUpPath(self,path,show=False):
         '''Touch a file or make a directory'''
         if path.endswith('/'):
-            self.ana.runCmd('mkdir -p '+path,logOut=show,logErr=show,dryRun=False,log=self.log)
+            self.ana.runCmd(['mkdir','-p',path],logOut=show,logErr=show,dryRun=False,log=self.log)
         else:
             dirt = os.path.split( path )[0]
-            self.ana.runCmd('mkdir -p '+dirt,logOut=show,logErr=show,dryRun=False,log=self.log)
-            self.ana.runCmd('touch -a '+path,logOut=show,logErr=show,dryRun=False,log=self.log)
+            self.ana.runCmd(['mkdir','-p',dirt],logOut=show,logErr=show,dryRun=False,log=self.log)
+            self.ana.runCmd(['touch','-a',path],logOut=show,logErr=show,dryRun=False,log=self.log)
         
     def mockUpResults(self):
         '''
@@ -241,7 +560,7 @@ class LogicalStep(Target):
         This is expected when a logical step succeeds.
         '''
         if self._dir != None:
-            self.ana.runCmd('rm -rf ' + self._dir)
+            self.ana.runCmd(['rm','-rf',self._dir])
         #self._analysis.removeStep(self)  # Do we want to do this?
         
     def makeFilePath(self, key, name=None, ext=''):
@@ -258,23 +577,121 @@ class LogicalStep(Target):
                 ext = '.' + ext
         return self.dir + name + ext
     
-    def toolBegins(self, toolName):
+    def runCmd(self, cmd, logOut=True, logErr=True, stdout=None):
+        '''
+        Runs a granular tool command (preferably an argument list) logging to the step log.
+        Returns the error code, and keeps the resource accounting for toolEnds().
+        '''
+        self._toolResult = self.ana.runProcess(cmd, logOut=logOut, logErr=logErr, log=self.log,
+                                               stdout=stdout)
+        self.noteUsage(self._toolResult)
+        return self._toolResult.status
+
+    @property
+    def toolResult(self):
+        '''ProcessResult of the most recent runCmd().'''
+        return self._toolResult
+
+    def submitTool(self, toolName, cmd, cpus=1, logOut=True, logErr=True, stdout=None):
+        '''
+        Launches a granular tool without waiting for it, so that independent tools may run at
+        once.  Tools share the step's declared cpus: each reserves 'cpus' of them before it
+        starts.  Returns a ToolFuture.  Call waitForTools() to collect the results.
+        '''
+        if self._toolPool == None:
+            self._toolPool = ToolPool(self.cpus, self._runFuture)
+        toolLog = Log(self.dir + '.' + toolName.replace(' ','_') + '.' + \
+                      str(len(self._toolPool.futures)) + '.log')
+        toolLog.empty()
+        future = ToolFuture(toolName, cmd, cpus, toolLog, logOut, logErr, stdout)
+        return self._toolPool.submit(future)
+
+    def _runFuture(self, future):
+        return self.ana.runProcess(future.cmd, logOut=future.logOut, logErr=future.logErr,
+                                   log=future.log, stdout=future.stdout, started=future.started)
+
+    def waitForTools(self, raiseError=True):
+        '''
+        Waits for all tools launched by submitTool().  Each tool is logged as a block (begins,
+        command, output, ends) as soon as it finishes.  The first failure cancels the other
+        tools and, unless raiseError is False, fails the step.  Returns the first error code.
+        '''
+        pool = self._toolPool
+        self._toolPool = None
+        if pool == None:
+            return 0
+        failedTool = None
+        firstErr = 0
+        runs = [] # (began, ended, maxRss) of each tool, for the peak of those overlapping
+        for future in pool.asCompleted():
+            if future.result == None and future.exception == None:
+                self.log.out("\n# '" + future.toolName + "' cancelled")
+                future.log.remove()
+                continue
+            self.toolBegins(future.toolName, began=future.began)
+            future.log.close()
+            self.log.appendFile(future.log.file())
+            future.log.remove()
+            if future.exception != None:
+                self.log.out(">>> '" + future.toolName + "' raised: " + str(future.exception))
+            if future.result != None:
+                self.noteUsage(future.result)
+                runs.append((future.began, future.ended, future.result.maxRss))
+            self.toolEnds(future.toolName, future.status, raiseError=False, ended=future.ended,
+                          result=future.result)
+            if future.status != 0 and failedTool == None:
+                failedTool = future.toolName
+                firstErr = future.status
+                pool.cancelAll()
+        self.noteUsage(None, overlappingPeak(runs))
+        if failedTool != None:
+            self._err = firstErr
+            if raiseError:
+                self.fail(failedTool + " returned " + str(firstErr))
+        return firstErr
+
+    def toolBegins(self, toolName, began=None):
         '''Standardized message before tool comandline'''
-        self._toolBegan = datetime.now()
+        self._toolResult = None
+        if began == None:
+            began = datetime.now()
+        self._toolBegan = began
         self.log.out("\n# [" + self._toolBegan.strftime("%Y-%m-%d %X") + "] '" + toolName + \
                      "' begins...")
+        self.emitEvent('toolStart', at=epoch(began), tool=toolName)
         
-    def toolEnds(self,toolName,retVal,raiseError=True):
+    def toolEnds(self,toolName,retVal,raiseError=True,ended=None,result=None):
         '''Standardized message after tool comandline.  Raise exception for non-zero retVal.'''
-        toolEnded = datetime.now()
+        toolEnded = ended
+        if toolEnded == None:
+            toolEnded = datetime.now()
+        if result != None:
+            self._toolResult = result
         toolTook = str(toolEnded - self._toolBegan + timedelta(seconds=0.5)).split('.')[0]
         
         self.log.out("# ["+toolEnded.strftime("%Y-%m-%d %X") + ' duration:' + toolTook + "] '" + \
                      toolName + "' returned " + str(retVal))
+        if self._toolResult != None and not self.ana.dryRun:
+            self.log.out("# [usage " + self._toolResult.usageString() + "]")
+        self.emitToolEnd(toolName, retVal, toolEnded)
         if raiseError and not retVal == 0:
             self._err = retVal
             self.fail(toolName + " returned " + str(self._err))
 
+    def emitToolEnd(self, toolName, retVal, toolEnded):
+        '''
+        Writes the 'toolEnd' event: exit code, wall and cpu time, memory and block i/o (from
+        rusage, so not reads served from the page cache, nor writes not yet on disk).
+        '''
+        result = self._toolResult
+        fields = { 'tool': toolName, 'exitCode': retVal,
+                   'wall': (toolEnded - self._toolBegan).total_seconds() }
+        if result != None:
+            fields.update({ 'exitCode': result.exitCode, 'cpuTime': result.cpuTime,
+                            'maxRss': result.maxRss, 'blockBytesRead': result.inBlocks * 512,
+                            'blockBytesWritten': result.outBlocks * 512 })
+        self.emitEvent('toolEnd', at=epoch(toolEnded), **fields)
+
     def writeVersions(self,raFile=None):
         '''Writes versions to to the log or a file.'''
         # Each logical step is expected to extend or replace this to record the actual tool versions
@@ -342,28 +759,54 @@ class LogicalStep(Target):
         '''
         Retrieves tool version, but if there is no success, then the version is the md5sum.
         '''
+        intro, toolName, version = self._resolveToolVersion(executable)
+        if logOut:
+            self.log.out("# "+intro+toolName+" [version: " + version + "]")
+        return version
+
+    def getToolVersions(self, tools, raFile=None, logOut=True):
+        '''
+        Retrieves the versions of several tools, probing them concurrently.  Each tool is either
+        an executable or a (raKey, executable) pair.  Versions are logged and added to the
+        raFile in the order given.  Returns the list of versions.
+        '''
+        pairs = []
+        for tool in tools:
+            if isinstance(tool, basestring):
+                pairs.append((tool, tool))
+            else:
+                pairs.append(tool)
+        threads = int(self.ana.getSetting('versionProbeThreads', '8'))
+        found = parallelMap(lambda pair: self._resolveToolVersion(pair[1]), pairs, threads)
+        versions = []
+        for ix in range(len(pairs)):
+            intro, toolName, version = found[ix]
+            if logOut and not self._quietVersions:
+                self.log.out("# "+intro+toolName+" [version: " + version + "]")
+            if raFile != None:
+                raFile.add(pairs[ix][0], version)
+            versions.append(version)
+        return versions
+
+    def _resolveToolVersion(self, executable):
+        '''
+        Returns (intro, toolName, version) for an executable, without logging.
+        '''
+        # md5sums are cached by file identity, so unchanged binaries are never hashed again
         if executable.find('/') == -1: # Not a path, then look for this on the path!
-            toolId = self.ana.getCmdOut("md5sum `which "+executable+"` | awk '{print $1}'", \
-                                        dryRun=False,logCmd=False)
-            if toolId.startswith('which: no'): # failed to find executable: might be perl script
-                toolId = self.ana.getCmdOut("md5sum "+self.ana.toolsDir + executable + \
-                                            " | awk '{print $1}'",dryRun=False,logCmd=False)
-                if toolId.startswith('md5sum: '): # failed to find executable
-                    toolId = ""
+            toolPath = findExecutable(executable)
+            if toolPath == None: # failed to find executable: might be perl script
+                toolPath = self.ana.toolsDir + executable
             toolName = executable
         else:
-            toolId = self.ana.getCmdOut("md5sum "+executable+" | awk '{print $1}'", \
-                                        dryRun=False,logCmd=False)
-            if toolId.startswith('md5sum: '): # failed to find executable
-                toolId = ""
+            toolPath = executable
             toolName = os.path.split( executable )[1]
+        toolId = self.ana.toolCache.md5sum(toolPath) # "" if failed to find executable
 
         toolData = self.ana.getToolData(toolId, toolName)
         if toolData == None:
             version = 'md5sum:'+toolId  # when all else fails
-            if logOut:
-                self.log.out("# tool: "+toolName+" [version: " + version + "]")
-            return version
+            return ("tool: ", toolName, version)
 
         try:
             version = toolData['version']
@@ -376,7 +819,9 @@ class LogicalStep(Target):
 
         # Try to get actual version and compare the two
         if 'versionCommand' in toolData:
-            actual = self.ana.getCmdOut(toolData['versionCommand'],dryRun=False,logCmd=False)
+            versionCommand = toolData['versionCommand']
+            actual = self.ana.toolCache.version(toolPath, versionCommand, lambda: \
+                        self.ana.getCmdOut(versionCommand,dryRun=False,logCmd=False))
             if version != actual:
                 if self.ana.strict:
                     raise Exception("Expecting "+executable+" [version: "+version+"], " + \
@@ -397,11 +842,8 @@ class LogicalStep(Target):
                 intro = "package(tool): "
                 if packageVersion != version:
                     version = packageVersion+'('+version+')' 
-            
-        if logOut:
-            self.log.out("# "+intro+toolName+" [version: " + version + "]")
 
-        return version
+        return (intro, toolName, version)
             
         
 
@@ -1,6 +1,7 @@
 from src.pipelines.pipeline import Pipeline
+from src.stepGraph import Barrier
 
-from src.steps.alignmentStep import AlignmentStep
+from src.steps.bwaAlignmentStep import BwaAlignmentStep
 from src.steps.bamEvaluateStep import BamEvaluateStep
 from src.steps.hotspotStep import HotspotStep
 from src.steps.mergeBamStep import MergeBamStep
@@ -16,10 +17,10 @@ class DnasePipeline(Pipeline):
         
     def getSingleReplicatePipeline(self, replicate):
         return [
-            AlignmentStep(self.analysis, replicate),
-            BamEvaluateStep(self.analysis, replicate, 5000000),
+            BwaAlignmentStep(self.analysis, replicate),
+            BamEvaluateStep(self.analysis, replicate, 'Rep' + str(replicate)),
             HotspotStep(self.analysis, 'Rep' + str(replicate)),
-            HotspotStep(self.analysis, 'Rep' + str(replicate) + '5M')
+            HotspotStep(self.analysis, 'Rep' + str(replicate) + '_5M')  # BamEvaluate's sample
         ]
        
     def getSecondPartPipeline(self):
@@ -28,7 +29,8 @@ class DnasePipeline(Pipeline):
         replicates have been run.
         """
         return [
-            MergeBamStep(self.analysis, 1, 2),
+            Barrier('replicates'),
+            MergeBamStep(self.analysis, 1, 2, 'alignment', 'alignment'),
             HotspotStep(self.analysis, 'Rep1Rep2')
         ]
         
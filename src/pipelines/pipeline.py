@@ -1,25 +1,36 @@
-from jobTree.scriptTree.target import Target
+try:
+    from jobTree.scriptTree.target import Target
+except ImportError:
+    from src.localExecutor import Target # Without jobTree, only the local executor can be used
+from src.stepGraph import StepGraph, Barrier
 
-class RunSequence(Target):
+class RunLevels(Target):
+    """
+    Runs lists of steps one list after another.  All steps in a list are run at once.
+    """
 
-    def __init__(self, pipeline, workqueue, ram=1000000000, cpus=1):
+    def __init__(self, pipeline, levels, ram=1000000000, cpus=1):
         Target.__init__(self, time=0.00025, memory=ram, cpu=cpus)
-        self.workqueue = workqueue
+        self.levels = levels
         self.pipeline = pipeline
         
     def run(self):
         if not self.pipeline.running:
             return
     
-        self.addChildTarget(self.workqueue.pop(0))
-        if len(self.workqueue) > 0:
-            self.setFollowOnTarget(RunSequence(self.pipeline, self.workqueue))
+        for step in self.levels[0]:
+            step.resizeTarget() # Its inputs exist now that the levels before it are done
+            self.addChildTarget(step)
+        if len(self.levels) > 1:
+            self.setFollowOnTarget(RunLevels(self.pipeline, self.levels[1:]))
 
 class Pipeline(Target):
     """
     Pipelines will be lightweight objects which contain essentially just a
     list of the steps needed to be taken. We might want to start by designing
-    the system such that there's a single-analysis part and a full part
+    the system such that there's a single-analysis part and a full part.
+    Steps are scheduled by what they read and write (see StepGraph), so any steps
+    that do not depend upon each other are run at the same time.
     """
     
     def __init__(self, analysis, ram=1000000000, cpus=1):
@@ -38,23 +49,32 @@ class Pipeline(Target):
     def getSecondPartPipeline(self):
         """
         Gets the second part of the pipeline. This would be after both
-        replicates have been run.
+        replicates have been run.  It should begin with a Barrier if its steps
+        need more than the files they declare (e.g. all replicates complete).
         """
         pass
         
+    def getSteps(self):
+        """
+        Gets every step (and Barrier) of the pipeline for this analysis.
+        """
+        steps = []
+        for replicate in [ 1, 2 ]:
+            if replicate in self.analysis.replicates:
+                steps.extend(self.getSingleReplicatePipeline(replicate) or [])
+        if 1 in self.analysis.replicates and 2 in self.analysis.replicates:
+            steps.extend(self.getSecondPartPipeline() or [])
+        return steps
+
+    def getStepGraph(self):
+        return StepGraph(self.getSteps(), self.analysis.inputKeys())
+
     def stop(self):
         self.running = False
         
     def run(self):
         self.running = True
-        if 1 in self.analysis.replicates:
-            self.addChildTarget(RunSequence(self, self.getSingleReplicatePipeline(1)))
-        if 2 in self.analysis.replicates:
-            self.addChildTarget(RunSequence(self, self.getSingleReplicatePipeline(2)))
-        
-        # TODO: this is not actually correct, will need to do DB lookup
-        if 1 in self.analysis.replicates and 2 in self.analysis.replicates:
-            self.setFollowOnTarget(RunSequence(self, self.getSecondPartPipeline()))
-            
-        
-            
\ No newline at end of file
+        maxConcurrent = int(self.analysis.getSetting('maxConcurrentSteps', '0'))
+        levels = self.getStepGraph().levels(maxConcurrent)
+        if len(levels) > 0:
+            self.addChildTarget(RunLevels(self, levels))
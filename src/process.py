@@ -0,0 +1,201 @@
+#!/usr/bin/env python2.7
+# process.py module holds the execution engine used to run all granular tools.  Commands are
+#            run directly from argument vectors by subprocess.Popen (no /bin/sh unless the
+#            command is a string that needs one).  Output is streamed into a Log through a pipe
+#            held open for the life of the command, and the child is reaped with wait4() so that
+#            the exit code, wall time, user/sys CPU and peak RSS are returned in a ProcessResult.
+
+import os, sys, time, errno, shlex, pipes, signal
+try:
+    import subprocess32 as subprocess
+    NEW_SESSION = True   # Popen can start a new session without running python in the child
+except ImportError:
+    import subprocess
+    NEW_SESSION = False  # The command is started through setsid instead
+from log import flushAll
+
+# Characters which mean a string command must be handed to the shell.
+SHELL_CHARS = set('|&;<>()$`\\"\'*?[]~{}\n')
+
+class ProcessResult(object):
+    '''
+    Result of running a single command: exit code and resource accounting.
+
+    'status' is the raw wait status (exactly what os.system() returned), so existing checks
+    of 'err != 0' continue to work.  'exitCode' is the decoded exit code (negative signal
+    number when the command was killed).
+    '''
+
+    def __init__(self, argv, status=0, wallTime=0.0, usage=None, output=None):
+        self.argv     = argv
+        self.status   = status
+        self.wallTime = wallTime
+        self.output   = output
+        if os.WIFSIGNALED(status):
+            self.exitCode = -os.WTERMSIG(status)
+        else:
+            self.exitCode = os.WEXITSTATUS(status)
+        if usage != None:
+            self.userTime  = usage.ru_utime
+            self.sysTime   = usage.ru_stime
+            self.maxRss    = usage.ru_maxrss * 1024  # Linux reports kilobytes
+            self.inBlocks  = usage.ru_inblock
+            self.outBlocks = usage.ru_oublock
+        else:
+            self.userTime  = 0.0
+            self.sysTime   = 0.0
+            self.maxRss    = 0
+            self.inBlocks  = 0
+            self.outBlocks = 0
+
+    @property
+    def cpuTime(self):
+        return self.userTime + self.sysTime
+
+    def usageString(self):
+        '''Standardized one line summary of resources used.'''
+        return "wall:%.1fs user:%.1fs sys:%.1fs maxRss:%.1fMB" % \
+               (self.wallTime, self.userTime, self.sysTime, self.maxRss / 1048576.0)
+
+    def __str__(self):
+        return "'" + commandString(self.argv) + "' returned " + str(self.status) + \
+               " [" + self.usageString() + "]"
+
+
+def commandArgv(cmd):
+    '''
+    Returns the argument vector for a command.  Lists are used as they are.  Strings are split
+    unless they use shell syntax (pipes, redirects, globs, quotes...) in which case they are
+    handed to /bin/sh, as os.system() would have done.
+    '''
+    if not isinstance(cmd, basestring):
+        return [ str(arg) for arg in cmd ]
+    for char in cmd:
+        if char in SHELL_CHARS:
+            return [ '/bin/sh', '-c', cmd ]
+    return shlex.split(cmd)
+
+def commandString(cmd):
+    '''Returns a printable command line for logging.'''
+    if isinstance(cmd, basestring):
+        return cmd
+    if len(cmd) == 3 and cmd[0] == '/bin/sh' and cmd[1] == '-c':
+        return cmd[2]
+    return ' '.join([ pipes.quote(str(arg)) for arg in cmd ])
+
+def killGroup(pid, sig=signal.SIGTERM):
+    '''
+    Kills a command launched with execute(started=...) and everything it started.  Until it
+    is in its own session it has started nothing, and is killed on its own.
+    '''
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass # Already gone
+
+def execute(cmd, log=None, logOut=True, logErr=True, stdout=None, capture=False, cwd=None,
+            started=None):
+    '''
+    Runs a command and returns a ProcessResult.  Does not log the command line itself.
+    - log:     Log that receives stdout and/or stderr.  A Log with no file means inherit.
+    - logOut:  send stdout to the log (ignored if stdout or capture is given).
+    - logErr:  send stderr to the log.
+    - stdout:  path of a file that should receive stdout (replaces shell '>' redirects).
+    - capture: collect stdout and stderr into result.output instead of logging them.
+    - started: called with the Popen object once launched.  The command is then run in its
+               own session (so process group), so that killGroup() kills everything it
+               started.
+    '''
+    argv = commandArgv(cmd)
+    logFile = None
+    if log != None:
+        logFile = log.file()
+
+    outFile = None
+    outArg = None
+    errArg = None
+    toLog = False
+    if capture:
+        outArg = subprocess.PIPE
+        errArg = subprocess.STDOUT
+    else:
+        if stdout != None:
+            outFile = open(stdout, 'w')
+            outArg = outFile
+        elif logOut and logErr and logFile != None:
+            outArg = subprocess.PIPE
+            errArg = subprocess.STDOUT
+            toLog = True
+        if errArg == None and logErr and logFile != None:
+            errArg = subprocess.PIPE
+            toLog = True
+
+    # A preexec_fn runs python between fork and exec, which can deadlock when other threads
+    # (a ToolPool, say) hold the import or allocator locks: start the session without one.
+    popenArgv = argv
+    options = {}
+    if started != None:
+        if NEW_SESSION:
+            options['start_new_session'] = True
+        else:
+            popenArgv = [ 'setsid' ] + argv  # Not a group leader, so setsid execs in place
+    flushAll() # The command may write to the same files or stdout
+    began = time.time()
+    try:
+        proc = subprocess.Popen(popenArgv, stdout=outArg, stderr=errArg, close_fds=True, cwd=cwd,
+                                **options)
+    except OSError as e:
+        # Mimic the shell: report the problem where the output would have gone, return 127
+        if outFile != None:
+            outFile.close()
+        message = argv[0] + ': ' + e.strerror + '\n'
+        if capture:
+            return ProcessResult(argv, 127 << 8, time.time() - began, output=message.rstrip())
+        if log != None:
+            log.write(message)
+            log.close()
+        else:
+            sys.stderr.write(message)
+        return ProcessResult(argv, 127 << 8, time.time() - began)
+
+    if started != None:
+        started(proc)
+
+    pipe = proc.stdout
+    if pipe == None:
+        pipe = proc.stderr
+    chunks = []
+    if pipe != None:
+        fd = pipe.fileno()
+        while True:
+            chunk = os.read(fd, 65536)
+            if chunk == '':
+                break
+            if toLog:
+                log.write(chunk)
+            else:
+                chunks.append(chunk)
+        pipe.close()
+        if toLog:
+            log.close()
+
+    while True:
+        try:
+            pid, status, usage = os.wait4(proc.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    proc.returncode = status  # reaped here, so Popen must not try again
+    if outFile != None:
+        outFile.close()
+
+    output = None
+    if capture:
+        output = ''.join(chunks)
+        if output.endswith('\n'):
+            output = output[ :-1 ]
+    return ProcessResult(argv, status, time.time() - began, usage, output)
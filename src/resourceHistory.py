@@ -0,0 +1,114 @@
+#!/usr/bin/env python2.7
+# resourceHistory.py module holds ResourceHistory class which records the cpu and memory that each
+#                    run of a LogicalStep actually used, and estimates from those records what
+#                    later runs of the same step class should request: a high percentile of past
+#                    usage plus some headroom.  Records are appended as json lines to one file per
+#                    step class, so any number of analyses can share a history directory.
+#     Usage: resourceHistory.py {historyDir} [{stepClass}...]
+
+import os, sys, json, math
+
+def percentile(values, pct):
+    '''Returns the nearest-rank percentile of a list of numbers.'''
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+class ResourceHistory(object):
+    '''
+    Measured usage of past step runs, keyed by step class.
+    '''
+
+    def __init__(self, historyDir, headroom=0.2, pct=95, minSamples=3, keep=100):
+        if not historyDir.endswith('/'):
+            historyDir = historyDir + '/'
+        self._historyDir = historyDir
+        self.headroom   = headroom    # fraction added to the percentile
+        self.pct        = pct
+        self.minSamples = minSamples  # fewer than this and the declared profile is used
+        self.keep       = keep        # only the latest runs are considered
+
+    @property
+    def dir(self):
+        return self._historyDir
+
+    def _historyFile(self, stepClass):
+        return self._historyDir + stepClass + '.jsonl'
+
+    def record(self, stepClass, usage):
+        '''
+        Appends the usage of one run: a dict with 'wall' and 'cpuTime' seconds, 'maxRss' bytes
+        and 'inputBytes'.  Failure to record is not an error.
+        '''
+        line = json.dumps(usage, sort_keys=True) + '\n'
+        try:
+            if not os.path.isdir(self._historyDir):
+                try:
+                    os.makedirs(self._historyDir)
+                except OSError:
+                    pass # Another step just made it
+            # A single O_APPEND write keeps concurrent writers from interleaving lines
+            fd = os.open(self._historyFile(stepClass), os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0664)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except (IOError, OSError):
+            pass
+
+    def samples(self, stepClass):
+        '''Returns the recorded usage dicts of the latest runs of a step class.'''
+        try:
+            fileH = open(self._historyFile(stepClass), 'r')
+        except IOError:
+            return []
+        found = []
+        try:
+            for line in fileH:
+                try:
+                    found.append(json.loads(line))
+                except ValueError:
+                    continue # Partial line from a writer that died
+        finally:
+            fileH.close()
+        return found[ -self.keep: ]
+
+    def estimate(self, stepClass, inputBytes=0):
+        '''
+        Returns (cpus, ram) for the next run of a step class, from the percentile of past runs
+        plus headroom, or None if there are too few runs to go on.  Only runs with inputs at
+        least half as large as inputBytes are considered, as usage tends to grow with input.
+        '''
+        samples = [ sample for sample in self.samples(stepClass) \
+                    if sample.get('wall', 0) > 0 and sample.get('maxRss', 0) > 0 \
+                    and sample.get('inputBytes', 0) * 2 >= inputBytes ]
+        if len(samples) < self.minSamples:
+            return None
+        usedCpus = percentile([ sample['cpuTime'] / sample['wall'] for sample in samples ],
+                              self.pct)
+        usedRam = percentile([ sample['maxRss'] for sample in samples ], self.pct)
+        cpus = max(1, int(math.ceil(usedCpus * (1 + self.headroom))))
+        ram = long(usedRam * (1 + self.headroom))
+        return (cpus, ram)
+
+
+############ command line testing ############
+if __name__ == '__main__':
+    '''
+    Command-line testing: prints the estimates for step classes found in a history dir.
+    '''
+    history = ResourceHistory(sys.argv[1])
+    stepClasses = sys.argv[2:]
+    if len(stepClasses) == 0:
+        stepClasses = sorted([ name[ :-len('.jsonl') ] for name in os.listdir(history.dir) \
+                               if name.endswith('.jsonl') ])
+    for stepClass in stepClasses:
+        estimate = history.estimate(stepClass)
+        runs = len(history.samples(stepClass))
+        if estimate == None:
+            print "%-24s runs:%-4d too few runs to estimate" % (stepClass, runs)
+        else:
+            print "%-24s runs:%-4d cpus:%d ram:%.1fGB" % \
+                  (stepClass, runs, estimate[0], estimate[1] / 1073741824.0)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python2.7
+# resultCache.py module holds ResultCache class: a content-addressed cache of LogicalStep results.
+#                A step's results are stored under a digest of everything that determines them:
+#                the md5sums of its input files, its class and version, the versions of its tools
+#                and the analysis settings it depends upon.  When a step is run again with the
+#                same digest, its target and interim files are staged back into the step dir
+#                instead of running the step.  Files are staged in and out by reflink, else by a
+#                hard link if already read only, else by copy (see staging.py), and the md5sum of
+#                each is recorded so that an entry changed since it was stored is dropped, not
+#                restored.
+#                Entries are evicted least recently used first once the cache grows beyond its
+#                size limit.
+#     Usage: resultCache.py [--purge] [--maxGb {gb}] [--olderThan {days}] {cacheDir}
+#            With no options, lists the entries in the cache.
+
+import os, sys, json, time, shutil, hashlib, tempfile, argparse
+from staging import stageFile
+from toolCache import md5sumOfFile
+
+ENTRY_FILE = 'entry.json'
+CACHE_STAGE_METHODS = [ 'reflink', 'hardlink', 'copy' ] # A symlink would not outlive eviction
+
+def resultDigest(parts):
+    '''Returns the digest of an ordered list of (name, value) pairs.'''
+    digest = hashlib.sha1()
+    for name, value in parts:
+        digest.update(str(name) + '=' + str(value) + '\n')
+    return digest.hexdigest()
+
+def treeFiles(path, relPath):
+    '''Returns (relative path, full path) of a file, or of every file in a directory.'''
+    if not os.path.isdir(path):
+        return [ (relPath, path) ]
+    files = []
+    for name in sorted(os.listdir(path)):
+        files.extend(treeFiles(os.path.join(path, name), os.path.join(relPath, name)))
+    return files
+
+def stageTree(fromPath, toPath):
+    '''Stages a file or a whole directory read only, sharing data where the filesystem can.'''
+    if os.path.isdir(fromPath):
+        if not os.path.isdir(toPath):
+            os.makedirs(toPath)
+        for name in os.listdir(fromPath):
+            stageTree(os.path.join(fromPath, name), os.path.join(toPath, name))
+        return
+    stageFile(fromPath, toPath, CACHE_STAGE_METHODS)
+
+def treeSize(path):
+    '''Returns bytes used by a file or directory, counting each inode once.'''
+    seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+class ResultCache(object):
+    '''
+    Stores and restores step results keyed by digest.  Each entry is a directory holding the
+    result files (relative to the step dir) and an entry.json describing them, with the
+    md5sum of every file.  md5sum(path) may be given to reuse md5sums already known (as from
+    a ToolCache); by default files are hashed on every store and restore.
+    '''
+
+    def __init__(self, cacheDir, maxBytes=None, md5sum=None):
+        if not cacheDir.endswith('/'):
+            cacheDir = cacheDir + '/'
+        self._cacheDir = cacheDir
+        self._maxBytes = maxBytes
+        self._md5sum = md5sum
+        if md5sum == None:
+            self._md5sum = md5sumOfFile
+
+    @property
+    def dir(self):
+        return self._cacheDir
+
+    def entryDir(self, key):
+        return self._cacheDir + key[:2] + '/' + key + '/'
+
+    def lookup(self, key):
+        '''Returns the entry dict for a key, or None if not cached.'''
+        try:
+            fileH = open(self.entryDir(key) + ENTRY_FILE, 'r')
+            try:
+                entry = json.load(fileH)
+            finally:
+                fileH.close()
+        except (IOError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def verify(self, key, entry):
+        '''
+        True if every file of an entry still has the md5sum it was stored with.  Entries from
+        before md5sums were recorded do not verify.
+        '''
+        md5sums = entry.get('md5sums')
+        if md5sums == None:
+            return False
+        filesDir = self.entryDir(key) + 'files/'
+        for relPath in sorted(md5sums.keys()):
+            try:
+                if self._md5sum(filesDir + relPath) != md5sums[relPath]:
+                    return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def restore(self, key, stepDir):
+        '''
+        Stages the cached results into stepDir, once their md5sums are verified.  Returns the
+        entry, whose 'files' map 'target' and 'interim' keys to paths relative to the step
+        dir, or None on a miss.  An entry that fails verification is removed.
+        '''
+        entry = self.lookup(key)
+        if entry == None:
+            return None
+        if not self.verify(key, entry):
+            self.remove(key)
+            return None
+        entryDir = self.entryDir(key)
+        try:
+            for kind in [ 'target', 'interim' ]:
+                for relPath in entry['files'][kind].values():
+                    if not os.path.isdir(os.path.dirname(stepDir + relPath)):
+                        os.makedirs(os.path.dirname(stepDir + relPath))
+                    stageTree(entryDir + 'files/' + relPath, stepDir + relPath)
+            os.utime(entryDir + ENTRY_FILE, None) # Recently used
+        except Exception:
+            return None  # Evicted out from under us: just run the step
+        return entry
+
+    def store(self, key, stepDir, targetFiles, interimFiles, description=None):
+        '''
+        Stages a step's results into the cache, where they are read only.  The step's own
+        files are left as they are.  targetFiles and interimFiles are the step's dicts of key
+        to full path within stepDir.  Returns True if stored.
+        '''
+        if self.lookup(key) != None:
+            return True
+        if not os.path.isdir(self._cacheDir):
+            try:
+                os.makedirs(self._cacheDir)
+            except OSError:
+                pass
+        entry = { 'key': key, 'created': time.time(), 'description': description,
+                  'files': { 'target': {}, 'interim': {} }, 'md5sums': {} }
+        # Build the entry aside, then rename it into place so readers never see it partial
+        tmpDir = tempfile.mkdtemp(dir=self._cacheDir, prefix='.tmp') + '/'
+        try:
+            for kind, files in [ ('target', targetFiles), ('interim', interimFiles) ]:
+                for fileKey in files.keys():
+                    path = files[fileKey].rstrip('/')
+                    relPath = os.path.relpath(path, stepDir)
+                    if relPath.startswith('..'):
+                        raise OSError("Result '" + path + "' is outside of " + stepDir)
+                    toPath = tmpDir + 'files/' + relPath
+                    if not os.path.isdir(os.path.dirname(toPath)):
+                        os.makedirs(os.path.dirname(toPath))
+                    stageTree(path, toPath)
+                    entry['files'][kind][fileKey] = relPath
+                    for fileRelPath, filePath in treeFiles(toPath, relPath):
+                        entry['md5sums'][fileRelPath] = self._md5sum(filePath)
+            entry['bytes'] = treeSize(tmpDir)
+            fileH = open(tmpDir + ENTRY_FILE, 'w')
+            json.dump(entry, fileH, sort_keys=True, indent=4, separators=(',', ': '))
+            fileH.close()
+            entryDir = self.entryDir(key).rstrip('/')
+            if not os.path.isdir(os.path.dirname(entryDir)):
+                try:
+                    os.makedirs(os.path.dirname(entryDir))
+                except OSError:
+                    pass
+            os.rename(tmpDir, entryDir)
+        except Exception:
+            shutil.rmtree(tmpDir, ignore_errors=True) # Lost a race or disk trouble
+            return self.lookup(key) != None
+        if self._maxBytes != None:
+            self.evict(self._maxBytes)
+        return True
+
+    def entries(self):
+        '''Returns all entries, least recently used first.  Each has 'used' and 'dir' added.'''
+        found = []
+        if not os.path.isdir(self._cacheDir):
+            return found
+        for prefix in os.listdir(self._cacheDir):
+            prefixDir = self._cacheDir + prefix + '/'
+            if prefix.startswith('.') or not os.path.isdir(prefixDir):
+                continue
+            for key in os.listdir(prefixDir):
+                entry = self.lookup(key)
+                if entry == None:
+                    continue
+                try:
+                    entry['used'] = os.path.getmtime(self.entryDir(key) + ENTRY_FILE)
+                except OSError:
+                    continue
+                entry['dir'] = self.entryDir(key)
+                found.append(entry)
+        found.sort(key=lambda entry: entry['used'])
+        return found
+
+    def remove(self, key):
+        '''Removes a single entry.'''
+        entryDir = self.entryDir(key).rstrip('/')
+        # Rename first so that a concurrent restore sees a miss rather than a partial entry
+        doomed = self._cacheDir + '.doomed.' + key + '.' + str(os.getpid())
+        try:
+            os.rename(entryDir, doomed)
+        except OSError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def evict(self, maxBytes=0, olderThan=None):
+        '''
+        Removes least recently used entries until the cache holds no more than maxBytes.
+        Entries not used for 'olderThan' seconds are removed regardless.  Returns bytes freed.
+        '''
+        entries = self.entries()
+        total = sum([ entry.get('bytes', 0) for entry in entries ])
+        freed = 0
+        now = time.time()
+        for entry in entries:
+            if total - freed <= maxBytes and \
+               (olderThan == None or now - entry['used'] < olderThan):
+                continue
+            self.remove(entry['key'])
+            freed += entry.get('bytes', 0)
+        return freed
+
+
+############ command line ############
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspects or purges the step result cache.')
+    parser.add_argument('--purge', action='store_true', help='Remove every entry')
+    parser.add_argument('--maxGb', type=float, default=None,
+                        help='Evict least recently used entries down to this size')
+    parser.add_argument('--olderThan', type=float, default=None,
+                        help='Evict entries not used for this many days')
+    parser.add_argument('cacheDir', help='The result cache directory')
+    args = parser.parse_args(sys.argv[1:])
+
+    cache = ResultCache(args.cacheDir)
+    if args.purge or args.maxGb != None or args.olderThan != None:
+        maxBytes = 0
+        if not args.purge and args.maxGb != None:
+            maxBytes = int(args.maxGb * 1073741824)
+        elif not args.purge:
+            maxBytes = sys.maxint
+        olderThan = None
+        if args.olderThan != None:
+            olderThan = args.olderThan * 86400
+        freed = cache.evict(maxBytes, olderThan)
+        print "Freed %.2fGB" % (freed / 1073741824.0)
+    else:
+        total = 0
+        for entry in cache.entries():
+            total += entry.get('bytes', 0)
+            description = entry.get('description') or {}
+            print "%s  %s  %8.2fGB  %s" % (entry['key'], \
+                time.strftime("%Y-%m-%d %X", time.localtime(entry['used'])), \
+                entry.get('bytes', 0) / 1073741824.0, description.get('step', ''))
+        print "Total %.2fGB" % (total / 1073741824.0)
@@ -5,10 +5,80 @@
 #            '#' based comments are supported anywhere in line.  Use '\#' to escape '#'.
 #            Continuation lines (with '\') ARE supported. 
 #            Leading whitespace on continued line is stripped.
+#            A file is parsed in a single pass, and the result kept in a hidden '.{file}.parsed'
+#            cache beside it (and in memory), so it is only parsed again once it changes.
+#     Usage: settings.py --benchmark [{keys}]   Times parsing a generated file of many keys.
 
 # imports needed for Settings class:
-import os, sys, string
+import os, sys, string, re, time, errno, marshal
 import json
+from ra.atomicFile import atomicWrite, fileStamp
+
+CACHE_VERSION = 1
+_COMMENT = re.compile(r'\\#|#.*', re.S)  # An escaped '#', or a comment to the end of line
+_parsed = {}  # In-memory cache: (stamp, fromJson, dict) keyed by absolute path
+
+def _uncomment(match):
+    if match.group(0) == '\\#':
+        return '#'
+    return ''
+
+def stripComments(line):
+    '''Strips a comment from a line, unescaping any '\\#'.'''
+    if '#' not in line:
+        return line
+    return _COMMENT.sub(_uncomment, line)
+
+def logicalLines(text):
+    '''
+    Yields the lines of text with '\\' continuations joined, each stripped of surrounding
+    whitespace.  As always, a continuation left hanging at the end of the file is dropped.
+    '''
+    lines = text.split('\n')
+    if text.endswith('\n'):
+        lines.pop()
+    pending = None
+    for line in lines:
+        line = line.strip()
+        if pending != None:
+            line = pending + line
+            pending = None
+        if line.endswith('\\'):
+            pending = line[ :-1 ]
+            continue
+        yield line
+
+def _cacheFile(filePath):
+    directory, name = os.path.split(os.path.abspath(filePath))
+    return os.path.join(directory, '.' + name + '.parsed')
+
+def _loadCache(filePath, stamp):
+    '''Returns (fromJson, dict) cached for this version of a file, or None.'''
+    path = os.path.abspath(filePath)
+    if path in _parsed and _parsed[path][0] == stamp:
+        return _parsed[path][1:]
+    try:
+        fileH = open(_cacheFile(filePath), 'rb')
+        try:
+            version, cachedPath, cachedStamp, fromJson, values = marshal.load(fileH)
+        finally:
+            fileH.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if version != CACHE_VERSION or cachedPath != path or tuple(cachedStamp) != stamp:
+        return None
+    _parsed[path] = (stamp, fromJson, values)
+    return (fromJson, values)
+
+def _storeCache(filePath, stamp, fromJson, values):
+    '''Caches a parsed file.  Failure (e.g. a read only directory) just means no cache.'''
+    path = os.path.abspath(filePath)
+    _parsed[path] = (stamp, fromJson, values)
+    try:
+        with atomicWrite(_cacheFile(filePath), binary=True) as fileH:
+            marshal.dump((CACHE_VERSION, path, stamp, fromJson, values), fileH)
+    except (IOError, OSError):
+        pass
 
 class Settings(dict):
     '''
@@ -31,7 +101,65 @@ class Settings(dict):
 
     def read(self, filePath, key=None):
         '''
-        Reads in a simple settings file. 
+        Reads in a simple settings file, from its cache if it has not changed since last read.
+        '''
+        self._filename = filePath
+        stamp = fileStamp(filePath)
+        cached = _loadCache(filePath, stamp)
+        if cached == None:
+            fileH = open(filePath, 'r')
+            try:
+                text = fileH.read()
+            finally:
+                fileH.close()
+            cached = self.parse(text)
+            _storeCache(filePath, stamp, cached[0], cached[1])
+        fromJson, values = cached
+        if not fromJson and len(self) > 0:
+            for settingKey in values:
+                if settingKey in self:
+                    raise KeyError('Duplicate Key ' + settingKey)
+        self.update(values)
+
+        if key != None:
+            return self[key]
+
+    def parse(self, text):
+        '''
+        Parses the text of a settings file in one pass.  Returns (fromJson, dict of settings).
+        '''
+        # Try json, but be happy with plain old var - space - val lines
+        if text.lstrip().startswith('{'):
+            try:
+                jsObj = json.loads(text)
+                if isinstance(jsObj, dict):
+                    values = {}
+                    for jsonKey in jsObj.keys():
+                        values[str(jsonKey)] = str(jsObj[jsonKey])
+                    return (True, values)
+            except ValueError:
+                pass
+        values = {}
+        for line in logicalLines(text):
+            if '#' in line:
+                line = _COMMENT.sub(_uncomment, line).strip()
+                if line == '' or line.startswith('#'):
+                    continue
+            elif line == '':
+                continue
+            pair = line.split(None, 1) # As _loadLine(), which is too slow to call per line
+            if pair[0] in values:
+                raise KeyError('Duplicate Key ' + pair[0])
+            if len(pair) == 2:
+                values[pair[0]] = pair[1]
+            else:
+                values[pair[0]] = ''
+        return (False, values)
+
+    def readLineByLine(self, filePath, key=None):
+        '''
+        Reads in a simple settings file the original way, a line at a time.  Kept as the
+        reference that the single pass parser is checked and timed against.
         '''
         self._filename = filePath
         file = open(filePath, 'r')
@@ -180,11 +308,67 @@ class Settings(dict):
                 line = line[ 0:bam - 1 ] + line[ bam: ]  
 
 
+def benchmark(keys=10000, rounds=5):
+    '''
+    Times reading a generated settings file of many keys (with comments, escapes and
+    continuations) line by line, in a single pass, from the cache file and from memory.
+    '''
+    import tempfile, shutil
+    tmpDir = tempfile.mkdtemp(prefix='settingsBench')
+    try:
+        filePath = os.path.join(tmpDir, 'settings.txt')
+        fileH = open(filePath, 'w')
+        fileH.write('# Generated settings for benchmarking\n\n')
+        for ix in range(keys):
+            if ix % 10 == 0:
+                fileH.write('# Section %d\n' % (ix / 10))
+            if ix % 7 == 0:
+                fileH.write('key%06d /some/long/path/to/tool/%d \\\n    --with continued options\n' % \
+                            (ix, ix))
+            elif ix % 5 == 0:
+                fileH.write('key%06d value \\#%d is not a comment  # but this is\n' % (ix, ix))
+            else:
+                fileH.write('key%06d value%d\n' % (ix, ix))
+        fileH.close()
+
+        reference = Settings()
+        reference.readLineByLine(filePath)
+        timings = []
+        for how in [ 'line by line', 'single pass', 'cache file', 'memory' ]:
+            began = time.time()
+            for round in range(rounds):
+                if how == 'line by line':
+                    Settings().readLineByLine(filePath)
+                    continue
+                if how != 'memory':  # The memory cache is left filled by the previous reads
+                    _parsed.clear()
+                if how == 'single pass':
+                    try:
+                        os.remove(_cacheFile(filePath))
+                    except OSError:
+                        pass
+                settings = Settings(filePath)
+            timings.append((how, (time.time() - began) / rounds))
+            if how != 'line by line' and settings != reference:
+                raise Exception("Parsed '" + how + "' differently than line by line.")
+        print "%d keys, mean of %d reads:" % (keys, rounds)
+        for how, took in timings:
+            print "  %-14s %8.2fms %7.1fx" % (how, took * 1000, timings[0][1] / max(took, 1e-9))
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+
 ############ command line testing ############
 if __name__ == '__main__':
     """
     Test this thang
     """
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        keys = 10000
+        if len(sys.argv) > 2:
+            keys = int(sys.argv[2])
+        benchmark(keys)
+        sys.exit(0)
     settings = Settings('/hive/users/tdreszer/galaxy/galaxy-dist/tools/encode/settingsE3.txt')
     # sort not sorting?  settings.sort()
     #for key in settings.keys():
@@ -0,0 +1,106 @@
+#!/usr/bin/env python2.7
+# staging.py module materializes an input file under a new name (usually in a step directory)
+#            without duplicating its data where the filesystem allows.  In order it tries a
+#            reflink (a copy-on-write clone sharing the same blocks), a hard link, a symlink and,
+#            only as a last resort, a copy.  Whatever the method, the staged name is read only.
+#            A hard link or symlink is the input itself, so it is only used for an input that is
+#            already read only; the input's own permissions are never changed.
+#            LogicalStep.stageInput() is the usual way in.
+
+import os, stat, shutil, errno
+try:
+    import fcntl
+except ImportError:
+    fcntl = None   # Not a unix: reflinks are never tried
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h: clones a whole file (btrfs, xfs)
+
+STAGE_METHODS = [ 'reflink', 'hardlink', 'symlink', 'copy' ]
+LINK_METHODS = [ 'hardlink', 'symlink' ]  # The staged name is the input itself
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+def reflink(fromLoc, toLoc):
+    '''
+    Makes toLoc a copy-on-write clone of fromLoc.  Raises IOError (or OSError) if the
+    filesystem cannot share blocks between the two, in which case toLoc is not left behind.
+    '''
+    if fcntl == None:
+        raise IOError(errno.EOPNOTSUPP, "reflinks are not supported here", toLoc)
+    fromH = open(fromLoc, 'rb')
+    try:
+        toH = open(toLoc, 'wb')
+        try:
+            fcntl.ioctl(toH.fileno(), FICLONE, fromH.fileno())
+        except:
+            toH.close()
+            os.remove(toLoc)
+            raise
+        toH.close()
+    finally:
+        fromH.close()
+    shutil.copymode(fromLoc, toLoc)
+
+def hardlink(fromLoc, toLoc):
+    os.link(fromLoc, toLoc)
+
+def symlink(fromLoc, toLoc):
+    os.symlink(os.path.abspath(fromLoc), toLoc)
+
+def copy(fromLoc, toLoc):
+    shutil.copyfile(fromLoc, toLoc)
+    shutil.copymode(fromLoc, toLoc)
+
+_STAGERS = { 'reflink': reflink, 'hardlink': hardlink, 'symlink': symlink, 'copy': copy }
+
+def isReadOnly(path):
+    '''Returns True if no one may write to a file (through a symlink, to its target).'''
+    return (stat.S_IMODE(os.stat(path).st_mode) & WRITE_BITS) == 0
+
+def readOnly(path):
+    '''Takes away write permission from a file (through a symlink, from its target).'''
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    os.chmod(path, mode & ~WRITE_BITS)
+
+def stageFile(fromLoc, toLoc, methods=None):
+    '''
+    Puts fromLoc at toLoc by the first of methods (default STAGE_METHODS) that works, and
+    returns the name of that method.  Anything already at toLoc is replaced.  The result is
+    read only.  A hard link or symlink is the input itself, so it is only used if the input
+    is already read only; otherwise the next method is tried.  A reflink or copy is a file of
+    its own and is made read only.
+    '''
+    if methods == None:
+        methods = STAGE_METHODS
+    if not os.path.isfile(fromLoc):
+        raise Exception("Unable to stage '" + fromLoc + "': not a file.")
+    if os.path.lexists(toLoc):
+        os.remove(toLoc)
+    failures = []
+    inputReadOnly = isReadOnly(fromLoc)
+    for method in methods:
+        if method in LINK_METHODS and not inputReadOnly:
+            failures.append(method + ': input is writable')
+            continue
+        try:
+            _STAGERS[method](fromLoc, toLoc)
+        except (IOError, OSError) as e:
+            failures.append(method + ': ' + str(e))
+            continue
+        if method not in LINK_METHODS:
+            readOnly(toLoc)
+        return method
+    raise Exception("Unable to stage '" + fromLoc + "' as '" + toLoc + "' (" + \
+                    '; '.join(failures) + ")")
+
+
+############ command line testing ############
+if __name__ == '__main__':
+    '''
+    Command-line testing: stages a file and reports how.
+        Usage: staging.py {fromFile} {toFile} [{method}...]
+    '''
+    import sys
+    methods = None
+    if len(sys.argv) > 3:
+        methods = sys.argv[3:]
+    print stageFile(sys.argv[1], sys.argv[2], methods)
@@ -12,9 +12,55 @@
 #            '#' based comments are supported anywhere in the file or at the end of a setting line.
 #            Use '\#' to escape '#'.   Continuation lines (with '\') ARE supported. 
 #            Leading whitespace on continued line is stripped.
+#            Alternate key indexes and the sort orders used to walk them are built once and
+#            kept until a stanza is added or removed, so lookups do not grow with the file.
+#            Single stanzas can be fetched from large files without reading them, through a
+#            sidecar index of where each stanza lies (see ra/raIndex.py).  Very large files can
+#            be parsed in pieces by a pool of processes.
 
 # imports needed for Settings class:
-from src.settings import Settings
+from src.settings import Settings, logicalLines, stripComments
+from ra.raIndex import RaIndex, parallelRanges
+import multiprocessing
+
+def _readRange(piece):
+    '''
+    Reads the stanzas in a byte range of a file (to the end if None), as (label, key, dict).
+    Also the pool worker for reading a large file in pieces.
+    '''
+    cls, filePath, start, end = piece
+    fileH = open(filePath, 'r')
+    try:
+        fileH.seek(start)
+        if end == None:
+            lines = logicalLines(fileH.read())
+        else:
+            lines = logicalLines(fileH.read(end - start))
+    finally:
+        fileH.close()
+
+    stanzas = cls()
+    parsed = []
+    eof = False
+    while eof == False:
+        stanzaLabel, stanzaKey, stanza, eof = stanzas._readStanza(lines)
+        parsed.append((stanzaLabel, stanzaKey, stanza))
+    return parsed
+
+def stanzaName(lines):
+    '''
+    Names a stanza for its sidecar index as Stanzas does: by the value of its first setting,
+    with continuations joined and comments stripped.  Given the stanza's raw lines.
+    '''
+    for line in logicalLines(''.join(lines)):
+        line = stripComments(line).strip()
+        if line.startswith('#') or line == '':
+            continue
+        pair = line.split(None, 1)
+        if len(pair) == 2:
+            return pair[1]
+        return ''
+    return None
 
 class Stanzas(Settings):
     '''
@@ -35,7 +81,7 @@ class Stanzas(Settings):
         return (self._altIndex != None)
     
     def hasUniqueAltIndex(self):
-        return (self._altIndex != None and self._altUnique == True)
+        return (self._currentAltIndex() != None and self._altUnique == True)
     
     def altLabel(self):
         return self._altLabel
@@ -43,50 +89,56 @@ class Stanzas(Settings):
     def primaryLabel(self):
         return self._primaryLabel
     
-    def __init__(self, filePath=None, primaryLabel=None):
-        Settings.__init__(self,filePath)
+    def __init__(self, filePath=None, primaryLabel=None, processes=1):
+        Settings.__init__(self)
         self._primaryLabel=primaryLabel
+        self._filename = filePath
         self._sortKeys = None
         self._altIndex = None
+        self._altLabel = None
+        self._altUnique = False         # No alternate value is shared by stanzas
+        self._altRequireUnique = False  # As asked of altIndex(): sharing is an error
+        self._altStale = False          # Stanzas changed since the alternate index was built
+        self.invalidate()
         if filePath != None:
-            self._primaryLabel = self.read(filePath, primaryLabel)
+            self._primaryLabel = self.read(filePath, primaryLabel, processes)
+
+    def invalidate(self):
+        '''
+        Drops the alternate indexes and sort orders, which are rebuilt when next needed, so that
+        adding many stanzas costs no rebuilds in between.  Called whenever a stanza is added or
+        removed.  Call it after changing a stanza's settings.
+        '''
+        self._indexes = {}  # Primary keys in file order by alternate value, by alternate label
+        self._cmpKeys = {}  # Sort comparison key of each primary key, by sort order
+        self._orders  = {}  # Sorted primary keys by alternate value, by (label, sort order)
+        self._latest  = {}  # Last primary key in sort order by alternate value, likewise
+        if self._altIndex != None:
+            self._altStale = True
 
-    def read(self, filePath, primaryLabel=None):
+    def _currentAltIndex(self):
+        '''Returns the alternate index, first rebuilding it if stanzas have changed since.'''
+        if self._altStale:
+            self.altIndex(self._altLabel, self._altRequireUnique)
+        return self._altIndex
+
+    def __setitem__(self, key, stanza):
+        Settings.__setitem__(self, key, stanza)
+        if len(self._indexes) > 0 or len(self._cmpKeys) > 0:
+            self.invalidate()
+
+    def __delitem__(self, key):
+        Settings.__delitem__(self, key)
+        self.invalidate()
+
+    def read(self, filePath, primaryLabel=None, processes=1):
         '''
         Reads RA style stanzas from a file. 
+        With processes, a large file is parsed in pieces by a pool of that many processes.
         '''
         self._filename = filePath
-        fileH = open(filePath, 'r')
         
-        eof = False
-        while eof == False:
-            stanza = dict()
-            stanzaKey = None
-            stanzaLabel = None
-            while eof == False:
-                line = self._readLineMayContinue( fileH )
-                if line == None:
-                    eof = True
-                    break
-                    
-                # end of stanza?
-                if line == '':
-                    break
-                
-                line = self._stripComments(line)
-                if line == '':
-                    continue
-            
-                line = line.strip()
-                if (line.startswith('#') or line == ''):
-                    continue
-                else:
-                    key = self._loadLine(line,stanza)
-                    # Stanza key is the value of the FIRST line
-                    if stanzaKey == None:
-                        stanzaLabel = key
-                        stanzaKey = stanza[stanzaLabel]
-                        
+        for stanzaLabel, stanzaKey, stanza in self._readParsed(filePath, processes):
             # Make sure we didn't just have a stanza of comments!
             if stanzaKey == None:
                 continue
@@ -102,8 +154,78 @@ class Stanzas(Settings):
             except:
                 self[stanzaKey] = stanza
         
-        fileH.close()
         return primaryLabel
+
+    def _readParsed(self, filePath, processes=1):
+        '''Yields the label, key and dict of each stanza in file order.'''
+        ranges = parallelRanges(filePath, processes)
+        if ranges == None:
+            for stanza in _readRange((self.__class__, filePath, 0, None)):
+                yield stanza
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            pieces = [ (self.__class__, filePath, start, end) for start, end in ranges ]
+            for parsed in pool.imap(_readRange, pieces):
+                for stanza in parsed:
+                    yield stanza
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _readStanza(self, lines):
+        '''
+        Reads one stanza from logical lines, up to a blank line.
+        Returns its label, key and dict (key None if it held only comments) and whether the
+        lines ran out.
+        '''
+        stanza = dict()
+        stanzaKey = None
+        stanzaLabel = None
+        for line in lines:
+            # end of stanza?
+            if line == '':
+                return (stanzaLabel, stanzaKey, stanza, False)
+
+            line = stripComments(line)
+            if line == '':
+                continue
+
+            line = line.strip()
+            if (line.startswith('#') or line == ''):
+                continue
+            else:
+                key = self._loadLine(line,stanza)
+                # Stanza key is the value of the FIRST line
+                if stanzaKey == None:
+                    stanzaLabel = key
+                    stanzaKey = stanza[stanzaLabel]
+        return (stanzaLabel, stanzaKey, stanza, True)
+
+    def fetch(self, key, filePath=None):
+        '''
+        Returns the stanza of a primary key, read on its own from the file (by default the
+        file this was read from) through the file's sidecar index, or None.  The stanza is
+        not added to these Stanzas.
+        '''
+        if filePath == None:
+            filePath = self._filename
+        try:
+            text = RaIndex(filePath, stanzaName).read(key)
+        except (IOError, OSError):
+            # No index can be kept beside the file: read the whole of it
+            return Stanzas(filePath, self._primaryLabel).getStanza(key)
+        if text == None:
+            return None
+        stanzaLabel, stanzaKey, stanza, eof = self._readStanza(logicalLines(text))
+        if stanzaKey != key:
+            return None
+        if self._primaryLabel != None and self._primaryLabel != stanzaLabel:
+            raise Exception("RA file", filePath, "stanzas must match on '"+ \
+                            self._primaryLabel+"', but found '"+stanzaLabel+"'.")
+        return stanza
     
     def getKeyFromStanza(self, stanza):
         '''Returns the Primary key for a stanza.'''
@@ -137,35 +259,47 @@ class Stanzas(Settings):
         stanza = self[key]
         return self.getFromStanza(stanza,setting,default)
     
+    def _index(self, altLabel):
+        '''Returns primary keys (in file order) by alternate value, built once per label.'''
+        if altLabel not in self._indexes:
+            index = {}
+            for key in self.keys():
+                stanza = self[key]
+                if altLabel not in stanza:
+                    raise Exception("RA file", self._filename, "stanza missing alternate label '"+ \
+                                        altLabel+"'.")
+                index.setdefault(stanza[altLabel], []).append(self.getKeyFromStanza(stanza))
+            self._indexes[altLabel] = index
+        return self._indexes[altLabel]
+
     def altIndex(self, altLabel, unique=True):
         '''
         Establish an alternate key which may be non-unique.
+        Cheap when the index for this label was already built.  Whether it must stay unique
+        is kept apart from whether it happens to be, so rebuilding it after stanzas are added
+        asks the same of it.
         '''
+        if self._altIndex != None and self._altLabel == altLabel and not self._altStale and \
+           (self._altUnique or not unique):
+            self._altRequireUnique = unique
+            return  # Already established
+        self._altIndex = None
+        self._altStale = False
+        index = self._index(altLabel)
         self._altLabel = altLabel
         self._altIndex = dict()
-        self._altUnique = unique
-        multiplesFound = False
-        for key in self.keys():
-            stanza = self[key]
-            altKey = stanza[altLabel]
-            if altKey == None:
-                raise Exception("RA file", self._filename, "stanza missing alternate label '"+ \
-                                    altLabel+"'.")
-            if altKey in self._altIndex:
-                if unique:
-                    raise Exception("RA file", self._filename, " alternate label '"+altLabel+ \
-                                    "' has non-unique key '"+altKey+"'.")
-                prevKey = self._altIndex[altKey]
-                if not isinstance(prevKey, basestring):
-                    prevKey.extend( [ self.getKeyFromStanza(stanza) ] )
-                    self._altIndex[altKey] = prevKey
-                else:
-                    self._altIndex[altKey] = [ prevKey, self.getKeyFromStanza(stanza) ]
-                multiplesFound = True
-            else:
-                self._altIndex[altKey] = self.getKeyFromStanza(stanza)
-        if not unique and not multiplesFound:
-            self._altUnique = True
+        self._altUnique = True
+        self._altRequireUnique = unique
+        for altKey in index.keys():
+            keys = index[altKey]
+            if len(keys) == 1:
+                self._altIndex[altKey] = keys[0]
+                continue
+            if unique:
+                raise Exception("RA file", self._filename, " alternate label '"+altLabel+ \
+                                "' has non-unique key '"+altKey+"'.")
+            self._altIndex[altKey] = list(keys)
+            self._altUnique = False
 
             
     def getAltKeyFromStanza(self, stanza):
@@ -176,7 +310,7 @@ class Stanzas(Settings):
         '''
         Returns stanza if only one stanza matches this alternate key.  Else returns None.
         '''
-        if self._altIndex == None:
+        if self._currentAltIndex() == None:
             raise Exception("RA file", self._filename, " does not have an alternate index.")
         if altKey not in self._altIndex:
             raise Exception("RA file", self._filename, "altKey '"+self._altLabel+ \
@@ -209,7 +343,7 @@ class Stanzas(Settings):
                             "' value '"+altKey+"' not found.")
         keyList = self._altIndex[altKey]
         if self._sortKeys:
-            keyList = self.sortedKeys(self._sortKeys,keyList)
+            keyList = self._sortedOrder()[altKey]
         alreadyFound = (iterator == None)
         for key in keyList: #.items():
             if key not in self:
@@ -218,10 +352,50 @@ class Stanzas(Settings):
             stanza = self[key]
             if alreadyFound:
                 return stanza
-            if iterator == stanza:
+            if iterator is stanza or iterator == stanza:
                 alreadyFound = True
         return None
 
+    def _sortedOrder(self):
+        '''
+        Returns the primary keys of each alternate value in the current sort order, sorted once
+        per alternate label and sort order.
+        '''
+        order = (self._altLabel, tuple(self._sortKeys or []))
+        if order not in self._orders:
+            cmpKeys = self._cmpKeysFor(self._sortKeys)
+            sortedKeys = {}
+            index = self._index(self._altLabel)
+            for altKey in index.keys():
+                sortedKeys[altKey] = sorted(index[altKey], key=cmpKeys.__getitem__)
+            self._orders[order] = sortedKeys
+        return self._orders[order]
+
+    def latestFromAlt(self, altKey):
+        '''
+        Returns the last stanza in sort order (e.g. the latest version of a tool, if sorted by
+        name then version) for an alternate key, or None if no stanza has it.  Once the sort
+        order is established, this costs the same however many stanzas there are.
+        '''
+        if self._currentAltIndex() == None:
+            raise Exception("RA file", self._filename, " does not have an alternate index.")
+        order = (self._altLabel, tuple(self._sortKeys or []))
+        if order not in self._latest:
+            latest = {}
+            if self._sortKeys:
+                sortedKeys = self._sortedOrder()
+                for value in sortedKeys.keys():
+                    latest[value] = sortedKeys[value][-1]
+            else:
+                index = self._index(self._altLabel)
+                for value in index.keys():
+                    latest[value] = index[value][-1]
+            self._latest[order] = latest
+        key = self._latest[order].get(altKey)
+        if key == None:
+            return None
+        return self[key]
+
     def getFromAlt(self, altKey, setting, default, index=0):
         '''
         Returns the setting value for stanza found by the given altKey.  
@@ -248,12 +422,21 @@ class Stanzas(Settings):
     def altCmpKey(self, key):
         '''Returns an alternate key for sort comparison.'''
         if self._sortKeys != None:
-            altKey = ''
-            for setting in self._sortKeys:
-                altKey = altKey + self.get(key,setting,' ').lower() + ' '
-            return altKey
+            return self._cmpKeysFor(self._sortKeys)[key]
         return self.getAltKeyFromStanza(self[key]).lower() + ' ' + key
 
+    def _cmpKeysFor(self, settingOrder):
+        '''Returns the sort comparison key of every stanza, built once per sort order.'''
+        order = tuple(settingOrder)
+        if order not in self._cmpKeys:
+            cmpKeys = {}
+            for key in self.keys():
+                stanza = self[key]
+                cmpKeys[key] = ''.join([ stanza.get(setting, ' ').lower() + ' ' \
+                                         for setting in order ])
+            self._cmpKeys[order] = cmpKeys
+        return self._cmpKeys[order]
+
     def setSortOrder(self, settingOrder):
         '''
         Sets the standard sort order which can be used for sorting, printing, 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+# stepGraph.py module holds StepGraph and Barrier classes.  A StepGraph orders the LogicalSteps of
+#              a pipeline by what they declare they read (inputKeys) and write (outputKeys), so
+#              that steps which do not depend upon each other may run at the same time.  A
+#              Barrier in the list of steps makes every later step wait for every earlier one,
+#              as cross-replicate work (e.g. merging replicate bams) must.
+
+class Barrier(object):
+    '''
+    Placed between steps given to a StepGraph: nothing after it starts until all before it end.
+    '''
+
+    def __init__(self, name='barrier'):
+        self.name = name
+
+    def __str__(self):
+        return "Barrier '" + self.name + "'"
+
+
+class StepGraph(object):
+    '''
+    Directed acyclic graph of steps.  A step depends upon the step that produces each file key
+    it reads: the closest earlier producer or, failing that, the first later one.  A key that no
+    step produces must be one of the analysis 'inputs', or the graph cannot be made.  A step that
+    does not declare its inputs depends upon every step before it, just as if the steps were run
+    in order.
+    '''
+
+    def __init__(self, steps, inputs=()):
+        self._steps = []
+        self._deps = {}   # step index: set of step indexes it waits upon
+        barrier = set()   # Every step before the latest barrier
+        listed = []       # (step, barrier) in order
+        for item in steps:
+            if isinstance(item, Barrier):
+                barrier = set(range(len(listed)))
+                continue
+            listed.append((item, barrier))
+            self._steps.append(item)
+
+        producers = {}
+        for ix in range(len(self._steps)):
+            for key in self._outputKeys(self._steps[ix]):
+                producers.setdefault(key, []).append(ix)
+
+        inputs = set(inputs)
+        for ix in range(len(self._steps)):
+            step, barrier = listed[ix]
+            deps = set(barrier)
+            inputKeys = step.inputKeys()
+            if inputKeys == None:
+                deps.update(range(ix))
+            else:
+                for key in inputKeys:
+                    if key not in producers:
+                        if key not in inputs:
+                            raise Exception("Step '" + step.name + "' reads '" + key + \
+                                            "', which is neither produced by a step nor " + \
+                                            "an analysis input.")
+                        continue
+                    earlier = [ p for p in producers[key] if p < ix ]
+                    later   = [ p for p in producers[key] if p > ix ]
+                    if len(earlier) > 0:
+                        deps.add(earlier[-1])
+                    elif len(later) > 0:
+                        deps.add(later[0])
+            deps.discard(ix)
+            self._deps[ix] = deps
+        self._levels = self._computeLevels()
+
+    def _outputKeys(self, step):
+        outputKeys = step.outputKeys()
+        if outputKeys == None:
+            return []
+        return outputKeys
+
+    def _computeLevels(self):
+        '''Returns lists of step indexes: each list depends only upon earlier lists.'''
+        levels = []
+        placed = set()
+        while len(placed) < len(self._steps):
+            level = [ ix for ix in range(len(self._steps)) \
+                      if ix not in placed and self._deps[ix].issubset(placed) ]
+            if len(level) == 0:
+                cycle = [ self._steps[ix].name for ix in range(len(self._steps)) \
+                          if ix not in placed ]
+                raise Exception("Steps depend upon each other: " + ', '.join(cycle))
+            levels.append(level)
+            placed.update(level)
+        return levels
+
+    @property
+    def steps(self):
+        return self._steps
+
+    def dependencies(self, step):
+        '''Returns the steps that must complete before this one can start.'''
+        ix = self._steps.index(step)
+        return [ self._steps[dep] for dep in sorted(self._deps[ix]) ]
+
+    def dependents(self, step):
+        '''Returns the steps that wait upon this one, directly or indirectly.'''
+        found = set([ self._steps.index(step) ])
+        changed = True
+        while changed:
+            changed = False
+            for ix in range(len(self._steps)):
+                if ix not in found and len(self._deps[ix] & found) > 0:
+                    found.add(ix)
+                    changed = True
+        found.discard(self._steps.index(step))
+        return [ self._steps[ix] for ix in sorted(found) ]
+
+    def ready(self, done, started=()):
+        '''
+        Returns the steps whose dependencies are all in 'done', excluding those done or started.
+        '''
+        doneIx = set([ self._steps.index(step) for step in done ])
+        startedIx = set([ self._steps.index(step) for step in started ])
+        return [ self._steps[ix] for ix in range(len(self._steps)) \
+                 if ix not in doneIx and ix not in startedIx and self._deps[ix].issubset(doneIx) ]
+
+    def levels(self, maxConcurrent=0):
+        '''
+        Returns lists of steps to be run one list after another, with the steps in each list run
+        at once.  With maxConcurrent, no list holds more than that many steps.
+        '''
+        levels = []
+        for level in self._levels:
+            if maxConcurrent <= 0:
+                levels.append([ self._steps[ix] for ix in level ])
+                continue
+            for start in range(0, len(level), maxConcurrent):
+                levels.append([ self._steps[ix] for ix in level[start:start + maxConcurrent] ])
+        return levels
+
+    def __str__(self):
+        lines = []
+        for ix in range(len(self._steps)):
+            deps = [ self._steps[dep].name for dep in sorted(self._deps[ix]) ]
+            lines.append(self._steps[ix].name + ' <- ' + ', '.join(deps))
+        return '\n'.join(lines)
@@ -4,9 +4,11 @@
 #
 # Inputs: 1 bam, pre-registered in the analysis keyed as: 'alignmentRep' + replicate + '.bam'
 # Outputs: 1 interim Corr       file, keyed as: 'strandCorr' + suffix +    '.txt'
+#          1 interim sample bam file, keyed as: 'alignment' + suffix +     '_5M.bam'
 #          1 target json        file, keyed as: 'bamEvaluate' + suffix +   '.json'
 
-from src.logicalStep import LogicalStep
+import os
+from src.logicalStep import LogicalStep, GB
 from src.settings import Settings
 
 class BamEvaluateStep(LogicalStep):
@@ -20,28 +22,42 @@ class BamEvaluateStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('edwBamStats', self.getToolVersion('edwBamStats'))
-            raFile.add('samtools', self.getToolVersion('samtools'))
-            raFile.add('Rscript', self.getToolVersion('Rscript'))
-            raFile.add('run_spp.R', self.getToolVersion(self.ana.toolsDir+'run_spp.R'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('edwBamStats')
-            self.getToolVersion('samtools')
-            self.getToolVersion('Rscript')
-            self.getToolVersion(self.ana.toolsDir+'run_spp.R')
+        tools = [ 'edwBamStats', 'samtools', 'Rscript',
+                  ('run_spp.R', self.ana.toolsDir+'run_spp.R') ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (1, 4 * GB)
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('replicate', self.replicate), ('suffix', self.suffix) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ 'alignmentRep' + self.replicate + '.bam' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'strandCorr' + self.suffix + '.txt', 'alignment' + self.suffix + '_5M.bam',
+                 'bamEvaluate' + self.suffix + '.json' ]
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        if self.ana.type == 'DNase':
+            return [ 'eap_dnase_stats' ]
+        return [ 'eap_eval_bam' ]
 
     def onRun(self):
         # Inputs:
-        bam = self.ana.getFile('alignmentRep' + self.replicate + '.bam')
+        bam = self.stageInput('alignmentRep' + self.replicate + '.bam')
         
         # Outputs:
         strandCorr = self.declareInterimFile('strandCorr'+ self.suffix + '.txt')
-        bamSample  = self.declareGarbageFile('alignment' + self.suffix + '_5M.bam')
+        bamSample  = self.declareInterimFile('alignment' + self.suffix + '_5M.bam')
 
         # Run the val script
         statsRa  = self.declareGarbageFile('stats.ra')
@@ -49,6 +65,8 @@ class BamEvaluateStep(LogicalStep):
             tagLen = 36 # 100? TODO find this info from somewhere
             spotsRa  = self.declareGarbageFile('spots.ra')
             self.eap_dnase_stats(bam,self.ana.genome,tagLen,statsRa,strandCorr,spotsRa)
+            if not self.ana.dryRun:  # The script leaves its 5M read sample in the step dir
+                os.rename(self.dir + '5M.bam', self.dir + bamSample)
         else:
             self.eap_eval_bam(bam,bamSample,statsRa,strandCorr)
         
@@ -136,28 +154,25 @@ class BamEvaluateStep(LogicalStep):
     def eap_eval_bam(self, inBam, outSampleBam, outStats, outStrandCorr):
         '''Evaluate bam file'''
     
-        cmd = "eap_eval_bam {bamIn} {bamOut} {statsOut} {strandCorrOut}".format( \
-              bamIn=inBam, bamOut=outSampleBam, statsOut=outStats, strandCorrOut=outStrandCorr)
+        cmd = [ 'eap_eval_bam', inBam, outSampleBam, outStats, outStrandCorr ]
           
         toolName = 'eap_eval_bam'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
 
     def eap_dnase_stats(self, inBam, genome, tagLen, outBamStats, outStrandCorr, outSpots):
         '''Evaluate bam file for DNase experiments'''
     
         #eap_dnase_stats in.bam target readSize bamStats.ra sppStats.ra spotStats.ra
-        cmd = "eap_dnase_stats {bamIn} {db} {readSize} {bamStatsOut} {sppOut} {spotsOut}".format( \
-              bamIn=inBam, db=genome, readSize=tagLen, bamStatsOut=outBamStats, \
-              sppOut=outStrandCorr, spotsOut=outSpots)
+        cmd = [ 'eap_dnase_stats', inBam, genome, tagLen, outBamStats, outStrandCorr, outSpots ]
           
         toolName = 'eap_dnase_stats'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
 
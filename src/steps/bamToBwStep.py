@@ -5,7 +5,7 @@
 # Inputs: 1 bam, pre-registered in analysis, keyed as: 'alignment' + suffix + '.bam'
 # Outputs: target signal file, keyed as: 'signal + suffix + readFilter + strand + '.bw'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class BamToBwStep(LogicalStep):
 
@@ -13,39 +13,71 @@ class BamToBwStep(LogicalStep):
         self.suffix = str(suffix)
         self.readFilter = readFilter
         self.strand     = strand
+        # readFilter and/or strand may be 'Both', in which case the variants run concurrently
         LogicalStep.__init__(self, analysis, 'bamToBws_' + \
                                                     readFilter.lower() + strand + '_' + suffix)
         self._stepVersion = self._stepVersion + 0  # Increment allows changing all set versions
 
+    def variants(self):
+        '''Returns the (readFilter, strand) pairs that this step generates.'''
+        readFilters = [ self.readFilter ]
+        if self.readFilter.lower() == 'both':
+            readFilters = [ 'All', 'Uniq' ]
+        strands = [ self.strand ]
+        if self.strand.lower() == 'both':
+            strands = [ 'Plus', 'Minus' ]
+        return [ (readFilter, strand) for readFilter in readFilters for strand in strands ]
+
     def writeVersions(self,raFile=None,allLevels=False,scriptName=None):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName,self.getToolVersion(scriptName))
-            raFile.add('samtools',    self.getToolVersion('samtools'))
-            raFile.add('makewigglefromBAM-NH.py', \
-                                      self.getToolVersion('makewigglefromBAM-NH.py'))
-            raFile.add('python2.7',   self.getToolVersion('python2.7'))
-            raFile.add('wigToBigWig', self.getToolVersion('wigToBigWig'))
-            #raFile.add('perl', self.getToolVersion('perl'))
+        tools = [ 'samtools', 'makewigglefromBAM-NH.py', 'python2.7', 'wigToBigWig' ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (len(self.variants()), 2 * GB * len(self.variants()))
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('suffix', self.suffix), ('readFilter', self.readFilter),
+                 ('strand', self.strand) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ 'alignment' + self.suffix + '.bam' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'signal' + self.suffix + readFilter + strand + '.bw' \
+                 for readFilter, strand in self.variants() ]
+
+    def scriptFor(self, readFilter, strand):
+        '''Returns the glue script converting one variant.'''
+        # Since eap_run scripts are not supposed to have if statements, there are 4 versions
+        # of the same thing and the ifs are here.
+        script = 'eap_run_bam_to_bw'
+        if readFilter.lower() == 'uniq' or readFilter.lower() == 'all':
+            script += '_' + readFilter.lower()
         else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('samtools')
-            self.getToolVersion('makewigglefromBAM-NH.py')
-            self.getToolVersion('python2.7')
-            self.getToolVersion('wigToBigWig')
-            #self.getToolVersion('perl')
+            raise Exception("Read filter may only be 'All', 'Uniq' or 'Both'.")
+        if strand.lower() == 'plus' or strand.lower() == 'minus':
+            script += '_' + strand.lower()
+        else:
+            raise Exception("Strand may only be 'Plus', 'Minus' or 'Both'.")
+        return script
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        return [ self.scriptFor(readFilter, strand) for readFilter, strand in self.variants() ]
 
     def onRun(self):
         # Inputs:
-        bam = self.ana.getFile('alignment' + self.suffix + '.bam')
+        bam = self.stageInput('alignment' + self.suffix + '.bam')
         
-        # Outputs:
-        outBw  = self.declareTargetFile('signal'+self.suffix+self.readFilter+self.strand+'.bw')
-
         # if bam is unindexed, create an index.
         #bai = bam + '.bai'
         #if not os.path.exists(bai):
@@ -56,32 +88,21 @@ class BamToBwStep(LogicalStep):
         if self.ana.gender == 'female':  # male and unspecified are treated the same
             chromFile = self.ana.refDir + self.ana.gender + '.' + self.ana.genome + "/chrom.sizes"
 
-        # Since eap_run scripts are not supposed to have if statements, there are 4 versions
-        # of the same thing and the ifs are here.
-        script = 'eap_run_bam_to_bw'
-        readFilter = self.readFilter.lower()
-        if readFilter == 'uniq' or readFilter == 'all':
-            script += '_' + readFilter 
-        else:
-            raise Exception("Read filter may only be 'All' or 'Uniq'.")
-        strand = self.strand.lower()
-        if strand == 'plus' or strand == 'minus':
-            script += '_' + strand 
-        else:
-            raise Exception("Strand may only be 'Plus' or 'Minus'.")
-        
-        # Run the script
-        self.eap_bamToBw(script, bam, chromFile, outBw)
+        for readFilter, strand in self.variants():
+            # Outputs:
+            outBw = self.declareTargetFile('signal'+self.suffix+readFilter+strand+'.bw')
+
+            # Launch the script
+            self.eap_bamToBw(self.scriptFor(readFilter, strand), bam, chromFile, outBw)
+
+        # All variants are independent, so they run at once
+        self.waitForTools()
         
     def eap_bamToBw(self, script, inBam, chromFile, outBw):
-        '''Hostspot peak calling'''
+        '''Launches bam to bigWig signal conversion'''
         
         toolName = script
-        cmd = "{tool} {bam} {chroms} {bwOut}".format( \
-              tool=toolName, bam=inBam, chroms=chromFile, bwOut=outBw)
+        cmd = [ toolName, inBam, chromFile, outBw ]
             
-        self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
-        
-        self.err = self.ana.runCmd(cmd, log=self.log)
-        self.toolEnds(toolName,self.err)
+        self.submitTool(toolName, cmd)
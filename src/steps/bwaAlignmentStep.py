@@ -9,8 +9,8 @@
 # Outputs: a single bam target keyed as:
 #          'alignmentRep'+replicate+'.bam'
 
-from src.logicalStep import LogicalStep
-from src.wrappers import samtools
+from src.logicalStep import LogicalStep, GB
+from src.wrappers import samtools, bwa, ucscUtils
 
 class BwaAlignmentStep(LogicalStep):
 
@@ -25,25 +25,55 @@ class BwaAlignmentStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('bwa', self.getToolVersion('bwa'))
-            raFile.add('samtools', self.getToolVersion('samtools'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('bwa')
-            self.getToolVersion('samtools')
-        
+        tools = [ 'bwa', 'samtools' ]
+        if self.ana.readType == 'paired' and self.encoding.lower().startswith('solexa'):
+            tools.append('edwSolexaToSangerFastq')
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        # bwa aln uses 4 threads.  Both reads of a pair are aligned at once (see bwa_pe), if
+        # granted the cpus for it
+        if self.ana.readType == 'paired':
+            return (8, 10 * GB)
+        return (4, 6 * GB)
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('replicate', self.replicate), ('encoding', self.encoding) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        if self.ana.readType == 'paired':
+            return [ 'tagsRd1Rep' + self.replicate + '.fastq',
+                     'tagsRd2Rep' + self.replicate + '.fastq' ]
+        return [ 'tagsRep' + self.replicate + '.fastq' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'alignmentRep' + self.replicate + '.bam' ]
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        prefix = 'eap_run_'
+        if self.encoding.lower().startswith('solexa'):
+            prefix = 'eap_run_slx_'
+        elif not self.encoding.lower().startswith('sanger'):
+            return []
+        if self.ana.readType == 'paired':
+            return []  # Run step by step in bwa_pe()
+        return [ prefix + 'bwa_se' ]
+
     def onRun(self):
         
         # Inputs:
         if self.ana.readType == 'single':
-            input1 = self.ana.getFile('tagsRep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRep' + self.replicate + '.fastq')
         elif self.ana.readType == 'paired':
-            input1 = self.ana.getFile('tagsRd1Rep' + self.replicate + '.fastq')
-            input2 = self.ana.getFile('tagsRd2Rep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRd1Rep' + self.replicate + '.fastq')
+            input2 = self.stageInput('tagsRd2Rep' + self.replicate + '.fastq')
              
         # Outputs:
         bam = self.declareTargetFile('alignmentRep' + self.replicate + '.bam')
@@ -60,12 +90,12 @@ class BwaAlignmentStep(LogicalStep):
             if self.ana.readType == 'single':
                 self.eap_se(refFile, input1, bam)
             elif self.ana.readType == 'paired':
-                self.eap_pe(refFile, input1, input2, bam)
+                self.bwa_pe(refFile, input1, input2, bam)
         elif self.encoding.lower().startswith('solexa'):
             if self.ana.readType == 'single':
                 self.eap_slx_se(refFile, input1, bam)
             elif self.ana.readType == 'paired':
-                self.eap_slx_pe(refFile, input1, input2, bam)
+                self.bwa_pe(refFile, input1, input2, bam, solexa=True)
         else:
             self.fail("fastq encoding '" + self.encoding + "' is not supported.")
                 
@@ -79,57 +109,54 @@ class BwaAlignmentStep(LogicalStep):
         
         # Using bash scripts to run bwa single-end on sanger style fastq
         # usage v3: eap_run_bwa_se bwa-index reads.fq out.bam
-        cmd = "eap_run_bwa_se {ref} {fq} {output}".format( \
-              ref=refFile, fq=fastq, output=outBam)
+        cmd = [ 'eap_run_bwa_se', refFile, fastq, outBam ]
               
         toolName = 'eap_run_bwa_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
     
-    def eap_pe(self, refFile, fastq1, fastq2, outBam):
-        '''Paired end bam generation'''
-        
-        # Using bash scripts to run bwa paired-end on sanger style fastqs
-        # usage v4: eap_run_bwa_pe bwa-index read1.fq read2.fq out.bam
-        cmd = "eap_run_bwa_pe {ref} {fq1} {fq2} {output}".format( \
-              ref=refFile, fq1=fastq1, fq2=fastq2, output=outBam)
-              
-        toolName = 'eap_run_bwa_pe'
-        self.toolBegins(toolName)
-        self.writeVersions(scriptName=toolName)
-        
-        self.err = self.ana.runCmd(cmd, log=self.log)
-        self.toolEnds(toolName,self.err)
+    def bwa_pe(self, refFile, fastq1, fastq2, outBam, solexa=False):
+        '''
+        Paired end bam generation, as eap_run_bwa_pe (or eap_run_slx_bwa_pe for solexa style
+        fastqs) does it, but with the two 'bwa aln' read passes, which are independent, run at
+        once.
+        '''
+        self.writeVersions()
+        if solexa:
+            # Convert both fastqs to sanger format quality scores
+            sanger1 = self.declareGarbageFile('sanger1.fq')
+            sanger2 = self.declareGarbageFile('sanger2.fq')
+            ucscUtils.submitSolexaToSangerFastq(self, fastq1, sanger1)
+            ucscUtils.submitSolexaToSangerFastq(self, fastq2, sanger2)
+            self.waitForTools()
+            fastq1 = sanger1
+            fastq2 = sanger2
+
+        # Using refFile as an index, align each read of the pair, then pair them
+        sai1 = self.declareGarbageFile('read1.sai')
+        sai2 = self.declareGarbageFile('read2.sai')
+        bwa.submitAln(self, refFile, fastq1, sai1)
+        bwa.submitAln(self, refFile, fastq2, sai2)
+        self.waitForTools()
+        sam = self.declareGarbageFile('paired.sam')
+        bwa.sampe(self, refFile, sai1, sai2, fastq1, fastq2, sam)
+        unsortedBam = self.declareGarbageFile('unsorted.bam')
+        samtools.samToBamWithHeader(self, sam, unsortedBam)
+        samtools.sort(self, unsortedBam, outBam)
     
     def eap_slx_se(self, refFile, solexaFq, outBam):
         '''Single end bam generation'''
         
         # Using bash scripts to run bwa single-end on solexa style fastq
         # usage v1: eap_run_slx_bwa_se bwa-index solexa-reads.fq out.bam
-        cmd = "eap_run_slx_bwa_se {ref} {fq} {output}".format( \
-              ref=refFile, fq=solexaFq, output=outBam)
+        cmd = [ 'eap_run_slx_bwa_se', refFile, solexaFq, outBam ]
               
         toolName = 'eap_run_slx_bwa_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
-        self.toolEnds(toolName,self.err)
-    
-    def eap_slx_pe(self, refFile, solexaFq1, solexaFq2, outBam):
-        '''Paired end bam generation'''
-        
-        # Using bash scripts to run bwa paired-end on solexa style fastqs
-        # usage v3: eap_run_slx_bwa_pe bwa-index solexa1.fq solexa2.fq out.bam
-        cmd = "eap_run_slx_bwa_pe {ref} {fq1} {fq2} {output}".format( \
-              ref=refFile, fq1=solexaFq1, fq2=solexaFq2, output=outBam)
-              
-        toolName = 'eap_run_slx_bwa_pe'
-        self.toolBegins(toolName)
-        self.writeVersions(scriptName=toolName)
-        
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
@@ -9,7 +9,7 @@
 #          html file in that directory                   keyed as: 'fastqVal'  + suffix + '.html'
 #          json file                                     keyed as: 'fastqVal' + suffix + '.json'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 from src.wrappers import ucscUtils
 
 class FastqValidationStep(LogicalStep):
@@ -23,12 +23,24 @@ class FastqValidationStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            raFile.add('ucscUtils', ucscUtils.version(self,tool='fastqStatsAndSubsample'))
-            raFile.add('fastqc', self.getToolVersion('fastqc'))
-        else:
-            ucscUtils.version(self,tool='fastqStatsAndSubsample')
-            self.getToolVersion('fastqc')
+        self.getToolVersions([ ('ucscUtils','fastqStatsAndSubsample'), 'fastqc' ], raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (1, 2 * GB)
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('suffix', self.suffix) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ 'tags' + self.suffix + '.fastq' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'fastqValDir' + self.suffix, 'fastqVal' + self.suffix + '.zip',
+                 'fastqVal' + self.suffix + '.html', 'fastqVal' + self.suffix + '.json' ]
 
     def onRun(self):
         # Inputs:
@@ -122,12 +134,12 @@ class FastqValidationStep(LogicalStep):
     def fastqc(self, inFastq, outDir):
         '''Validation'''
         
-        cmd = 'fastqc {fastq} --extract -q'.format( fastq=inFastq )
+        cmd = [ 'fastqc', inFastq, '--extract', '-q' ]
     
         toolName = __name__.split('.')[-1] + " validate"
         self.toolBegins(toolName)
         self.getToolVersion('fastqc', logOut=True)
     
-        self.err = self.ana.runCmd(cmd, log=self.log) # stdout goes to file
+        self.err = self.runCmd(cmd) # stdout goes to file
         self.toolEnds(toolName,self.err)
 
@@ -7,7 +7,7 @@
 #          target narrowPeak peaks file,      keyed as: 'peaks'     + suffix + '.bigBed'
 #          target density bigWig file,        keyed as: 'density'   + suffix + '.bigWig'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class HotspotStep(LogicalStep):
 
@@ -21,38 +21,32 @@ class HotspotStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            raFile.add('eap_run_hotspot', self.getToolVersion('eap_run_hotspot'))
-            raFile.add('hotspot',     self.getToolVersion( \
-                                      self.ana.toolsDir+'hotspot-distr/hotspot-deploy/bin/hotspot'))
-            raFile.add('python2.7',   self.getToolVersion('python2.7'))
-            raFile.add('hotspot.py',  self.getToolVersion('hotspot.py'))
-            raFile.add('bedToBigBed', self.getToolVersion('bedToBigBed'))
-            raFile.add('bedmap',      self.getToolVersion('bedmap'))
-            raFile.add('sort-bed',    self.getToolVersion('sort-bed'))
-            raFile.add('starchcat',   self.getToolVersion('starchcat'))
-            raFile.add('unstarch',    self.getToolVersion('unstarch'))
-            raFile.add('intersectBed',self.getToolVersion( \
-                                                    self.ana.toolsDir+'bedtools/bin/intersectBed'))
-            raFile.add('bedGraphPack',self.getToolVersion('bedGraphPack'))
-            raFile.add('bedGraphToBigWig', self.getToolVersion('bedGraphToBigWig'))
-        else:
-            self.getToolVersion('eap_run_hotspot')
-            self.getToolVersion(self.ana.toolsDir+'hotspot-distr/hotspot-deploy/bin/hotspot')
-            self.getToolVersion('python2.7')
-            self.getToolVersion('hotspot.py')
-            self.getToolVersion('bedToBigBed')
-            self.getToolVersion('bedmap')
-            self.getToolVersion('sort-bed')
-            self.getToolVersion('starchcat')
-            self.getToolVersion('unstarch')
-            self.getToolVersion(self.ana.toolsDir+'bedtools/bin/intersectBed')
-            self.getToolVersion('bedGraphPack')
-            self.getToolVersion('bedGraphToBigWig')
+        self.getToolVersions([ 'eap_run_hotspot',
+            ('hotspot', self.ana.toolsDir+'hotspot-distr/hotspot-deploy/bin/hotspot'),
+            'python2.7', 'hotspot.py', 'bedToBigBed', 'bedmap', 'sort-bed', 'starchcat',
+            'unstarch', ('intersectBed', self.ana.toolsDir+'bedtools/bin/intersectBed'),
+            'bedGraphPack', 'bedGraphToBigWig' ], raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (1, 4 * GB + inputBytes)
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('suffix', self.suffix), ('tagLen', self.tagLen) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ 'alignment' + self.suffix + '.bam' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'hot' + self.suffix + '.bigBed', 'peaks' + self.suffix + '.bigBed',
+                 'density' + self.suffix + '.bigWig' ]
 
     def onRun(self):
         # Inputs:
-        bam = self.ana.getFile('alignment' + self.suffix + '.bam')
+        bam = self.stageInput('alignment' + self.suffix + '.bam')
 
         # Outputs:
         broadPeaks  = self.declareTargetFile('hot'     + self.suffix + '.bigBed')
@@ -64,13 +58,11 @@ class HotspotStep(LogicalStep):
     def eap_hotspot(self, genome, inBam, tagLen, outNarrowPeak, outBroadPeak, outBigWig):
         '''Hostspot peak calling'''
         
-        cmd = "eap_run_hotspot {db} {bam} {readLen} {narrowOut} {broadOut} {bwOut}".format( \
-              db=genome, bam=inBam, readLen=tagLen, \
-              narrowOut=outNarrowPeak, broadOut=outBroadPeak, bwOut=outBigWig)
+        cmd = [ 'eap_run_hotspot', genome, inBam, tagLen, outNarrowPeak, outBroadPeak, outBigWig ]
               
         toolName = 'eap_run_hotspot'
         self.toolBegins(toolName)
         self.writeVersions()
 
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
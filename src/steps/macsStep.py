@@ -7,7 +7,7 @@
 # Outputs: target narrowPeak peaks file,      keyed as: 'peaks'     + suffix + '.bigBed'
 #          target density bigWig file,        keyed as: 'density'   + suffix + '.bigWig'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class MacsStep(LogicalStep):
 
@@ -22,27 +22,47 @@ class MacsStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('macs',                     self.getToolVersion('macs2'))
-            raFile.add('eap_macs2_xls_to_narrowPeak', 
-                                                self.getToolVersion('eap_macs2_xls_to_narrowPeak'))
-            raFile.add('eap_narrowPeak_to_bigBed', self.getToolVersion('eap_narrowPeak_to_bigBed'))
-            raFile.add('bedGraphToBigWig',         self.getToolVersion('bedGraphToBigWig'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('macs2')
-            self.getToolVersion('eap_macs2_xls_to_narrowPeak')
-            self.getToolVersion('eap_narrowPeak_to_bigBed')
-            self.getToolVersion('bedGraphToBigWig')
+        tools = [ ('macs','macs2'), 'eap_macs2_xls_to_narrowPeak',
+                  'eap_narrowPeak_to_bigBed', 'bedGraphToBigWig' ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (1, 2 * GB + inputBytes) # macs2 holds all tags in memory
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('suffix', self.suffix), ('expType', self.expType), ('isPaired', self.isPaired) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        keys = [ 'alignment' + self.suffix + '.bam' ]
+        if self.expType.lower() == 'chipseq':
+            keys.append('control' + self.suffix + '.bam')
+        return keys
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'peaks' + self.suffix + '.bigBed', 'density' + self.suffix + '.bigWig' ]
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        pairing = '_se'
+        if self.isPaired:
+            pairing = '_pe'
+        if self.expType.lower() == 'chipseq':
+            return [ 'eap_run_macs2_chip' + pairing ]
+        elif self.expType.lower() == 'dnase':
+            return [ 'eap_run_macs2_dnase' + pairing ]
+        return []
 
     def onRun(self):
         # Inputs:
-        bam = self.ana.getFile('alignment' + self.suffix + '.bam')
+        bam = self.stageInput('alignment' + self.suffix + '.bam')
         if self.expType.lower() == 'chipseq':
-            control = self.ana.getFile('control' + self.suffix + '.bam')
+            control = self.stageInput('control' + self.suffix + '.bam')
 
         # Outputs:
         narrowPeaks = self.declareTargetFile('peaks'   + self.suffix + '.bigBed')
@@ -66,58 +86,50 @@ class MacsStep(LogicalStep):
         '''Single-end macs2 peak-calling for DNase'''
         
         # usage v2: eap_run_macs2_dnase_se target in.bam out.narrowPeak.bigBed out.bigWig
-        cmd = "eap_run_macs2_dnase_se {target} {bam} {bbOut} {bwOut}".format( \
-              target=genome, bam=inBam, \
-              bbOut=outBigBed, bwOut=outBigWig)
+        cmd = [ 'eap_run_macs2_dnase_se', genome, inBam, outBigBed, outBigWig ]
               
         toolName = 'eap_run_macs2_dnase_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
     
     def eap_dnase_pe(self, genome, inBam, outBigBed, outBigWig):
         '''Paired-end macs2 peak-calling for DNase'''
         
         # usage v2: eap_run_macs2_dnase_pe target in.bam out.narrowPeak.bigBed out.bigWig
-        cmd = "eap_run_macs2_dnase_pe {target} {bam} {bbOut} {bwOut}".format( \
-              target=genome, bam=inBam, \
-              bbOut=outBigBed, bwOut=outBigWig)
+        cmd = [ 'eap_run_macs2_dnase_pe', genome, inBam, outBigBed, outBigWig ]
               
         toolName = "eap_run_macs2_dnase_pe"
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
     
     def eap_chip_se(self, genome, inBam, controlBam, outBigBed, outBigWig):
         '''Single-end macs2 peak-calling for Chip-seq'''
         
         # usage v1: eap_run_macs2_chip_se target in.bam control.bam out.narrowPeak.bigBed out.bigWig
-        cmd = "eap_run_macs2_chip_se {target} {bam} {bamControl} {bbOut} {bwOut}".format( \
-              target=genome, bam=inBam, bamControl=controlBam, \
-              bbOut=outBigBed, bwOut=outBigWig)
+        cmd = [ 'eap_run_macs2_chip_se', genome, inBam, controlBam, outBigBed, outBigWig ]
               
         toolName = 'eap_run_macs2_chip_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
     
     def eap_chip_pe(self, genome, inBam, controlBam, outBigBed, outBigWig):
         '''Paired-end macs2 peak-calling for Chip-seq'''
         
         # usage v1: eap_run_macs2_chip_pe target in.bam control.bam out.narrowPeak.bigBed out.bigWig
-        cmd = "eap_run_macs2_chip_pe {target} {bam} {bamControl} {bbOut} {bwOut}".format( \
-              target=genome, bam=inBam, bamControl=controlBam, \
-              bbOut=outBigBed, bwOut=outBigWig)
+        cmd = [ 'eap_run_macs2_chip_pe', genome, inBam, controlBam, outBigBed, outBigWig ]
               
         toolName = 'eap_run_macs2_chip_pe'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
     
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
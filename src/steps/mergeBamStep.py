@@ -2,18 +2,23 @@
 # mergeBamStep.py module holds MergeBamStep class which descends from LogicalStep class.
 # It merges 2 bam files using samtools merge.
 #
-# Inputs: 2 bam files, pre-registered in the analysis and both keyed as: 'bamRep' + replicateN + '.bam'
+# Inputs: 2 bam files, pre-registered in the analysis and both keyed as:
+#                                                         inPrefix + 'Rep' + replicateN + '.bam'
 #
-# Outputs: 1 merged bam keyed as: 'mergedRep' + replicate1 + 'Rep' +replicate2 + '.bam'
+# Outputs: 1 merged bam keyed as: outPrefix + 'Rep' + replicate1 + 'Rep' +replicate2 + '.bam'
+#          The prefixes default to 'bam' and 'merged'.
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 from src.wrappers import samtools
 
 class MergeBamStep(LogicalStep):
 
-    def __init__(self, analysis, replicate1='1', replicate2='2'):
+    def __init__(self, analysis, replicate1='1', replicate2='2', inPrefix='bam',
+                 outPrefix='merged'):
         self.replicate1 = str(replicate1)
         self.replicate2 = str(replicate2)
+        self.inPrefix   = inPrefix
+        self.outPrefix  = outPrefix
         LogicalStep.__init__(self, analysis, \
                              'mergeBam_Rep' + self.replicate1 + 'Rep' + self.replicate2)
         self._stepVersion = self._stepVersion + 0  # Increment allows changing all set versions
@@ -22,19 +27,34 @@ class MergeBamStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            raFile.add('samtools', samtools.version(self))
-        else:
-            samtools.version(self)
+        self.getToolVersions([ 'samtools' ], raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (1, 2 * GB)
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('replicate1', self.replicate1), ('replicate2', self.replicate2),
+                 ('inPrefix', self.inPrefix), ('outPrefix', self.outPrefix) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ self.inPrefix + 'Rep' + self.replicate1 + '.bam',
+                 self.inPrefix + 'Rep' + self.replicate2 + '.bam' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ self.outPrefix + 'Rep' + self.replicate1 + 'Rep' + self.replicate2 + '.bam' ]
 
     def onRun(self):
         # Inputs:
-        bamRep1 = self.ana.getFile('bamRep' + self.replicate1 + '.bam')
-        bamRep2 = self.ana.getFile('bamRep' + self.replicate2 + '.bam')
+        bamRep1 = self.stageInput(self.inPrefix + 'Rep' + self.replicate1 + '.bam')
+        bamRep2 = self.stageInput(self.inPrefix + 'Rep' + self.replicate2 + '.bam')
         
         # Outputs:  
-        mergedBam = self.declareTargetFile('mergedRep' + self.replicate1 + 'Rep' + \
-                                                         self.replicate2+'.bam')
+        mergedBam = self.declareTargetFile(self.outPrefix + 'Rep' + self.replicate1 + 'Rep' + \
+                                                                    self.replicate2+'.bam')
 
         # merge
         samtools.merge(self,[bamRep1,bamRep2],mergedBam)
@@ -6,7 +6,7 @@
 # Outputs: 1 target Gene       results tab file, keyed: 'quantifyGenesRsem'       + suffix + '.tab'
 #          1 target Transcript results tab file, keyed: 'quantifyTranscriptsRsem' + suffix + '.tab'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class RsemStep(LogicalStep):
 
@@ -19,23 +19,40 @@ class RsemStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('rsem', self.getToolVersion('rsem-calculate-expression'))
-            raFile.add('bowtie2', self.getToolVersion('bowtie2'))
-            raFile.add('samtools', self.getToolVersion('samtools'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('rsem-calculate-expression')
-            self.getToolVersion('bowtie2')
-            self.getToolVersion('samtools')
-        
+        tools = [ ('rsem','rsem-calculate-expression'), 'bowtie2', 'samtools' ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (12, 34 * GB)  # -p 12 --ci-memory 30000, plus bowtie2
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('suffix', self.suffix) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        return [ 'annotation' + self.suffix + '.bam' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'quantifyGenesRsem' + self.suffix + '.tab',
+                 'quantifyTranscriptsRsem' + self.suffix + '.tab' ]
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        if self.ana.type != 'RNAseq-long':
+            return []
+        if self.ana.readType == 'paired':
+            return [ 'eap_run_rsem_long_pe' ]
+        return [ 'eap_run_rsem_long_se' ]
+
     def onRun(self):
         
         # Inputs:
-        annoBam = self.ana.getFile('annotation' + self.suffix + '.bam')
+        annoBam = self.stageInput('annotation' + self.suffix + '.bam')
              
         # Outputs:
         genesFile = self.declareTargetFile('quantifyGenesRsem'       + self.suffix + '.tab')
@@ -57,25 +74,23 @@ class RsemStep(LogicalStep):
     def eap_long_pe(self, refDir, inAnnoBam, outGene, outTrans):
         '''RSEM quantification for paired-end datasets'''
         
-        cmd = "eap_run_rsem_long_pe {ref} {annoBamIn} {geneOut} {transOut}".format( \
-              ref=refDir, annoBamIn=inAnnoBam, geneOut=outGene, transOut=outTrans,)
+        cmd = [ 'eap_run_rsem_long_pe', refDir, inAnnoBam, outGene, outTrans ]
               
         toolName = 'eap_run_rsem_long_pe'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
 
     def eap_long_se(self, refDir, inAnnoBam, outGene, outTrans):
         '''RSEM quantification for single-end datasets'''
         
-        cmd = "eap_run_rsem_long_se {ref} {annoBamIn} {geneOut} {transOut}".format( \
-              ref=refDir, annoBamIn=inAnnoBam, geneOut=outGene, transOut=outTrans)
+        cmd = [ 'eap_run_rsem_long_se', refDir, inAnnoBam, outGene, outTrans ]
               
         toolName = 'eap_run_rsem_long_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
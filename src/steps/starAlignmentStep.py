@@ -15,7 +15,7 @@
 #          or 2 (unpaired/unstranded) target signals:  'signalStarRep' + replicate +      'Uniq.bw'
 #                                                      'signalStarRep' + replicate +       'All.bw'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class StarAlignmentStep(LogicalStep):
 
@@ -32,25 +32,55 @@ class StarAlignmentStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('star', self.getToolVersion('STAR'))
-            raFile.add('samtools', self.getToolVersion('samtools'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('STAR')
-            self.getToolVersion('samtools')
-        
+        tools = [ ('star','STAR'), 'samtools' ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (12, 32 * GB)  # --runThreadN 12, and the genome index is loaded in memory
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('replicate', self.replicate), ('libId', self.libId),
+                 ('encoding', self.encoding), ('tagLen', self.tagLen) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        if self.ana.readType == 'paired':
+            return [ 'tagsRd1Rep' + self.replicate + '.fastq',
+                     'tagsRd2Rep' + self.replicate + '.fastq' ]
+        return [ 'tagsRep' + self.replicate + '.fastq' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        keys = [ 'genomeAlignedStarRep' + self.replicate + '.bam',
+                 'annotationAlignedStarRep' + self.replicate + '.bam',
+                 'statisticsStarRep' + self.replicate + '.txt' ]
+        signals = [ 'Uniq', 'All' ]
+        if self.ana.readType == 'paired':
+            signals = [ 'UniqMinus', 'UniqPlus', 'AllMinus', 'AllPlus' ]
+        for signal in signals:
+            keys.append('signalStarRep' + self.replicate + signal + '.bw')
+        return keys
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        if self.ana.type != 'RNAseq-long':
+            return []
+        if self.ana.readType == 'paired':
+            return [ 'eap_run_star_long_pe' ]
+        return [ 'eap_run_star_long_se' ]
+
     def onRun(self):
         
         # Inputs:
         if self.ana.readType == 'single':
-            input1 = self.ana.getFile('tagsRep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRep' + self.replicate + '.fastq')
         elif self.ana.readType == 'paired':
-            input1 = self.ana.getFile('tagsRd1Rep' + self.replicate + '.fastq')
-            input2 = self.ana.getFile('tagsRd2Rep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRd1Rep' + self.replicate + '.fastq')
+            input2 = self.stageInput('tagsRd2Rep' + self.replicate + '.fastq')
              
         # Outputs:
         genoBam = self.declareTargetFile(     'genomeAlignedStarRep' + self.replicate + '.bam')
@@ -88,30 +118,26 @@ class StarAlignmentStep(LogicalStep):
                     outUniqBw, outStats):
         '''Single-end unstranded genome and transcriptome alignment by STAR'''
         
-        cmd = "eap_run_star_long_se {ref} {chrRef} {lib} {fq} {genoBamOut} {annoBamOut} {allOut} {uniqOut} {statsOut}".format( \
-              ref=refDir, chrRef=chromRef, lib=libId, fq=fastq, genoBamOut=outGenoBam, \
-              annoBamOut=outAnnoBam, allOut=outAllBw, uniqOut=outUniqBw, statsOut=outStats)
+        cmd = [ 'eap_run_star_long_se', refDir, chromRef, libId, fastq, outGenoBam, outAnnoBam,
+                outAllBw, outUniqBw, outStats ]
               
         toolName = 'eap_run_star_long_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
 
     def eap_long_pe(self, refDir, chromRef, libId, fastq1, fastq2, outGenoBam, outAnnoBam, \
                     outAllMinusBw, outAllPlusBw, outUniqMinusBw, outUniqPlusBw, outStats):
         '''Paired-end stranded genome and transcriptome alignment by STAR'''
         
-        cmd = "eap_run_star_long_pe {ref} {chrRef} {lib} {fq1} {fq2} {genoBamOut} {annoBamOut} {allMinusOut} {allPlusOut} {uniqMinusOut} {uniqPlusOut} {statsOut}".format( \
-              ref=refDir, chrRef=chromRef, lib=libId, fq1=fastq1, fq2=fastq2, \
-              genoBamOut=outGenoBam, annoBamOut=outAnnoBam, \
-              allMinusOut=outAllMinusBw, allPlusOut=outAllPlusBw, \
-              uniqMinusOut=outUniqMinusBw, uniqPlusOut=outUniqPlusBw, statsOut=outStats)
+        cmd = [ 'eap_run_star_long_pe', refDir, chromRef, libId, fastq1, fastq2, outGenoBam,
+                outAnnoBam, outAllMinusBw, outAllPlusBw, outUniqMinusBw, outUniqPlusBw, outStats ]
               
         toolName = 'eap_run_star_long_pe'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
@@ -7,7 +7,7 @@
 #         Paired: 'tagsRd1Rep'+replicate+'.fastq' and 'tagsRd2Rep'+replicate+'.fastq' 
 # Outputs: a single bam target keyed as: 'alignmentTophatRep'+replicate+'.bam'
 
-from src.logicalStep import LogicalStep
+from src.logicalStep import LogicalStep, GB
 
 class TophatAlignmentStep(LogicalStep):
 
@@ -24,29 +24,47 @@ class TophatAlignmentStep(LogicalStep):
         '''Writes versions to to the log or a file.'''
         if allLevels:
             LogicalStep.writeVersions(self, raFile)
-        if raFile != None:
-            if scriptName  != None:
-                raFile.add(scriptName, self.getToolVersion(scriptName))
-            raFile.add('tophat', self.getToolVersion('tophat'))
-            raFile.add('bowtie2', self.getToolVersion('bowtie2'))
-            raFile.add('samtools', self.getToolVersion('samtools'))
-            raFile.add('tophat_bam_xsA_tag_fix.pl', self.getToolVersion('tophat_bam_xsA_tag_fix.pl'))
-        else:
-            if scriptName != None:
-                self.getToolVersion(scriptName)
-            self.getToolVersion('tophat')
-            self.getToolVersion('bowtie2')
-            self.getToolVersion('samtools')
-            self.getToolVersion('tophat_bam_xsA_tag_fix.pl')
-        
+        tools = [ 'tophat', 'bowtie2', 'samtools', 'tophat_bam_xsA_tag_fix.pl' ]
+        if scriptName != None:
+            tools.insert(0, scriptName)
+        self.getToolVersions(tools, raFile)
+
+    def resourceProfile(self, inputBytes):
+        '''Cpus and ram used by this step's tools.'''
+        return (8, 8 * GB)    # -p 8
+
+    def resultParams(self):
+        '''Step parameters the results depend upon.'''
+        return [ ('replicate', self.replicate), ('libId', self.libId),
+                 ('encoding', self.encoding), ('tagLen', self.tagLen) ]
+
+    def inputKeys(self):
+        '''Analysis files read by this step.'''
+        if self.ana.readType == 'paired':
+            return [ 'tagsRd1Rep' + self.replicate + '.fastq',
+                     'tagsRd2Rep' + self.replicate + '.fastq' ]
+        return [ 'tagsRep' + self.replicate + '.fastq' ]
+
+    def outputKeys(self):
+        '''Analysis files produced by this step.'''
+        return [ 'alignmentTophatRep' + self.replicate + '.bam' ]
+
+    def scriptNames(self):
+        '''Glue scripts onRun() will run.'''
+        if self.ana.type != 'RNAseq-long':
+            return []
+        if self.ana.readType == 'paired':
+            return [ 'eap_run_tophat_long_pe' ]
+        return [ 'eap_run_tophat_long_se' ]
+
     def onRun(self):
         
         # Inputs:
         if self.ana.readType == 'single':
-            input1 = self.ana.getFile('tagsRep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRep' + self.replicate + '.fastq')
         elif self.ana.readType == 'paired':
-            input1 = self.ana.getFile('tagsRd1Rep' + self.replicate + '.fastq')
-            input2 = self.ana.getFile('tagsRd2Rep' + self.replicate + '.fastq')
+            input1 = self.stageInput('tagsRd1Rep' + self.replicate + '.fastq')
+            input2 = self.stageInput('tagsRd2Rep' + self.replicate + '.fastq')
              
         # Outputs:
         bam = self.declareTargetFile('alignmentTophatRep' + self.replicate + '.bam')
@@ -72,25 +90,23 @@ class TophatAlignmentStep(LogicalStep):
     def eap_long_pe(self, refPrefix, annoPrefix, libId, fastq1, fastq2, outBam):
         '''Paired end bam generation'''
         
-        cmd = "eap_run_tophat_long_pe {ref} {anno} {lib} {fq1} {fq2} {output}".format( \
-              ref=refPrefix, anno=annoPrefix, lib=libId, fq1=fastq1, fq2=fastq2, output=outBam)
+        cmd = [ 'eap_run_tophat_long_pe', refPrefix, annoPrefix, libId, fastq1, fastq2, outBam ]
               
         toolName = 'eap_run_tophat_long_pe'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
 
     def eap_long_se(self, refPrefix, annoPrefix, libId, fastq, outBam):
         '''Single end bam generation'''
         
-        cmd = "eap_run_tophat_long_se {ref} {anno} {lib} {fq} {output}".format( \
-              ref=refPrefix, anno=annoPrefix, lib=libId, fq=fastq, output=outBam)
+        cmd = [ 'eap_run_tophat_long_se', refPrefix, annoPrefix, libId, fastq, outBam ]
               
         toolName = 'eap_run_tophat_long_se'
         self.toolBegins(toolName)
         self.writeVersions(scriptName=toolName)
         
-        self.err = self.ana.runCmd(cmd, log=self.log)
+        self.err = self.runCmd(cmd)
         self.toolEnds(toolName,self.err)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python2.7
+# toolCache.py module holds ToolCache class: a persistent on-disk cache of tool identities
+#              (md5sums) and resolved versions.  Entries are keyed by the resolved path plus the
+#              inode, size and mtime of the executable, so an entry is never used once the binary
+#              changes.  The cache is a directory of small files written atomically, so it can be
+#              shared by every analysis and Galaxy process using the same settings.
+
+import os, sys, json, hashlib, threading
+from ra.atomicFile import atomicWrite, fileStamp
+
+def md5sumOfFile(path, chunkSize=1048576):
+    '''Returns the md5sum of a file, computed in-process by streaming it.'''
+    digest = hashlib.md5()
+    fileH = open(path, 'rb')
+    try:
+        while True:
+            chunk = fileH.read(chunkSize)
+            if chunk == '':
+                break
+            digest.update(chunk)
+    finally:
+        fileH.close()
+    return digest.hexdigest()
+
+def findExecutable(executable, path=None):
+    '''Returns the full path of an executable found on the PATH (like 'which') or None.'''
+    if path == None:
+        path = os.environ.get('PATH', '')
+    for directory in path.split(os.pathsep):
+        candidate = os.path.join(directory, executable)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+class ToolCache(object):
+    '''
+    Caches md5sums and version command results for executables.
+
+    md5sum(path) returns the md5sum of the file, hashing it only when the cache misses.
+    version(path, versionCommand, probe) returns the cached result of running versionCommand
+    for that executable, calling probe() to run it only when the cache misses.
+    '''
+
+    def __init__(self, cacheDir=None):
+        self._cacheDir = cacheDir
+        if cacheDir != None and not cacheDir.endswith('/'):
+            self._cacheDir = cacheDir + '/'
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @property
+    def dir(self):
+        return self._cacheDir
+
+    def identity(self, path):
+        '''
+        Returns the identity string of a file: resolved path, inode, size and mtime.
+        Returns None if the file does not exist.
+        '''
+        realPath = os.path.realpath(path)
+        try:
+            size, mtime, inode = fileStamp(realPath)
+        except OSError:
+            return None
+        return '%s|%d|%d|%.6f' % (realPath, inode, size, mtime)
+
+    def md5sum(self, path):
+        '''Returns the md5sum of a file, or '' if it cannot be found.'''
+        identity = self.identity(path)
+        if identity == None:
+            return ''
+        key = 'md5sum|' + identity
+        value = self._get(key)
+        if value == None:
+            value = md5sumOfFile(os.path.realpath(path))
+            self._put(key, value)
+        return value
+
+    def version(self, path, versionCommand, probe):
+        '''
+        Returns the version reported by versionCommand for the executable at path.
+        probe() is called to actually run the command on a cache miss.
+        '''
+        identity = None
+        if path != None and path != '':
+            identity = self.identity(path)
+        if identity == None:
+            return probe() # Can't tell when it would change, so don't cache it
+        key = 'version|' + versionCommand + '|' + identity
+        value = self._get(key)
+        if value == None:
+            value = probe()
+            self._put(key, value)
+        return value
+
+    def _entryFile(self, key):
+        return self._cacheDir + hashlib.sha1(key).hexdigest()[:2] + '/' + \
+               hashlib.sha1(key).hexdigest() + '.json'
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        if self._cacheDir == None:
+            return None
+        try:
+            fileH = open(self._entryFile(key), 'r')
+            try:
+                entry = json.load(fileH)
+            finally:
+                fileH.close()
+        except (IOError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        value = str(entry['value'])
+        with self._lock:
+            self._memory[key] = value
+        return value
+
+    def _put(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+        if self._cacheDir == None:
+            return
+        # Write to a temp file then rename, so readers never see a partial entry
+        entryFile = self._entryFile(key)
+        try:
+            entryDir = os.path.dirname(entryFile)
+            if not os.path.isdir(entryDir):
+                try:
+                    os.makedirs(entryDir)
+                except OSError:
+                    pass # Another process just made it
+            with atomicWrite(entryFile) as fileH:
+                json.dump({ 'key': key, 'value': value }, fileH)
+        except (IOError, OSError):
+            pass # A cache that can't be written is just a slower cache
+
+
+############ command line testing ############
+if __name__ == '__main__':
+    '''
+    Command-line testing: toolCache.py {cacheDir} {executable} [{executable}...]
+    '''
+    cache = ToolCache(sys.argv[1])
+    for executable in sys.argv[2:]:
+        path = executable
+        if executable.find('/') == -1:
+            path = findExecutable(executable)
+        print executable, path, cache.md5sum(path)
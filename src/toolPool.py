@@ -0,0 +1,179 @@
+#!/usr/bin/env python2.7
+# toolPool.py module holds ToolPool and ToolFuture classes which let a LogicalStep launch several
+#             independent granular tools at once.  Each tool reserves some of the step's cpus
+#             and waits in line until they are free.  Tools are run in threads, since the work is
+#             done by child processes.  Any tool may be cancelled, which kills its process group.
+
+import signal, threading, Queue
+from datetime import datetime
+from process import killGroup
+
+class ToolFuture(object):
+    '''
+    A single granular tool submitted to a ToolPool.
+    '''
+
+    def __init__(self, toolName, cmd, cpus=1, log=None, logOut=True, logErr=True, stdout=None):
+        self.toolName  = toolName
+        self.cmd       = cmd
+        self.cpus      = cpus
+        self.log       = log     # Private log of this tool, merged by the step when done
+        self.logOut    = logOut
+        self.logErr    = logErr
+        self.stdout    = stdout
+        self.began     = None
+        self.ended     = None
+        self.result    = None    # ProcessResult once run
+        self.exception = None
+        self._proc     = None
+        self._cancelled = False
+        self._done     = threading.Event()
+        self._lock     = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def status(self):
+        '''Raw exit status (non-zero when cancelled or failed to launch).'''
+        if self.result != None:
+            return self.result.status
+        return -1
+
+    def done(self):
+        return self._done.is_set()
+
+    def succeeded(self):
+        return self.done() and self.exception == None and self.status == 0
+
+    def wait(self):
+        self._done.wait()
+        return self.result
+
+    def started(self, proc):
+        '''Called by the execution engine as soon as the process exists.'''
+        with self._lock:
+            self._proc = proc
+            cancelled = self._cancelled
+        if cancelled:
+            self._kill()
+
+    def cancel(self):
+        '''Prevents the tool from starting, or kills it if running.'''
+        with self._lock:
+            if self._cancelled or self.done():
+                return
+            self._cancelled = True
+            running = (self._proc != None)
+        if running:
+            self._kill()
+
+    def _kill(self):
+        killGroup(self._proc.pid, signal.SIGTERM)
+
+
+class ToolPool(object):
+    '''
+    Runs ToolFutures concurrently while the sum of their cpus stays within the budget.
+    'run' is called in a worker thread as run(future) and must return a ProcessResult.
+    '''
+
+    def __init__(self, cpus, run):
+        self._cpus = max(1, int(cpus))
+        self._free = self._cpus
+        self._run = run
+        self._cond = threading.Condition()
+        self._finished = Queue.Queue()
+        self._futures = []
+
+    @property
+    def futures(self):
+        return self._futures
+
+    def submit(self, future):
+        '''Queues the tool.  It starts as soon as enough cpus are free.'''
+        self._futures.append(future)
+        worker = threading.Thread(target=self._work, args=(future,))
+        worker.daemon = True
+        worker.start()
+        return future
+
+    def _work(self, future):
+        need = min(max(1, int(future.cpus)), self._cpus) # Never wait for more than there is
+        with self._cond:
+            while self._free < need and not future.cancelled:
+                self._cond.wait()
+            if not future.cancelled:
+                self._free -= need
+        if future.cancelled:
+            future._done.set()
+            self._finished.put(future)
+            return
+        try:
+            future.began = datetime.now()
+            future.result = self._run(future)
+        except Exception as e:
+            future.exception = e
+        finally:
+            future.ended = datetime.now()
+            with self._cond:
+                self._free += need
+                self._cond.notify_all()
+            future._done.set()
+            self._finished.put(future)
+
+    def cancelAll(self):
+        '''Cancels every tool that has not finished.'''
+        for future in self._futures:
+            future.cancel()
+        with self._cond:
+            self._cond.notify_all()
+
+    def asCompleted(self):
+        '''Yields each future once as it finishes.'''
+        remaining = len(self._futures)
+        while remaining > 0:
+            # A timeout keeps the main thread responsive to KeyboardInterrupt
+            try:
+                future = self._finished.get(True, 3600)
+            except Queue.Empty:
+                continue
+            remaining -= 1
+            yield future
+
+
+def parallelMap(func, items, threads=8):
+    '''
+    Returns [ func(item) for item in items ] computed in up to 'threads' threads.
+    The first exception raised by func is re-raised.
+    '''
+    items = list(items)
+    results = [ None ] * len(items)
+    errors = []
+    work = Queue.Queue()
+    for ix in range(len(items)):
+        work.put(ix)
+
+    def worker():
+        while True:
+            try:
+                ix = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[ix] = func(items[ix])
+            except Exception as e:
+                errors.append(e)
+
+    workers = []
+    for n in range(min(max(1, threads), len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return results
@@ -0,0 +1,176 @@
+#!/usr/bin/env python2.7
+# toolsDb.py module holds ToolsDb class: tools.ra compiled into an indexed SQLite file, so that
+#            a process can look up a tool by toolId (md5sum), name, name and version, or
+#            packageName without parsing tools.ra.  The compiled file ('tools.ra.db' beside
+#            tools.ra, or in a fallback dir if that is not writable) is rebuilt whenever tools.ra
+#            changes.  toolsRaCheck.py compiles it after checking tools.ra.
+#     Usage: toolsDb.py {tools.ra} [{name or toolId}...]
+
+import os, sys, time, marshal, hashlib
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None   # Python built without it: callers read tools.ra with Stanzas instead
+from stanzas import Stanzas
+from ra.atomicFile import replacing, fileStamp
+
+SCHEMA_VERSION = '1'
+SORT_ORDER = [ 'name', 'version', 'toolId' ]  # The last of a name in this order is the latest
+
+class ToolsDb(object):
+    '''
+    Read only, indexed lookups of tools.ra stanzas.  Stanzas are returned as dicts.
+    '''
+
+    def __init__(self, toolDbFile, dbFile=None, fallbackDir=None):
+        if sqlite3 == None:
+            raise Exception("Python was built without sqlite3: tools.ra cannot be compiled.")
+        self._toolDbFile = os.path.abspath(toolDbFile)
+        self._dbFile = dbFile
+        if self._dbFile == None:
+            self._dbFile = self._toolDbFile + '.db'
+        self._fallbackDir = fallbackDir
+        self._db = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()  # Connections cannot be pickled: reconnect when used
+        state['_db'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def file(self):
+        return self._dbFile
+
+    def _stamp(self):
+        return '%s|%d|%.6f|%d' % ((self._toolDbFile,) + fileStamp(self._toolDbFile))
+
+    def _isCurrent(self, dbFile, stamp):
+        if not os.path.exists(dbFile):
+            return False
+        try:
+            db = sqlite3.connect(dbFile)
+            try:
+                rows = db.execute("SELECT key, value FROM meta").fetchall()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return False
+        meta = dict(rows)
+        return meta.get('schema') == SCHEMA_VERSION and meta.get('source') == stamp
+
+    def connect(self):
+        '''Returns a connection to the compiled db, compiling it first if it is out of date.'''
+        if self._db != None and self._pid == os.getpid():
+            return self._db
+        self._db = None   # A connection must not be used across fork()
+        stamp = self._stamp()
+        if not self._isCurrent(self._dbFile, stamp):
+            try:
+                self.compile(self._dbFile)
+            except (IOError, OSError, sqlite3.Error):
+                if self._fallbackDir == None:
+                    raise
+                # Not allowed to write beside tools.ra: keep a private compiled copy
+                self._dbFile = self._fallbackDir + 'tools.' + \
+                               hashlib.sha1(self._toolDbFile).hexdigest()[:12] + '.db'
+                if not self._isCurrent(self._dbFile, stamp):
+                    self.compile(self._dbFile)
+        self._db = sqlite3.connect(self._dbFile, check_same_thread=False)
+        self._db.text_factory = str
+        self._pid = os.getpid()
+        return self._db
+
+    def compile(self, dbFile=None):
+        '''
+        Compiles tools.ra into dbFile (default the ToolsDb's file).  The db is built aside and
+        renamed into place, so processes reading the old one are unaffected.
+        '''
+        if dbFile == None:
+            dbFile = self._dbFile
+        stamp = self._stamp()
+        tools = Stanzas(self._toolDbFile)
+        dbDir = os.path.dirname(dbFile)
+        if dbDir != '' and not os.path.isdir(dbDir):
+            os.makedirs(dbDir)
+        with replacing(dbFile) as tmpFile:
+            db = sqlite3.connect(tmpFile)
+            try:
+                db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                db.execute("CREATE TABLE tools (toolId TEXT PRIMARY KEY, name TEXT, " + \
+                           "version TEXT, packageName TEXT, sortKey TEXT, stanza BLOB)")
+                rows = []
+                for key in tools.keys():
+                    stanza = tools[key]
+                    sortKey = ''.join([ stanza.get(setting, ' ').lower() + ' ' \
+                                        for setting in SORT_ORDER ])
+                    rows.append((key, stanza.get('name'), stanza.get('version'),
+                                 stanza.get('packageName'), sortKey,
+                                 sqlite3.Binary(marshal.dumps(stanza))))
+                db.executemany("INSERT INTO tools VALUES (?, ?, ?, ?, ?, ?)", rows)
+                db.execute("CREATE INDEX toolsByName ON tools (name, sortKey)")
+                db.execute("CREATE INDEX toolsByNameVersion ON tools (name, version)")
+                db.execute("CREATE INDEX toolsByPackage ON tools (packageName, sortKey)")
+                db.executemany("INSERT INTO meta VALUES (?, ?)",
+                               [ ('schema', SCHEMA_VERSION), ('source', stamp),
+                                 ('compiled', time.strftime("%Y-%m-%d %X")) ])
+                db.commit()
+            finally:
+                db.close()
+        return len(tools)
+
+    def _one(self, query, args):
+        row = self.connect().execute(query, args).fetchone()
+        if row == None:
+            return None
+        return marshal.loads(str(row[0]))
+
+    def _all(self, query, args):
+        rows = self.connect().execute(query, args).fetchall()
+        return [ marshal.loads(str(row[0])) for row in rows ]
+
+    def byId(self, toolId):
+        '''Returns the stanza of a toolId (md5sum), or None.'''
+        return self._one("SELECT stanza FROM tools WHERE toolId = ?", (toolId,))
+
+    def latestByName(self, name):
+        '''Returns the stanza of the latest version of a tool, or None.'''
+        return self._one("SELECT stanza FROM tools WHERE name = ? ORDER BY sortKey DESC " + \
+                         "LIMIT 1", (name,))
+
+    def byNameVersion(self, name, version):
+        '''Returns the stanza of a version of a tool, or None.'''
+        return self._one("SELECT stanza FROM tools WHERE name = ? AND version = ? " + \
+                         "ORDER BY sortKey DESC LIMIT 1", (name, version))
+
+    def byName(self, name):
+        '''Returns the stanzas of every version of a tool, oldest first.'''
+        return self._all("SELECT stanza FROM tools WHERE name = ? ORDER BY sortKey", (name,))
+
+    def byPackageName(self, packageName):
+        '''Returns the stanzas of every tool in a package.'''
+        return self._all("SELECT stanza FROM tools WHERE packageName = ? ORDER BY sortKey",
+                         (packageName,))
+
+
+############ command line testing ############
+if __name__ == '__main__':
+    '''
+    Command-line testing: compiles tools.ra if needed and looks up tools by name or toolId.
+    '''
+    toolsDb = ToolsDb(sys.argv[1])
+    began = time.time()
+    toolsDb.connect()
+    print "Connected to '" + toolsDb.file + "' in %.1fms" % ((time.time() - began) * 1000)
+    for arg in sys.argv[2:]:
+        began = time.time()
+        stanza = toolsDb.byId(arg)
+        if stanza == None:
+            stanza = toolsDb.latestByName(arg)
+        took = (time.time() - began) * 1000000
+        if stanza == None:
+            print "%-20s not found (%.0fus)" % (arg, took)
+        else:
+            print "%-20s %s %s %s (%.0fus)" % (arg, stanza['toolId'], stanza.get('name'),
+                                              stanza.get('version'), took)
@@ -4,13 +4,28 @@
 #            be verified are: md5sum, version, archive file and size of archive, and installed dir.
 #            Not every tool has all aof these settings defined and some may not be validatable.
 #            The md5sum can also be fixed, if it is in error.
-#     Usage: toolsRaCheck.py [--fixMd5sum] [{tools.ra}]
+#            Executables are hashed and version commands run by a pool of threads, each command
+#            being killed if it runs too long.  Results are cached (in '.tools.ra.checked') by
+#            each executable's size and mtime, so a rerun only re-checks tools that changed.
+#            Fixes are written in a single rewrite of tools.ra.
+#            Afterwards tools.ra is compiled into the indexed tools.ra.db read by analyses.
+#     Usage: toolsRaCheck.py [--fixMd5sum] [--threads=N] [--timeout=S] [--recheck] [{tools.ra}]
 #            --fixMd5sum  Updates md5sums if it is able to
+#            --threads=N  Number of tools to check at once (default 8)
+#            --timeout=S  Seconds a version command may take (default 60)
+#            --recheck    Ignore results cached by earlier runs
 #            {tools.ra}   File to check.  Default ${EAP_TOOLS_DIR}/tools.ra
 
 # imports needed for Settings class:
-import sys, os.path, commands
+import sys, os.path, commands, hashlib, marshal, signal, threading
+from multiprocessing.pool import ThreadPool
 from src.stanzas import Stanzas
+from src.process import execute, killGroup
+from src import toolsDb
+from ra import atomicFile
+
+CACHE_VERSION = 1
+MD5_BLOCK_BYTES = 1048576
 
 def backupFile(filePath):
     '''Back up the file before making any changes.'''
@@ -19,37 +34,153 @@ def backupFile(filePath):
         raise Exception("Failed to make a backup copy of " + filePath)
     print "Copied "+filePath+" to "+filePath+".bak"
         
+def replaceLines(filePath,replacements):
+    '''
+    Rewrites the file once, replacing each line found in the replacements dict of
+    {oldLine: newLine}.  The new file is renamed into place.  Returns the number replaced.
+    '''
+    found = set()
+    with atomicFile.atomicWrite(filePath) as newFile:
+        curFile = open(filePath, 'r')
+        try:
+            for line in curFile:
+                newLine = replacements.get(line.rstrip())
+                if newLine != None:
+                    found.add(line.rstrip())
+                    newFile.write(newLine+'\n')
+                else:
+                    newFile.write(line)
+        finally:
+            curFile.close()
+        missing = [ oldLine for oldLine in replacements.keys() if oldLine not in found ]
+        if len(missing) > 0:
+            raise Exception("Failed to find '"+missing[0]+"' in " + filePath)
+    for oldLine in sorted(found):
+        print "Updated '"+oldLine+"' to '"+replacements[oldLine]+"'"
+    return len(found)
+
 def replaceLine(filePath,oldLine,newLine):
     '''Rewrites the entire file replacing this one line.'''
-    found = False
-    curFile = open(filePath, 'r')
-    newFile = open(filePath+'.new', 'w')
-    while True:
-        line = curFile.readline()
-        if line == '':
-            curFile.close()
-            newFile.close()
-            break
-        if oldLine == line.rstrip():
-            found = True
-            newFile.write(newLine+'\n')
-        else:
-            newFile.write(line)
-    if found:
-        err = os.system('mv -f ' + filePath + '.new ' + filePath)
-        if err != 0:
-            raise Exception("Failed to update " + filePath)
-        print "Updated '"+oldLine+"' to '"+newLine+"'"
-    else:
-        raise Exception("Failed to find '"+oldLine+"' in " + filePath)
-    return found
-        
+    return (replaceLines(filePath, { oldLine: newLine }) == 1)
+
+def cacheFile(toolDbFile):
+    directory, name = os.path.split(os.path.abspath(toolDbFile))
+    return os.path.join(directory, '.' + name + '.checked')
+
+def loadCache(toolDbFile):
+    '''Returns the results cached by earlier runs, or empty ones.'''
+    try:
+        fileH = open(cacheFile(toolDbFile), 'rb')
+        try:
+            cache = marshal.load(fileH)
+        finally:
+            fileH.close()
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except (IOError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    return newCache()
+
+def newCache():
+    return { 'version': CACHE_VERSION, 'md5sums': {}, 'versions': {} }
+
+def saveCache(toolDbFile, cache):
+    '''Saves results for the next run.  Not being able to is not an error.'''
+    try:
+        with atomicFile.atomicWrite(cacheFile(toolDbFile), binary=True) as fileH:
+            marshal.dump(cache, fileH)
+    except (IOError, OSError):
+        pass
+
+def fileStamp(path):
+    '''Returns (size, mtime, inode) of a file, or None if it is not one.'''
+    try:
+        return atomicFile.fileStamp(path)
+    except OSError:
+        return None
+
+def md5sumOf(path, cache):
+    '''Returns the md5sum of a file, or None if it cannot be read.'''
+    stamp = fileStamp(path)
+    cached = cache['md5sums'].get(path)
+    if stamp != None and cached != None and cached[0] == stamp:
+        return cached[1]
+    try:
+        digest = hashlib.md5()
+        fileH = open(path, 'rb')
+        try:
+            while True:
+                block = fileH.read(MD5_BLOCK_BYTES)
+                if block == '':
+                    break
+                digest.update(block)
+        finally:
+            fileH.close()
+    except IOError:
+        return None
+    md5sum = digest.hexdigest()
+    if stamp != None:
+        cache['md5sums'][path] = (stamp, md5sum)
+    return md5sum
+
+def versionOf(versionCommand, executablePath, cache, timeout):
+    '''
+    Returns the output of a version command, cached by the size and mtime of the executable.
+    A command still running after timeout seconds is killed.
+    '''
+    stamp = fileStamp(executablePath)
+    cached = cache['versions'].get((versionCommand, executablePath))
+    if stamp != None and cached != None and cached[0] == stamp:
+        return cached[1]
+    timers = []
+    def started(proc):
+        timer = threading.Timer(timeout, killGroup, [ proc.pid, signal.SIGKILL ])
+        timers.append(timer)
+        timer.start()
+    result = execute(versionCommand, capture=True, started=started)
+    for timer in timers:
+        timer.cancel()
+    if result.exitCode == -signal.SIGKILL:
+        return "killed after " + str(timeout) + " seconds"
+    if stamp != None:
+        cache['versions'][(versionCommand, executablePath)] = (stamp, result.output)
+    return result.output
+
+def probeTools(tools, toolsDir, cache, threads=8, timeout=60):
+    '''
+    Hashes the executable and runs the version command of every tool, by a pool of threads.
+    Returns {toolId: (executable, md5sum, versionFound)}, md5sum being None for executables
+    that cannot be read and versionFound None for tools without a version command.
+    '''
+    def probe(key):
+        toolData = tools.getStanza(key)
+        executable = toolData['name']
+        if 'executable' in toolData:
+            subDirExec = toolData['executable']
+            if os.path.exists(toolsDir+'/'+subDirExec):
+                executable = subDirExec
+        versionFound = None
+        if 'version' in toolData and 'versionCommand' in toolData:
+            versionFound = versionOf(toolData['versionCommand'], toolsDir+'/'+executable, cache,
+                                     timeout)
+        return (key, (executable, md5sumOf(toolsDir+'/'+executable, cache), versionFound))
+
+    pool = ThreadPool(max(threads, 1))
+    try:
+        return dict(pool.map(probe, tools.keys(), 1))
+    finally:
+        pool.close()
+        pool.join()
+
 
 if __name__ == '__main__':
     """
     toolsRaCheck.py v1 - Checks the tools.ra file for consistency.
-    Usage: toolsRaCheck.py [--fixMd5sum] [{tools.ra}]
+    Usage: toolsRaCheck.py [--fixMd5sum] [--threads=N] [--timeout=S] [--recheck] [{tools.ra}]
            --fixMd5sum  Updates md5sums if it is able to
+           --threads=N  Number of tools to check at once (default 8)
+           --timeout=S  Seconds a version command may take (default 60)
+           --recheck    Ignore results cached by earlier runs
            {tools.ra}   File to check.  Default ${EAP_TOOLS_DIR}/tools.ra
     """
 
@@ -64,15 +195,28 @@ if __name__ == '__main__':
     # Get the correct file
     toolDbFile = toolsDir + '/tools.ra'
     fixMd5sum = False
+    recheck = False
+    threads = 8
+    timeout = 60
     for arg in sys.argv[1:]:
         if arg == '-fixMd5sum' or arg == '--fixMd5sum' or arg == '-fix' or arg == '--fix':
             fixMd5sum = True
+        elif arg == '--recheck':
+            recheck = True
+        elif arg.startswith('--threads=') and arg.split('=', 1)[1].isdigit():
+            threads = int(arg.split('=', 1)[1])
+        elif arg.startswith('--timeout=') and arg.split('=', 1)[1].isdigit():
+            timeout = int(arg.split('=', 1)[1])
         elif not arg.startswith('-'):
             toolDbFile = arg
         else: # All other options fall to here
             print "toolsRaCheck.py v1 - Checks the tools.ra file for consistency.\n" + \
-                  "Usage: toolsRaCheck.py [--fixMd5sum] [{tools.ra}]\n" + \
+                  "Usage: toolsRaCheck.py [--fixMd5sum] [--threads=N] [--timeout=S] " + \
+                  "[--recheck] [{tools.ra}]\n" + \
                   "       --fixMd5sum  Updates md5sums if it is able to\n" + \
+                  "       --threads=N  Number of tools to check at once (default 8)\n" + \
+                  "       --timeout=S  Seconds a version command may take (default 60)\n" + \
+                  "       --recheck    Ignore results cached by earlier runs\n" + \
                   "       {tools.ra}   File to check.  Default ${EAP_TOOLS_DIR}/tools.ra"
             sys.exit(1)
     if not os.path.exists(toolDbFile):
@@ -94,6 +238,15 @@ if __name__ == '__main__':
     tools = Stanzas(toolDbFile)
     tools.altIndex('name',unique=False)
 
+    # Hash and run every tool at once, reusing what has not changed since the last run
+    if recheck:
+        cache = newCache()
+    else:
+        cache = loadCache(toolDbFile)
+    probes = probeTools(tools, toolsDir, cache, threads, timeout)
+    saveCache(toolDbFile, cache)
+    fixes = {}
+
     # Tiptoe through tools
     for key in tools.sortedKeys(['name','version','toolId']):
         toolData = tools.getStanza(key)
@@ -112,7 +265,7 @@ if __name__ == '__main__':
         try:
             version = toolData['version']
             versionCommand = toolData['versionCommand']
-            err, versionFound = commands.getstatusoutput(versionCommand)
+            versionFound = probes[key][2]
             if versionFound == version:
                 versionPass = True
             else:
@@ -133,22 +286,19 @@ if __name__ == '__main__':
             pass
 
         # Manage md5sum:
-        executable = name
-        if 'executable' in toolData:
-            subDirExec = toolData['executable']
-            if os.path.exists(toolsDir+'/'+subDirExec):
-                executable = subDirExec
-        err, md5sum = commands.getstatusoutput('md5sum '+toolsDir+'/'+executable + \
-                                               " | awk '{print $1}'")
-        if err != 0 or md5sum != key:
+        executable, md5sum = probes[key][:2]
+        if md5sum != key:
             if name != 'java': # java has problems: it is different exe on different machines
                 okay = False
-                print key + " {:<35}".format(name+' ('+version+')') + " ERROR: " + \
-                      "found md5sum " + md5sum
+                if md5sum == None:
+                    print key + " {:<35}".format(name+' ('+version+')') + " ERROR: " + \
+                          "could not read '" + toolsDir+'/'+executable + "'"
+                else:
+                    print key + " {:<35}".format(name+' ('+version+')') + " ERROR: " + \
+                          "found md5sum " + md5sum
                 # update?
-                if fixMd5sum and updateThisMd5sum:
-                    if replaceLine(toolDbFile,'toolId '+key,'toolId '+md5sum):
-                        updateCount += 1
+                if fixMd5sum and updateThisMd5sum and md5sum != None:
+                    fixes['toolId '+key] = 'toolId '+md5sum
         else:
             md5Pass = True
 
@@ -210,9 +360,22 @@ if __name__ == '__main__':
             errorCount += 1
         checkedCount += 1
 
+    # All fixes in one rewrite
+    if len(fixes) > 0:
+        updateCount = replaceLines(toolDbFile,fixes)
+
     # Final fate
     closingMsg = "--- Tools checked: "+str(checkedCount)+"   In error: " + str(errorCount)
     if fixMd5sum:
         closingMsg += "   Fixed md5sum: "+ str(updateCount) 
     print closingMsg
 
+    # Compile for analyses, which would otherwise each compile it on first use
+    if toolsDb.sqlite3 != None:
+        try:
+            compiled = toolsDb.ToolsDb(toolDbFile)
+            count = compiled.compile()
+            print "--- Compiled " + str(count) + " tools into " + compiled.file
+        except Exception as e:
+            print "--- Could not compile " + toolDbFile + ": " + str(e)
+
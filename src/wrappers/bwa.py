@@ -0,0 +1,30 @@
+#!/usr/bin/env python2.7
+# bwa.py module holds methods for running bwa from a LogicalStep.
+#
+# Runs from (in path) tools dir symlink
+
+import os
+
+def version(step, logOut=True):
+    '''Returns tool version.  Will log to stepLog unless requested not to.'''
+    toolName = __name__.split('.')[-1]
+    return step.getToolVersion(toolName, logOut)
+
+def submitAln(step, refFile, inFastq, outSai, threads=4):
+    '''
+    Launches alignment of one read file without waiting for it, so that both reads of a pair
+    may be aligned at once.  Call step.waitForTools() to collect it.
+    '''
+    cmd = [ 'bwa', 'aln', '-t', str(threads), refFile, inFastq ]
+    toolName = __name__.split('.')[-1] + ' aln ' + os.path.basename(inFastq)
+    return step.submitTool(toolName, cmd, cpus=threads, stdout=outSai)
+
+def sampe(step, refFile, inSai1, inSai2, inFastq1, inFastq2, outSam):
+    '''Pairs the alignments of both reads into a sam.'''
+    cmd = [ 'bwa', 'sampe', refFile, inSai1, inSai2, inFastq1, inFastq2 ]
+    toolName = __name__.split('.')[-1] + ' sampe'
+    step.toolBegins(toolName)
+    step.getToolVersion('bwa', logOut=True)
+
+    step.err = step.runCmd(cmd, logOut=False, stdout=outSam)
+    step.toolEnds(toolName, step.err)
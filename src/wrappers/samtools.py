@@ -14,21 +14,32 @@ def version(step, logOut=True):
 def samToBam(step, inSam, outBam):
     '''Sam to Bam converion.'''
     
-    cmd = 'samtools view -bt {ref} {input} -o {output}'.format( \
-          ref=step.ana.getSetting(step.ana.genome+'ChromInfoFile'), \
-          input=inSam, output=outBam)
+    cmd = [ 'samtools', 'view', '-bt', step.ana.getSetting(step.ana.genome+'ChromInfoFile'),
+            inSam, '-o', outBam ]
           
     toolName = __name__.split('.')[-1] + " samToBam"
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, log=step.log)
+    step.err = step.runCmd(cmd)
+    step.toolEnds(toolName,step.err)
+        
+def samToBamWithHeader(step, inSam, outBam):
+    '''Sam to Bam conversion of a sam that carries its own header.'''
+    
+    cmd = [ 'samtools', 'view', '-S', '-b', inSam ]
+          
+    toolName = __name__.split('.')[-1] + " samToBamWithHeader"
+    step.toolBegins(toolName)
+    step.getToolVersion('samtools',logOut=True)
+
+    step.err = step.runCmd(cmd, logOut=False, stdout=outBam)
     step.toolEnds(toolName,step.err)
         
 def bamSize(step, bam):
     '''Returns size of a bam.'''
     
-    cmd = 'samtools view -c {bam}'.format(bam=bam)
+    cmd = [ 'samtools', 'view', '-c', bam ]
           
     toolName = __name__.split('.')[-1] + " bamSize"
     step.toolBegins(toolName)
@@ -49,19 +60,19 @@ def bamSize(step, bam):
     
     step.toolEnds(toolName,bamSize,raiseError=False) # Return was not an error code
     if step.err != 0:
-        raise StepError(toolName)
+        raise StepError(step, toolName)
     
     return bamSize
 
 def merge(step, inList, outBam):
     '''Mer bams.'''
-    cmd = 'samtools merge -f {output} {inList}'.format(output=outBam, inList=' '.join(inList))
+    cmd = [ 'samtools', 'merge', '-f', outBam ] + inList
           
     toolName = __name__.split('.')[-1] + " merge"
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, log=step.log)
+    step.err = step.runCmd(cmd)
     step.toolEnds(toolName,step.err)
         
 def sort(step, inBam, outBam):
@@ -70,44 +81,44 @@ def sort(step, inBam, outBam):
     # KLUDGE: -f would be the correct option to not have to cut off the filetype, but it does not work correctly in samtools 1.19
     #    and a new version has not been released yet. When the new version of samtools is accepted, we can change this
     #
-    cmd = 'samtools sort {inBam} {outBam}'.format(inBam=inBam, outBam=outBam.replace('.bam', ''))
+    cmd = [ 'samtools', 'sort', inBam, outBam.replace('.bam', '') ]
     # Was working as:
     #cmd = 'samtools sort -o {inBam} tmp > {outBam}'.format(inBam=inBam, outBam=outBam)
     toolName = __name__.split('.')[-1] + ' sort'
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, logOut=False, log=step.log)
+    step.err = step.runCmd(cmd, logOut=False)
     step.toolEnds(toolName, step.err)
     
 def index(step, inBam):
     '''Indexes a sorted bam'''
-    cmd = 'samtools index {inBam}'.format(inBam=inBam)
+    cmd = [ 'samtools', 'index', inBam ]
     toolName = __name__.split('.')[-1] + ' index'
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, log=step.log)
+    step.err = step.runCmd(cmd)
     step.toolEnds(toolName, step.err)
     
 def idxstats(step, inBam, outStats):
     '''Calculates stats for each chromosome in a sorted and indexed bam'''
-    cmd = 'samtools idxstats {inBam} > {outStats}'.format(inBam=inBam, outStats=outStats)
+    cmd = [ 'samtools', 'idxstats', inBam ]
     toolName = __name__.split('.')[-1] + ' idxstats'
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, logOut=False, log=step.log)
+    step.err = step.runCmd(cmd, stdout=outStats)
     step.toolEnds(toolName, step.err)
 
 def header(step, inBam, outHeader):
     '''Outputs header of a bam'''
-    cmd = 'samtools view -H {inBam} > {outHeader}'.format(inBam=inBam, outHeader=outHeader)
+    cmd = [ 'samtools', 'view', '-H', inBam ]
     toolName = __name__.split('.')[-1] + ' header'
     step.toolBegins(toolName)
     step.getToolVersion('samtools',logOut=True)
 
-    step.err = step.ana.runCmd(cmd, logOut=False, log=step.log)
+    step.err = step.runCmd(cmd, stdout=outHeader)
     step.toolEnds(toolName, step.err)
     
     
\ No newline at end of file
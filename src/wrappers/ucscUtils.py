@@ -5,6 +5,8 @@
 # Runs from (in path) tools dir symlinks
 # NOTE: fastqStatsAndSubsample needs to be added to ucscUtils package and symlinked!!!
 
+import os
+
 def version(step, logOut=True, tool=None):
     '''Returns tool version.  Will log to stepLog unless requested not to.'''
     if tool != None:
@@ -20,23 +22,20 @@ def bedGraphToBigWig(step, inBedGraph, outBigWig):
     '''Converts a bedGraph to a bigWig.'''
     
         # "bedGraphToBigWig input.tmp chromLengths output.bigWig"
-    cmd = 'bedGraphToBigWig {bedGraph} {chromInfo} {bigWig}'.format( bedGraph=inBedGraph, \
-          chromInfo=step.ana.getSetting(step.ana.genome+'ChromInfoFile'), \
-          bigWig=outBigWig)
+    cmd = [ 'bedGraphToBigWig', inBedGraph, step.ana.getSetting(step.ana.genome+'ChromInfoFile'),
+            outBigWig ]
           
     toolName = __name__.split('.')[-1] + " bedGraphToBigWig"
     step.toolBegins(toolName)
     step.getToolVersion('bedGraphToBigWig', logOut=True)
 
-    step.err = step.ana.runCmd(cmd, logOut=False, log=step.log)
+    step.err = step.runCmd(cmd, logOut=False)
     step.toolEnds(toolName,step.err)
 
 def fastqStatsAndSubsample(step, inFastq, simpleStats, sampleFastq):
     '''Sample a fastq.'''
     
-    cmd = 'fastqStatsAndSubsample -sampleSize={reads} -seed={seed} {input} {outStats} {outSample}'.format( \
-          reads='{sample}',seed=step.ana.getSetting('fastqSampleSeed', '12345'), \
-          input=inFastq, outStats=simpleStats, outSample=sampleFastq)
+    seed = step.ana.getSetting('fastqSampleSeed', '12345')
     
     sampleSize = int( step.ana.getSetting('fastqSampleReads','100000') )
       
@@ -46,22 +45,33 @@ def fastqStatsAndSubsample(step, inFastq, simpleStats, sampleFastq):
 
     #step.err = step.ana.runCmd(cmd, log=step.log) # stdout goes to file
     while sampleSize >= 40000:
-        step.err = step.ana.runCmd(cmd.format(sample=sampleSize), log=step.log)
+        cmd = [ 'fastqStatsAndSubsample', '-sampleSize=' + str(sampleSize), '-seed=' + seed,
+                inFastq, simpleStats, sampleFastq ]
+        step.err = step.runCmd(cmd)
         if step.err != 65280: # size error
             break;
         sampleSize = sampleSize - 15000
         
     step.toolEnds(toolName,step.err)
     
+def submitSolexaToSangerFastq(step, inFastq, outFastq):
+    '''
+    Launches conversion of a solexa fastq to sanger quality scores without waiting for it.
+    Call step.waitForTools() to collect it.
+    '''
+    cmd = [ 'edwSolexaToSangerFastq', inFastq, outFastq ]
+    toolName = __name__.split('.')[-1] + ' edwSolexaToSangerFastq ' + os.path.basename(inFastq)
+    return step.submitTool(toolName, cmd)
+    
 def edwBamStats(step, inBam, statsRa, outSample, sampleSize):
     '''Bam evaluation statistics.'''
     
-    cmd = 'edwBamStats {bamIn} {raOut} -sampleBed={outBed} -sampleBedSize={size}'.format( \
-          bamIn=inBam, raOut=statsRa, outBed=outSample, size=sampleSize)
+    cmd = [ 'edwBamStats', inBam, statsRa, '-sampleBed=' + outSample,
+            '-sampleBedSize=' + str(sampleSize) ]
       
     toolName = __name__.split('.')[-1] + ' edwBamStats'
     step.toolBegins(toolName)
     step.getToolVersion('edwBamStats', logOut=True)
 
-    step.err = step.ana.runCmd(cmd, log=step.log) # stdout goes to file
+    step.err = step.runCmd(cmd) # stdout goes to file
     step.toolEnds(toolName,step.err)